@@ -3,8 +3,18 @@ eventlet.monkey_patch() # Must be at the very top!
 
 from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
 import os
+import re
 import json
-from datetime import datetime
+import time
+import threading
+import functools
+import random
+import zlib
+import io
+import csv
+import heapq
+from collections import OrderedDict, deque, namedtuple
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import phonenumbers
 from flask_socketio import SocketIO, emit, join_room, leave_room # Added leave_room
@@ -16,28 +26,48 @@ load_dotenv() # Load environment variables from .env file
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+from googleapiclient.http import HttpRequest
+from googleapiclient import discovery_cache
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
 
 # Flask-Login imports
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required
 
 # SQLAlchemy imports for database
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, or_, and_, case, bindparam
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.dialects import postgresql, sqlite
 
 # Twilio imports
 from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
+from twilio.base.exceptions import TwilioRestException
 
 # Google OAuth imports
 from oauthlib.oauth2 import WebApplicationClient
 import requests
+import redis
 import httpx # Added httpx import
 
 from twilio.twiml.messaging_response import MessagingResponse # Import for Twilio webhook
 import tempfile # Added tempfile import
 from flask import Response # Added Response import for TwiML
+from flask import stream_with_context
 
 app = Flask(__name__)
-app.config['SECRET_KEY'] = os.urandom(24) # Replace with a strong, random key in production
+# Session cookies (Flask and Flask-Login) are signed with SECRET_KEY, so every web worker must share it;
+# a per-process random key logs users out whenever a request reaches another worker
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", 1)) # gunicorn -w, see Procfile
+SECRET_KEY = os.environ.get("SECRET_KEY")
+if not SECRET_KEY:
+    if WEB_CONCURRENCY > 1:
+        raise RuntimeError(f"SECRET_KEY must be set when WEB_CONCURRENCY={WEB_CONCURRENCY}: each worker would sign sessions with its own random key.")
+    print("[ERROR] SECRET_KEY is not set; using a random key, sessions will not survive a restart.")
+    SECRET_KEY = os.urandom(24)
+app.config['SECRET_KEY'] = SECRET_KEY
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_URL", 'sqlite:///smssuite.db') # Use DATABASE_URL for PostgreSQL on Render
 print(f"SQLALCHEMY_DATABASE_URI: {app.config['SQLALCHEMY_DATABASE_URI']}") # Diagnostic print
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
@@ -46,7 +76,101 @@ db = SQLAlchemy(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login_page' # Changed to point to the new login route
-socketio = SocketIO(app, cors_allowed_origins="*", logger=False, engineio_logger=False) # Initialize SocketIO with logging
+# Real-time fan-out across processes. With a message queue (Redis), an emit from any web worker or
+# from the bulk send worker reaches sockets connected to every other process. Without one, emits
+# only reach sockets on the emitting process, so the web tier must run a single worker.
+SOCKETIO_MESSAGE_QUEUE = os.environ.get("SOCKETIO_MESSAGE_QUEUE") or os.environ.get("REDIS_URL") # e.g. redis://localhost:6379/0
+SOCKETIO_CHANNEL = os.environ.get("SOCKETIO_CHANNEL", "smssuite") # Queue channel, separates apps sharing one Redis
+# Long-polling needs every request of a session to reach the same worker (sticky sessions), which
+# gunicorn's own worker balancing cannot do; with several workers behind it, use WebSocket only
+SOCKETIO_WEBSOCKET_ONLY = os.environ.get("SOCKETIO_WEBSOCKET_ONLY", "false").lower() == "true"
+if WEB_CONCURRENCY > 1 and not SOCKETIO_MESSAGE_QUEUE:
+    print(f"[ERROR] WEB_CONCURRENCY={WEB_CONCURRENCY} without SOCKETIO_MESSAGE_QUEUE/REDIS_URL: real-time updates will only reach clients on the emitting worker.")
+if WEB_CONCURRENCY > 1 and not SOCKETIO_WEBSOCKET_ONLY:
+    print(f"[ERROR] WEB_CONCURRENCY={WEB_CONCURRENCY} with long-polling enabled: set SOCKETIO_WEBSOCKET_ONLY=true or put the workers behind a sticky-session proxy.")
+socketio = SocketIO(app, cors_allowed_origins="*", logger=False, engineio_logger=False, # Initialize SocketIO with logging
+                    message_queue=SOCKETIO_MESSAGE_QUEUE, channel=SOCKETIO_CHANNEL,
+                    transports=['websocket'] if SOCKETIO_WEBSOCKET_ONLY else None)
+
+SOCKETIO_EMIT_WINDOW_MS = int(os.environ.get("SOCKETIO_EMIT_WINDOW_MS", 150)) # Per-room batching window for bursty emits, 0 emits as soon as the caller yields
+
+# Batches bursty emits per room over a short window. A bulk send or a webhook burst otherwise sends a
+# new_message and a conversation_update per message: within a window, new_message payloads go out as
+# one new_messages array, conversation_update requests are merged (the conversation ids of a user are
+# summarized with one query at flush time, a refresh request absorbs them) and bulk_job_progress keeps
+# the latest summary per job.
+class EmitCoalescer:
+    def __init__(self, window_seconds):
+        self.window_seconds = window_seconds
+        self._pending = {} # room -> {'new_messages': [...], 'conversation_ids': {id: None}, 'refresh': bool, 'jobs': {id: summary}}
+        self._lock = threading.Lock()
+        self.stats = {'queued': 0, 'emitted': 0, 'coalesced': 0, 'summary_queries': 0}
+
+    def queue(self, event_name, payload, room):
+        # conversation_update payloads carry conversation_ids (or refresh); the summaries are read when
+        # emitting. Flushes always run in their own greenlet, even with a zero window, so the summary
+        # query never adds to the latency of the request (e.g. the Twilio webhook) that queued it.
+        with self._lock:
+            pending = self._pending.get(room)
+            if pending is None:
+                pending = self._pending[room] = {'new_messages': [], 'conversation_ids': {}, 'refresh': False, 'jobs': {}, 'user_id': None, 'queued': 0}
+                eventlet.spawn_after(self.window_seconds, self.flush, room)
+            pending['queued'] += 1
+            if event_name == 'new_messages':
+                pending['new_messages'].append(payload)
+            elif event_name == 'conversation_update':
+                pending['user_id'] = payload['user_id']
+                pending['refresh'] = pending['refresh'] or payload.get('refresh', False)
+                pending['conversation_ids'].update(dict.fromkeys(payload.get('conversation_ids', ())))
+            elif event_name == 'bulk_job_progress':
+                pending['jobs'][payload['id']] = payload
+            else:
+                raise ValueError(f"Event {event_name} cannot be coalesced")
+
+    def flush(self, room):
+        with self._lock:
+            pending = self._pending.pop(room, None)
+        if not pending:
+            return
+        events = []
+        if pending['new_messages']:
+            events.append(('new_messages', pending['new_messages']))
+        if pending['refresh']:
+            events.append(('conversation_update', {'user_id': pending['user_id'], 'refresh': True}))
+        elif pending['conversation_ids']:
+            events.append(('conversation_update', self._conversation_update(pending['user_id'], list(pending['conversation_ids']))))
+        events.extend(('bulk_job_progress', job) for job in pending['jobs'].values())
+        self._count(pending['queued'], len(events))
+        for event_name, payload in events:
+            try:
+                socketio.emit(event_name, payload, room=room)
+            except Exception as e:
+                print(f"[ERROR] Failed to emit {event_name} to room {room}: {e}")
+
+    def _conversation_update(self, user_id, conversation_ids):
+        # One summary query for every conversation of the user that changed in the window; if it
+        # fails, the client is told to refetch its list instead
+        with self._lock:
+            self.stats['summary_queries'] += 1
+        try:
+            with app.app_context():
+                return {'user_id': user_id, 'conversations': conversation_summaries(user_id, conversation_ids)}
+        except Exception as e:
+            print(f"[ERROR] Failed to read conversation summaries for user {user_id}: {e}")
+            return {'user_id': user_id, 'refresh': True}
+
+    def _count(self, queued, emitted):
+        with self._lock:
+            self.stats['queued'] += queued
+            self.stats['emitted'] += emitted
+            self.stats['coalesced'] += queued - emitted
+
+socketio_emits = EmitCoalescer(SOCKETIO_EMIT_WINDOW_MS / 1000)
+
+@app.context_processor
+def inject_socketio_client_options():
+    # Passed to io() in the page scripts, so the client only tries the transports the server accepts
+    return {'socketio_client_options': {'transports': ['websocket']} if SOCKETIO_WEBSOCKET_ONLY else {}}
 
 # User model for Flask-Login
 class User(UserMixin, db.Model):
@@ -59,6 +183,7 @@ class User(UserMixin, db.Model):
     twilio_account_sid = db.Column(db.String(100), nullable=True)
     twilio_auth_token = db.Column(db.String(100), nullable=True)
     twilio_phone_number = db.Column(db.String(20), nullable=True, unique=True)
+    twilio_history_synced_at = db.Column(db.DateTime, nullable=True) # Newest imported Twilio date_sent (import watermark)
 
 # Contact model
 class Contact(db.Model):
@@ -77,11 +202,23 @@ class Conversation(db.Model):
     start_time = db.Column(db.DateTime, default=datetime.utcnow)
     last_read_timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=True) # New field
     last_activity_time = db.Column(db.DateTime, default=datetime.utcnow, nullable=False) # New field
+    # Conversation list summary, maintained by insert_messages and mark_conversation_as_read;
+    # `python maintenance.py summaries` checks and rebuilds it from the messages
+    unread_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_message_body = db.Column(db.Text, nullable=True)
+    last_message_at = db.Column(db.DateTime, nullable=True)
+    archived_through = db.Column(db.DateTime, nullable=True) # Newest archived message; NULL if nothing is archived
 
     # Relationships
     contact = db.relationship('Contact', backref=db.backref('conversations', lazy=True), lazy=True)
     messages = db.relationship('Message', backref='conversation', lazy=True, order_by='Message.timestamp')
 
+    # Indexes for the hot access paths; existing databases get them through migrate.py
+    __table_args__ = (
+        db.Index('ix_conversation_user_activity', 'user_id', 'last_activity_time'), # Conversation list ordering
+        db.Index('ix_conversation_user_contact', 'user_id', 'contact_id'), # Conversation lookup by contact
+    )
+
 # Message model
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -89,38 +226,309 @@ class Message(db.Model):
     sender = db.Column(db.String(50), nullable=False) # e.g., 'user' or 'contact'
     body = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    provider_sid = db.Column(db.String(64), nullable=True) # Twilio MessageSid, NULL for messages stored before it was kept
+
+    __table_args__ = (
+        db.Index('ix_message_conversation_timestamp', 'conversation_id', 'timestamp', 'id'), # History and last message
+        db.Index('ix_message_conversation_sender_timestamp', 'conversation_id', 'sender', 'timestamp'), # Unread counts
+        db.Index('ix_message_provider_sid', 'provider_sid', unique=True), # Dedupe of webhook retries and imports
+    )
+
+# Cold storage for old messages: `python maintenance.py archive` moves them out of the message table
+# into zlib-compressed segments of up to MESSAGE_ARCHIVE_SEGMENT_SIZE messages of one conversation.
+# The message history API reads them back only when a page reaches that far back.
+class MessageArchiveSegment(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
+    first_timestamp = db.Column(db.DateTime, nullable=False) # (timestamp, id) of the oldest message in the segment
+    first_message_id = db.Column(db.Integer, nullable=False)
+    last_timestamp = db.Column(db.DateTime, nullable=False) # (timestamp, id) of the newest message in the segment
+    last_message_id = db.Column(db.Integer, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    messages = db.Column(db.LargeBinary, nullable=False) # zlib-compressed JSON, see _pack_archive_segment
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_message_archive_segment_conversation_last', 'conversation_id', 'last_timestamp', 'last_message_id'), # Paging back
+        db.Index('ix_message_archive_segment_conversation_first', 'conversation_id', 'first_timestamp', 'first_message_id'), # Paging forward
+    )
+
+# Bulk send job model: one row per templated bulk send, drained by the worker process
+class BulkSendJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    sheet_id = db.Column(db.String(200), nullable=True)
+    message_template = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending') # 'pending', 'running', 'completed'
+    total_count = db.Column(db.Integer, nullable=False, default=0)
+    sent_count = db.Column(db.Integer, nullable=False, default=0)
+    failed_count = db.Column(db.Integer, nullable=False, default=0)
+    skipped_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    items = db.relationship('BulkSendItem', backref='job', lazy=True, order_by='BulkSendItem.row_index')
+
+# Bulk send work item: one row per sheet row, claimed by workers with SKIP LOCKED
+class BulkSendItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('bulk_send_job.id'), nullable=False)
+    row_index = db.Column(db.Integer, nullable=False)
+    phone_number = db.Column(db.String(50), nullable=True)
+    contact_name = db.Column(db.String(100), nullable=True)
+    label = db.Column(db.String(200), nullable=True) # Name (or phone) shown in the job results
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending') # 'pending', 'sending', 'sent', 'failed', 'skipped'
+    result = db.Column(db.Text, nullable=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    processed_at = db.Column(db.DateTime, nullable=True)
+    provider_sid = db.Column(db.String(64), nullable=True) # Twilio MessageSid once the send went out
+
+    __table_args__ = (
+        db.Index('ix_bulk_send_item_status_id', 'status', 'id'), # Worker claims
+        db.Index('ix_bulk_send_item_job_status', 'job_id', 'status'), # Job progress
+        db.Index('ix_bulk_send_item_job_status_id', 'job_id', 'status', 'id'), # Per-job claims
+    )
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Served from user_cache as a detached snapshot: authenticating a request or socket event does
+    # not read the users table. Code that changes a user loads it with db.session.get and calls
+    # invalidate_user after the commit.
+    user_id = int(user_id)
+    values = user_cache.get(user_id)
+    if values is None:
+        user = db.session.get(User, user_id)
+        if user is not None:
+            user_cache.put(user_id, {column.key: getattr(user, column.key) for column in User.__table__.columns})
+        return user
+    user = User(**values)
+    make_transient_to_detached(user) # Not attached to the session, so changes to it are never flushed
+    return user
+
+def invalidate_user(user_id):
+    user_cache.pop(user_id)
 
 # Configuration for Google Sheets API
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly', 'https://www.googleapis.com/auth/drive.readonly', 'https://www.googleapis.com/auth/userinfo.profile', 'https://www.googleapis.com/auth/userinfo.email', 'openid']
 GOOGLE_SHEET_ID = os.environ.get("GOOGLE_SHEET_ID", 'YOUR_GOOGLE_SHEET_ID') # TODO: Replace with your actual Google Sheet ID
 GOOGLE_SHEET_RANGE = os.environ.get("GOOGLE_SHEET_RANGE", 'Sheet1!A:C') # TODO: Adjust range as needed (e.g., Name, Phone, Group)
+GOOGLE_SERVICE_CACHE_SIZE = int(os.environ.get("GOOGLE_SERVICE_CACHE_SIZE", 256)) # Max cached Sheets/Drive service objects
+GOOGLE_SERVICE_CACHE_TTL = int(os.environ.get("GOOGLE_SERVICE_CACHE_TTL", 1800)) # Seconds before a cached service is rebuilt
+SHEET_DATA_CACHE_SIZE = int(os.environ.get("SHEET_DATA_CACHE_SIZE", 64)) # Max cached spreadsheets (across users)
+SHEET_DATA_REVALIDATE_SECONDS = int(os.environ.get("SHEET_DATA_REVALIDATE_SECONDS", 30)) # Serve cached sheet data without re-checking Drive modifiedTime for this long
+SHEET_PREVIEW_ROWS = int(os.environ.get("SHEET_PREVIEW_ROWS", 100)) # Rows fetched for the sheet preview
+SHEET_READ_CHUNK_SIZE = int(os.environ.get("SHEET_READ_CHUNK_SIZE", 1000)) # Rows per chunk when streaming a sheet to the bulk sender
+
+# Bulk send worker configuration
+CONTACT_UPSERT_BATCH_SIZE = int(os.environ.get("CONTACT_UPSERT_BATCH_SIZE", 1000)) # Contacts prefetched/upserted per statement
+BULK_SEND_BATCH_SIZE = int(os.environ.get("BULK_SEND_BATCH_SIZE", 50)) # Rows claimed (and sent concurrently) per worker iteration
+BULK_SEND_LEASE_SECONDS = int(os.environ.get("BULK_SEND_LEASE_SECONDS", 300)) # Claimed rows older than this are requeued
+BULK_SEND_POLL_SECONDS = float(os.environ.get("BULK_SEND_POLL_SECONDS", 2)) # Idle sleep between queue polls
+
+# Outbound dispatcher configuration (every send path goes through it)
+OUTBOUND_CONCURRENCY = int(os.environ.get("OUTBOUND_CONCURRENCY", 16)) # Twilio send requests in flight at once, across all numbers
+OUTBOUND_MAX_PENDING = int(os.environ.get("OUTBOUND_MAX_PENDING", 500)) # Queued sends before callers block (backpressure)
+OUTBOUND_DEFAULT_MPS = float(os.environ.get("OUTBOUND_DEFAULT_MPS", 1)) # Messages per second per sending number (Twilio long code limit); 0 disables
+OUTBOUND_NUMBER_MPS = os.environ.get("OUTBOUND_NUMBER_MPS", "") # Per-number overrides, e.g. "+18005550100=3,+15005550006=10"
+OUTBOUND_RATE_LIMIT_REDIS = os.environ.get("OUTBOUND_RATE_LIMIT_REDIS") or os.environ.get("REDIS_URL") # Shares each number's rate between all sending processes
+OUTBOUND_RATE_LIMIT_PREFIX = os.environ.get("OUTBOUND_RATE_LIMIT_PREFIX", "smssuite:outbound-rate") # Redis key prefix of the shared buckets
+if WEB_CONCURRENCY > 1 and not OUTBOUND_RATE_LIMIT_REDIS:
+    print(f"[ERROR] WEB_CONCURRENCY={WEB_CONCURRENCY} without OUTBOUND_RATE_LIMIT_REDIS/REDIS_URL: every worker will send at each number's full rate.")
+OUTBOUND_MAX_RETRIES = int(os.environ.get("OUTBOUND_MAX_RETRIES", 4)) # Retries of a send rejected with 429 or 5xx
+OUTBOUND_RETRY_BASE_SECONDS = float(os.environ.get("OUTBOUND_RETRY_BASE_SECONDS", 1)) # First retry backoff, doubled per attempt (full jitter)
+OUTBOUND_RETRY_MAX_SECONDS = float(os.environ.get("OUTBOUND_RETRY_MAX_SECONDS", 30)) # Backoff ceiling
 
 # Twilio Configuration
 # TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID", None) # TODO: Replace with your actual Twilio Account SID
 # TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN", None) # TODO: Replace with your actual Twilio Auth Token
 # TWILIO_PHONE_NUMBER = os.environ.get("TWILIO_PHONE_NUMBER", None) # TODO: Replace with your actual Twilio Phone Number
 
+TWILIO_IMPORT_PAGE_SIZE = int(os.environ.get("TWILIO_IMPORT_PAGE_SIZE", 1000)) # Messages per Twilio page during history import
+RECENT_MESSAGE_SID_CACHE_SIZE = int(os.environ.get("RECENT_MESSAGE_SID_CACHE_SIZE", 100000)) # Recently stored MessageSids kept in memory
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10000)) # Logged-in users kept in memory by load_user
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 30)) # Seconds before a cached user is re-read, bounds staleness across processes
+WEBHOOK_ROUTE_CACHE_SIZE = int(os.environ.get("WEBHOOK_ROUTE_CACHE_SIZE", 50000)) # (user, contact number) -> conversation routes kept in memory
+WEBHOOK_ROUTE_TTL = int(os.environ.get("WEBHOOK_ROUTE_TTL", 300)) # Seconds before a route is re-read, bounds staleness across processes
+WEBHOOK_WRITE_MODE = os.environ.get("WEBHOOK_WRITE_MODE", "sync").lower() # sync: commit per message; group: batched commits, reply once durable; ack: reply first, persist in the next batch
+if WEBHOOK_WRITE_MODE not in ('sync', 'group', 'ack'):
+    print(f"[ERROR] Unknown WEBHOOK_WRITE_MODE={WEBHOOK_WRITE_MODE}, using sync.")
+    WEBHOOK_WRITE_MODE = 'sync'
+WEBHOOK_FLUSH_MS = float(os.environ.get("WEBHOOK_FLUSH_MS", 5)) # Group commit: longest a buffered inbound message waits for its batch
+WEBHOOK_FLUSH_MAX_BATCH = int(os.environ.get("WEBHOOK_FLUSH_MAX_BATCH", 200)) # Group commit: a batch this large is flushed at once
+MESSAGE_PAGE_SIZE = int(os.environ.get("MESSAGE_PAGE_SIZE", 50)) # Default messages per history page
+MESSAGE_PAGE_SIZE_MAX = int(os.environ.get("MESSAGE_PAGE_SIZE_MAX", 500)) # Largest page a client may request
+MESSAGE_ARCHIVE_AFTER_DAYS = int(os.environ.get("MESSAGE_ARCHIVE_AFTER_DAYS", 180)) # Messages older than this are moved to the archive by maintenance.py
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 1000)) # Rows fetched from the database cursor and written to the response at a time
+MESSAGE_ARCHIVE_SEGMENT_SIZE = int(os.environ.get("MESSAGE_ARCHIVE_SEGMENT_SIZE", 500)) # Messages per compressed archive segment
+PHONE_NUMBER_CACHE_SIZE = int(os.environ.get("PHONE_NUMBER_CACHE_SIZE", 50000)) # Max memoized E.164 normalizations
+TWILIO_CLIENT_POOL_SIZE = int(os.environ.get("TWILIO_CLIENT_POOL_SIZE", 64)) # Max cached Twilio clients (one per account credentials)
+
 # Google OAuth Configuration
 GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID", None)
 GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_CLIENT_SECRET", None)
-GOOGLE_DISCOVERY_URL = (
-    "https://accounts.google.com/.well-known/openid-configuration"
+GOOGLE_DISCOVERY_URL = os.environ.get(
+    "GOOGLE_DISCOVERY_URL", "https://accounts.google.com/.well-known/openid-configuration"
 )
+GOOGLE_DISCOVERY_DEFAULT_MAX_AGE = int(os.environ.get("GOOGLE_DISCOVERY_DEFAULT_MAX_AGE", 3600)) # Used when the response has no max-age
+GOOGLE_DISCOVERY_STALE_SECONDS = int(os.environ.get("GOOGLE_DISCOVERY_STALE_SECONDS", 86400)) # Used when the response has no stale-while-revalidate
 
 # OAuth 2 client setup
 client = WebApplicationClient(GOOGLE_CLIENT_ID)
 
+# Shared, connection-pooled HTTP client for all Google OAuth traffic (discovery, token, userinfo)
+google_http_client = httpx.Client(
+    timeout=httpx.Timeout(10.0),
+    limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+)
+
+def _parse_cache_control(header_value):
+    directives = {}
+    for part in (header_value or '').split(','):
+        name, _, value = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"')
+    return directives
+
+# Process-wide cache of the OpenID discovery document. Fresh entries are served directly,
+# stale ones are served while a single background refresh runs, and only a cold (or fully
+# expired) cache makes callers wait. Concurrent cold callers share one outbound request.
+class DiscoveryDocumentCache:
+    def __init__(self, url, http_client):
+        self.url = url
+        self.http_client = http_client
+        self._document = None
+        self._fresh_until = 0
+        self._stale_until = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        with self._lock:
+            document = self._document
+            if document is not None and now < self._fresh_until:
+                return document
+            if document is not None and now < self._stale_until:
+                if not self._refreshing:
+                    self._refreshing = True
+                    eventlet.spawn_n(self._background_refresh)
+                return document
+
+        with self._fetch_lock:
+            # Another caller may have refreshed the document while we waited
+            with self._lock:
+                if self._document is not None and time.monotonic() < self._fresh_until:
+                    return self._document
+            return self._fetch()
+
+    def _background_refresh(self):
+        try:
+            with self._fetch_lock:
+                self._fetch()
+        except Exception as e:
+            print(f"Error refreshing Google discovery document, serving stale copy: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _fetch(self):
+        response = self.http_client.get(self.url)
+        response.raise_for_status()
+        document = response.json()
+
+        directives = _parse_cache_control(response.headers.get('Cache-Control'))
+        if 'no-store' in directives or 'no-cache' in directives:
+            # Not cacheable (we never revalidate, so no-cache is handled like no-store): forget any
+            # earlier copy, so every caller fetches the document itself
+            with self._lock:
+                self._document = None
+                self._fresh_until = self._stale_until = 0
+            return document
+        max_age = int(directives.get('max-age') or GOOGLE_DISCOVERY_DEFAULT_MAX_AGE)
+        max_age = max(max_age - int(response.headers.get('Age') or 0), 0)
+        stale_seconds = int(directives.get('stale-while-revalidate') or GOOGLE_DISCOVERY_STALE_SECONDS)
+
+        now = time.monotonic()
+        with self._lock:
+            self._document = document
+            self._fresh_until = now + max_age
+            self._stale_until = now + max_age + stale_seconds
+        return document
+
+google_discovery_cache = DiscoveryDocumentCache(GOOGLE_DISCOVERY_URL, google_http_client)
+
+# Small thread/greenlet-safe LRU cache with an optional TTL, shared by the in-process caches below
+class LRUCache:
+    def __init__(self, max_size, ttl_seconds=None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at is not None and time.monotonic() > expires_at:
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._entries.pop(key, None)
+        return item[1] if item else None
+
+    def invalidate(self, predicate):
+        # Remove every entry whose key matches predicate(key)
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
 # Before the first request, create database tables
 # @app.before_first_request # DEPRECATED IN FLASK 2.3+
 # def create_tables():
 #     db.create_all()
 
-# Helper to format phone numbers
+# Helper to format phone numbers. Parsing/validating with phonenumbers is expensive and the same
+# numbers come up constantly (webhooks, bulk sends, imports), so results are memoized.
 def format_phone_number_e164(phone_number, default_region="US"):
+    try:
+        return _format_phone_number_e164_cached(phone_number, default_region)
+    except TypeError: # Unhashable input, format without caching
+        return _format_phone_number_e164(phone_number, default_region)
+
+# Batch variant for a whole sheet column or import page: each distinct value is formatted once
+def format_phone_numbers_e164(phone_numbers, default_region="US"):
+    formatted = {}
+    results = []
+    for phone_number in phone_numbers:
+        if phone_number not in formatted:
+            formatted[phone_number] = format_phone_number_e164(phone_number, default_region)
+        results.append(formatted[phone_number])
+    return results
+
+def _format_phone_number_e164(phone_number, default_region="US"):
     try:
         parsed_number = phonenumbers.parse(phone_number, default_region)
         if phonenumbers.is_valid_number(parsed_number):
@@ -135,6 +543,8 @@ def format_phone_number_e164(phone_number, default_region="US"):
         pass # Fallback to original if parsing fails
     return phone_number # Return original if cannot format
 
+_format_phone_number_e164_cached = functools.lru_cache(maxsize=PHONE_NUMBER_CACHE_SIZE)(_format_phone_number_e164)
+
 def get_or_create_contact_and_conversation(raw_phone_number, user_id, contact_name_hint=None):
     print(f"[DEBUG] get_or_create_contact_and_conversation called for raw_phone_number: {raw_phone_number}, user_id: {user_id}, contact_name_hint: {contact_name_hint}")
     phone_number_e164 = format_phone_number_e164(raw_phone_number)
@@ -170,53 +580,614 @@ def get_or_create_contact_and_conversation(raw_phone_number, user_id, contact_na
         print(f"[DEBUG] Found existing Conversation: ID {conversation.id}, Contact ID {conversation.contact_id}")
     
     db.session.commit() # Commit contact and conversation creation/updates here
+    webhook_routes.remember_conversation(user_id, phone_number_e164, conversation.id)
 
     return contact, conversation
 
-def send_sms(to_number, message_body, conversation_id=None):
-    # Use current_user's Twilio credentials
-    if not current_user.is_authenticated or \
-       not current_user.twilio_account_sid or \
-       not current_user.twilio_auth_token or \
-       not current_user.twilio_phone_number:
-        error_message = "Twilio credentials not configured for your account. Please go to Settings to configure."
-        print(f"Error sending SMS: {error_message}")
-        return False, error_message
+# In-process routing for inbound webhooks: Twilio number -> user id and (user id, contact number)
+# -> conversation id. A reply in an existing conversation then needs no lookups at all, just the
+# message insert and one commit. Only positive routes are cached; unknown numbers take the slow
+# path, which records the route it creates. Entries expire after WEBHOOK_ROUTE_TTL so changes made
+# by another process are picked up.
+class WebhookRoutingTable:
+    def __init__(self, max_size, ttl_seconds):
+        self._users = LRUCache(max_size, ttl_seconds) # Twilio number -> user id
+        self._conversations = LRUCache(max_size, ttl_seconds) # (user id, contact number) -> conversation id
+        self._warmed = False
+        self._warm_lock = threading.Lock()
+
+    def warm(self):
+        # Preload routes for every configured number and the most recently active conversations
+        users = db.session.query(User.twilio_phone_number, User.id).filter(User.twilio_phone_number.isnot(None)).all()
+        conversations = db.session.query(Conversation.user_id, Contact.phone_number, Conversation.id).join(
+            Contact, Conversation.contact_id == Contact.id
+        ).order_by(Conversation.last_activity_time.desc()).limit(self._conversations.max_size).all()
+        for twilio_number, user_id in users:
+            self._users.put(twilio_number, user_id)
+        for user_id, phone_number, conversation_id in reversed(conversations): # Most active last, so evicted last
+            self._conversations.put((user_id, phone_number), conversation_id)
+        self._warmed = True
+        print(f"[DEBUG] Webhook routing table warmed with {len(users)} numbers and {len(conversations)} conversations.")
+
+    def _ensure_warm(self):
+        if self._warmed:
+            return
+        with self._warm_lock:
+            if not self._warmed:
+                try:
+                    self.warm()
+                except Exception as e:
+                    self._warmed = True # Fall back to filling routes on demand
+                    print(f"[ERROR] Could not warm webhook routing table: {e}")
+
+    def user_for(self, twilio_number):
+        self._ensure_warm()
+        return self._users.get(twilio_number)
+
+    def conversation_for(self, user_id, contact_number):
+        self._ensure_warm()
+        return self._conversations.get((user_id, contact_number))
+
+    def remember_user(self, twilio_number, user_id):
+        if twilio_number:
+            self._users.put(twilio_number, user_id)
+
+    def remember_conversation(self, user_id, contact_number, conversation_id):
+        if contact_number:
+            self._conversations.put((user_id, contact_number), conversation_id)
+
+    def forget_user(self, twilio_number):
+        # Called when a user's Twilio number changes
+        self._users.pop(twilio_number)
+
+    def invalidate_conversation(self, user_id, contact_number):
+        self._conversations.pop((user_id, contact_number))
+
+    def clear(self):
+        # Drop every route without re-warming; routes are filled again on demand
+        self._users.clear()
+        self._conversations.clear()
+        self._warmed = True
+
+webhook_routes = WebhookRoutingTable(WEBHOOK_ROUTE_CACHE_SIZE, WEBHOOK_ROUTE_TTL)
+
+# Recently stored provider message SIDs. A Twilio retry of a message we already stored is
+# rejected from memory without touching the database; the unique index on Message.provider_sid
+# catches anything older than the cache.
+recent_message_sids = LRUCache(RECENT_MESSAGE_SID_CACHE_SIZE)
+
+# Column values of recently loaded users, by id (see load_user)
+user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+def is_known_message_sid(message_sid):
+    return bool(message_sid) and recent_message_sids.get(message_sid) is not None
+
+def insert_messages(rows):
+    # Shared write path for inbound (webhook), imported and outbound messages. Rows are dicts of
+    # Message columns; rows whose provider_sid is already stored are skipped. The conversations'
+    # last_activity_time and list summary are updated in the same transaction. Returns the inserted
+    # rows. Does not commit; SIDs enter the recent filter once the commit succeeds.
+    rows = [row for row in rows if not is_known_message_sid(row.get('provider_sid'))]
+    if not rows:
+        return []
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        statement = postgresql.insert(Message.__table__).on_conflict_do_nothing(index_elements=['provider_sid'])
+    elif dialect == 'sqlite':
+        statement = sqlite.insert(Message.__table__).on_conflict_do_nothing(index_elements=['provider_sid'])
+    else:
+        statement = Message.__table__.insert()
+    columns = Message.__table__.c
+    statement = statement.returning(columns.id, columns.provider_sid, columns.conversation_id, columns.sender, columns.body, columns.timestamp)
+    inserted = db.session.execute(statement, rows).all()
+    if inserted:
+        db.session.execute(_conversation_summary_update, [{
+            'b_conversation_id': message.conversation_id,
+            'b_sender': message.sender,
+            'b_body': message.body,
+            'b_timestamp': message.timestamp
+        } for message in inserted])
+
+    pending = db.session.info.setdefault('pending_message_sids', set())
+    pending.update(row['provider_sid'] for row in rows if row.get('provider_sid'))
+    return inserted
+
+def _build_conversation_summary_update():
+    # Folds one new message into its conversation: unread if it is from the contact and newer than
+    # the last read, last message if it is the newest. Run once per message (executemany); SET
+    # expressions see the row as it was before the statement, so the CASEs agree with each other.
+    table = Conversation.__table__
+    timestamp = bindparam('b_timestamp', type_=db.DateTime)
+    is_newest = or_(table.c.last_message_at.is_(None), table.c.last_message_at <= timestamp)
+    is_unread = and_(bindparam('b_sender', type_=db.String) == 'contact',
+                     timestamp > db.func.coalesce(table.c.last_read_timestamp, datetime(1970, 1, 1)))
+    return table.update().where(table.c.id == bindparam('b_conversation_id')).values(
+        unread_count=table.c.unread_count + case((is_unread, 1), else_=0),
+        last_message_body=case((is_newest, bindparam('b_body', type_=db.Text)), else_=table.c.last_message_body),
+        last_message_at=case((is_newest, timestamp), else_=table.c.last_message_at),
+        last_activity_time=case((table.c.last_activity_time < timestamp, timestamp), else_=table.c.last_activity_time)
+    )
+
+_conversation_summary_update = _build_conversation_summary_update()
+
+def conversation_summary_repair(min_conversation_id=None, max_conversation_id=None, user_id=None):
+    # (mismatch condition, values) recomputing unread_count, last_message_body and last_message_at from
+    # the messages themselves, for the consistency checker and the migration backfill
+    table = Conversation.__table__
+    messages = Message.__table__
+    last_message = db.select(messages.c.body, messages.c.timestamp).where(
+        messages.c.conversation_id == table.c.id
+    ).order_by(messages.c.timestamp.desc(), messages.c.id.desc()).limit(1)
+    unread_count = db.select(db.func.count(messages.c.id)).where(
+        messages.c.conversation_id == table.c.id,
+        messages.c.sender == 'contact',
+        messages.c.timestamp > db.func.coalesce(table.c.last_read_timestamp, datetime(1970, 1, 1))
+    ).scalar_subquery()
+    last_message_body = last_message.with_only_columns(messages.c.body).scalar_subquery()
+    last_message_at = last_message.with_only_columns(messages.c.timestamp).scalar_subquery()
+
+    criteria = [or_(
+        table.c.unread_count != unread_count,
+        table.c.last_message_at.is_distinct_from(last_message_at),
+        table.c.last_message_body.is_distinct_from(last_message_body)
+    )]
+    if min_conversation_id is not None:
+        criteria.append(table.c.id >= min_conversation_id)
+    if max_conversation_id is not None:
+        criteria.append(table.c.id <= max_conversation_id)
+    if user_id is not None:
+        criteria.append(table.c.user_id == user_id)
+    values = {'unread_count': unread_count, 'last_message_body': last_message_body, 'last_message_at': last_message_at}
+    return and_(*criteria), values
+
+def rebuild_conversation_summaries(min_conversation_id=None, max_conversation_id=None, user_id=None, dry_run=False):
+    # Consistency check of the materialized conversation summaries; fixes every mismatch unless dry_run.
+    # Returns the ids of the conversations that were (or would be) corrected.
+    mismatch, values = conversation_summary_repair(min_conversation_id, max_conversation_id, user_id)
+    table = Conversation.__table__
+    conversation_ids = [conversation_id for (conversation_id,) in db.session.execute(db.select(table.c.id).where(mismatch))]
+    if conversation_ids and not dry_run:
+        db.session.execute(table.update().where(table.c.id.in_(conversation_ids)).values(**values))
+    return conversation_ids
+
+# A message read back from an archive segment; has the Message attributes the history API uses
+ArchivedMessage = namedtuple('ArchivedMessage', ['id', 'sender', 'body', 'timestamp', 'provider_sid'])
+
+def _pack_archive_segment(messages):
+    rows = [[m.id, m.sender, m.body, m.timestamp.isoformat(), m.provider_sid] for m in messages]
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode(), 9)
+
+def _unpack_archive_segment(segment):
+    return [ArchivedMessage(message_id, sender, body, datetime.fromisoformat(timestamp), provider_sid)
+            for message_id, sender, body, timestamp, provider_sid in json.loads(zlib.decompress(segment.messages))]
+
+def archive_messages(cutoff, min_conversation_id=None, max_conversation_id=None, user_id=None, segment_size=None):
+    # Move messages older than cutoff into compressed per-conversation segments. A conversation's
+    # newest message and its unread messages stay in the message table, so the materialized summaries
+    # and last activity times still match what is stored there. Does not commit.
+    # Returns (messages archived, segments written).
+    segment_size = segment_size or MESSAGE_ARCHIVE_SEGMENT_SIZE
+    eligible = [
+        Message.timestamp < cutoff,
+        Message.timestamp < Conversation.last_message_at, # Keep the newest message
+        or_(Message.sender != 'contact', Message.timestamp <= db.func.coalesce(Conversation.last_read_timestamp, datetime(1970, 1, 1))),
+    ]
+    if min_conversation_id is not None:
+        eligible.append(Conversation.id >= min_conversation_id)
+    if max_conversation_id is not None:
+        eligible.append(Conversation.id <= max_conversation_id)
+    if user_id is not None:
+        eligible.append(Conversation.user_id == user_id)
+
+    archived = segments = 0
+    conversation_ids = [conversation_id for (conversation_id,) in db.session.query(Message.conversation_id).join(
+        Conversation, Conversation.id == Message.conversation_id).filter(*eligible).distinct()]
+    for conversation_id in conversation_ids:
+        newest = None
+        while True:
+            # One segment at a time, oldest first; archived rows are deleted so the next query starts after them
+            messages = Message.query.join(Conversation, Conversation.id == Message.conversation_id).filter(
+                Message.conversation_id == conversation_id, *eligible
+            ).order_by(Message.timestamp, Message.id).limit(segment_size).all()
+            if not messages:
+                break
+            db.session.add(MessageArchiveSegment(
+                conversation_id=conversation_id,
+                first_timestamp=messages[0].timestamp, first_message_id=messages[0].id,
+                last_timestamp=messages[-1].timestamp, last_message_id=messages[-1].id,
+                message_count=len(messages), messages=_pack_archive_segment(messages)
+            ))
+            Message.query.filter(Message.id.in_([m.id for m in messages])).delete(synchronize_session=False)
+            for message in messages:
+                db.session.expunge(message) # Deleted in bulk; keep them out of the identity map
+            newest = max(newest or messages[-1].timestamp, messages[-1].timestamp)
+            archived += len(messages)
+            segments += 1
+        if newest:
+            Conversation.query.filter(Conversation.id == conversation_id, or_(
+                Conversation.archived_through.is_(None), Conversation.archived_through < newest
+            )).update({Conversation.archived_through: newest}, synchronize_session=False)
+    return archived, segments
+
+def archived_messages_page(conversation_id, limit, before=None, after=None):
+    # Up to limit archived messages next to a (timestamp, id) cursor: older than before (newest first,
+    # also when before is None) or newer than after (oldest first). Segments are decompressed only
+    # until the page is certain, so a page costs one or two segments however large the archive is.
+    if after:
+        segments = MessageArchiveSegment.query.filter(
+            MessageArchiveSegment.conversation_id == conversation_id,
+            db.tuple_(MessageArchiveSegment.last_timestamp, MessageArchiveSegment.last_message_id) > after
+        ).order_by(MessageArchiveSegment.first_timestamp, MessageArchiveSegment.first_message_id)
+        boundary = lambda segment: (segment.first_timestamp, segment.first_message_id)
+        in_page = lambda key: key > after
+    else:
+        segments = MessageArchiveSegment.query.filter(MessageArchiveSegment.conversation_id == conversation_id)
+        if before:
+            segments = segments.filter(db.tuple_(MessageArchiveSegment.first_timestamp, MessageArchiveSegment.first_message_id) < before)
+        segments = segments.order_by(MessageArchiveSegment.last_timestamp.desc(), MessageArchiveSegment.last_message_id.desc())
+        boundary = lambda segment: (segment.last_timestamp, segment.last_message_id)
+        in_page = lambda key: before is None or key < before
+
+    key = lambda message: (message.timestamp, message.id)
+    page = []
+    for segment in segments.yield_per(4):
+        # Segments come nearest-first; once the page is full, a segment starting beyond its far end cannot contribute
+        if len(page) >= limit and (boundary(segment) > key(page[-1]) if after else boundary(segment) < key(page[-1])):
+            break
+        page.extend(message for message in _unpack_archive_segment(segment) if in_page(key(message)))
+        page.sort(key=key, reverse=not after)
+        del page[limit:]
+    return page
+
+def _drop_archived_duplicates(rows, conversations):
+    # History import of a period that was archived since: rows already in the archive are matched by
+    # MessageSid or, for messages stored before SIDs were kept, by their content
+    horizons = {conversation.id: conversation.archived_through for conversation in conversations if conversation.archived_through}
+    old_rows = [row for row in rows if row['conversation_id'] in horizons and row['timestamp'] <= horizons[row['conversation_id']]]
+    if not old_rows:
+        return rows
+    timestamps = [row['timestamp'] for row in old_rows]
+    archived_sids, archived_legacy = set(), set()
+    for segment in MessageArchiveSegment.query.filter(
+        MessageArchiveSegment.conversation_id.in_({row['conversation_id'] for row in old_rows}),
+        MessageArchiveSegment.first_timestamp <= max(timestamps),
+        MessageArchiveSegment.last_timestamp >= min(timestamps)
+    ):
+        for message in _unpack_archive_segment(segment):
+            if message.provider_sid:
+                archived_sids.add(message.provider_sid)
+            else:
+                archived_legacy.add((segment.conversation_id, message.sender, message.body, message.timestamp))
+    return [row for row in rows if row['provider_sid'] not in archived_sids and
+            (row['conversation_id'], row['sender'], row['body'], row['timestamp']) not in archived_legacy]
+
+@event.listens_for(db.session, 'after_commit')
+def _remember_committed_message_sids(db_session):
+    for message_sid in db_session.info.pop('pending_message_sids', ()):
+        recent_message_sids.put(message_sid, True)
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_rolled_back_message_sids(db_session):
+    db_session.info.pop('pending_message_sids', None)
+
+# Pool of Twilio REST clients keyed by (account SID, auth token). Each client keeps its own
+# keep-alive HTTP session, so repeated sends for an account reuse the same TLS connection.
+class TwilioClientPool:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._clients = OrderedDict()
+        self._lock = threading.Lock() # Green lock once eventlet has monkey patched threading
+
+    def get(self, account_sid, auth_token):
+        key = (account_sid, auth_token)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                return client
+            client = Client(account_sid, auth_token, http_client=TwilioHttpClient(pool_connections=True))
+            self._clients[key] = client
+            while len(self._clients) > self.max_size:
+                _, evicted = self._clients.popitem(last=False)
+                self._close(evicted)
+            return client
+
+    def invalidate(self, account_sid):
+        # Drop every client for this account, e.g. when configure_twilio changes its credentials
+        with self._lock:
+            for key in [key for key in self._clients if key[0] == account_sid]:
+                self._close(self._clients.pop(key))
+
+    @staticmethod
+    def _close(client):
+        http_session = getattr(getattr(client, 'http_client', None), 'session', None)
+        if http_session is not None:
+            http_session.close()
+
+twilio_client_pool = TwilioClientPool(TWILIO_CLIENT_POOL_SIZE)
+
+# Token bucket limiting how fast one sending number hands messages to Twilio
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate # Tokens per second
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        # Reserve the next token and sleep until it is due; reservations are served in order
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        # Twilio said 429: push back every later send from this number, not just the rejected one
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+# The same bucket kept in Redis, so the web workers and every bulk send worker share one rate per number.
+# The script refills, reserves and returns the wait in one atomic step, timed by the Redis clock.
+REDIS_TOKEN_BUCKET_SCRIPT = """
+if redis.replicate_commands then redis.replicate_commands() end
+local rate, capacity, pause = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = math.min(capacity, (tonumber(state[1]) or capacity) + (now - (tonumber(state[2]) or now)) * rate)
+local wait = 0
+if pause > 0 then
+    tokens = math.min(tokens, -pause * rate)
+else
+    tokens = tokens - 1
+    wait = math.max(0, -tokens / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 60000)
+return tostring(wait)
+"""
+
+class RedisTokenBucket:
+    def __init__(self, client, key, rate, capacity=None):
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._script = client.register_script(REDIS_TOKEN_BUCKET_SCRIPT)
+        self._fallback = None # Process-local bucket used while Redis is unreachable
+
+    def _call(self, pause):
+        try:
+            return float(self._script(keys=[self.key], args=[self.rate, self.capacity, pause]))
+        except redis.RedisError as e:
+            print(f"[ERROR] Shared rate limit for {self.key} unavailable, limiting this process only: {e}")
+            if self._fallback is None:
+                self._fallback = TokenBucket(self.rate, self.capacity)
+            return None
 
+    def acquire(self):
+        wait = self._call(0)
+        if wait is None:
+            self._fallback.acquire()
+        elif wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        if self._call(seconds) is None:
+            self._fallback.pause(seconds)
+
+def _parse_number_rates(value):
+    rates = {}
+    for part in value.split(','):
+        number, _, rate = part.strip().partition('=')
+        if number and rate:
+            rates[format_phone_number_e164(number)] = float(rate)
+    return rates
+
+# Shared outbound dispatcher. Sends run on a bounded green pool: at most max_pending sends are queued
+# (submit blocks the caller beyond that), at most `concurrency` requests are in flight to Twilio, and each
+# sending number is held to its messages-per-second rate. 429s and 5xx responses are retried with jitter.
+class OutboundDispatcher:
+    def __init__(self, concurrency, max_pending, default_rate, number_rates=None,
+                 max_retries=4, retry_base_seconds=1.0, retry_max_seconds=30.0, redis_client=None, redis_prefix=None):
+        self.redis = redis_client # Shared buckets when set, else process-local ones
+        self.redis_prefix = redis_prefix
+        self.default_rate = default_rate
+        self.number_rates = number_rates or {}
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self._pool = eventlet.GreenPool(max_pending)
+        self._in_flight = threading.BoundedSemaphore(concurrency)
+        self._buckets = {} # sending number -> TokenBucket or RedisTokenBucket
+        self._lock = threading.Lock()
+        self.stats = {'submitted': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'rate_limited': 0}
+
+    def submit(self, user, to_number, body):
+        # Returns an event; .wait() gives the Twilio message or raises the send error.
+        # Credentials are read here, in the caller, so the send never touches the caller's DB session.
+        self._count('submitted')
+        done = eventlet.event.Event()
+        self._pool.spawn_n(self._run, done, user.twilio_account_sid, user.twilio_auth_token,
+                           user.twilio_phone_number, format_phone_number_e164(to_number), body)
+        return done
+
+    def _run(self, done, *args):
+        try:
+            done.send(self._send(*args))
+        except Exception as e:
+            done.send_exception(e)
+
+    def _bucket(self, from_number):
+        with self._lock:
+            bucket = self._buckets.get(from_number)
+            if bucket is None:
+                rate = self.number_rates.get(from_number, self.default_rate)
+                if rate <= 0:
+                    bucket = None
+                elif self.redis is not None:
+                    bucket = RedisTokenBucket(self.redis, f"{self.redis_prefix}:{from_number}", rate)
+                else:
+                    bucket = TokenBucket(rate)
+                self._buckets[from_number] = bucket
+            return bucket
+
+    def _send(self, account_sid, auth_token, from_number, to_number, body):
+        bucket = self._bucket(from_number)
+        attempt = 0
+        while True:
+            if bucket:
+                bucket.acquire()
+            try:
+                with self._in_flight:
+                    message = twilio_client_pool.get(account_sid, auth_token).messages.create(
+                        to=to_number, from_=from_number, body=body)
+                self._count('sent')
+                return message
+            except TwilioRestException as e:
+                if not (e.status == 429 or e.status >= 500) or attempt >= self.max_retries:
+                    self._count('failed')
+                    raise
+                delay = random.uniform(0, min(self.retry_max_seconds, self.retry_base_seconds * 2 ** attempt))
+                if e.status == 429:
+                    self._count('rate_limited')
+                    if bucket:
+                        bucket.pause(delay)
+                attempt += 1
+                self._count('retried')
+                print(f"[DEBUG] Twilio returned {e.status} sending from {from_number}, retry {attempt} in {delay:.1f}s")
+                time.sleep(delay)
+            except Exception:
+                self._count('failed')
+                raise
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+outbound_dispatcher = OutboundDispatcher(
+    OUTBOUND_CONCURRENCY, OUTBOUND_MAX_PENDING, OUTBOUND_DEFAULT_MPS, _parse_number_rates(OUTBOUND_NUMBER_MPS),
+    OUTBOUND_MAX_RETRIES, OUTBOUND_RETRY_BASE_SECONDS, OUTBOUND_RETRY_MAX_SECONDS,
+    redis.Redis.from_url(OUTBOUND_RATE_LIMIT_REDIS) if OUTBOUND_RATE_LIMIT_REDIS else None, OUTBOUND_RATE_LIMIT_PREFIX)
+
+def get_twilio_client(user):
+    return twilio_client_pool.get(user.twilio_account_sid, user.twilio_auth_token)
+
+def _twilio_credentials_error(user):
+    if not user.is_authenticated or \
+       not user.twilio_account_sid or \
+       not user.twilio_auth_token or \
+       not user.twilio_phone_number:
+        return "Twilio credentials not configured for your account. Please go to Settings to configure."
+    return None
+
+def send_sms(to_number, message_body, conversation_id=None, user=None):
+    # Use the given user's Twilio credentials (the bulk send worker has no request), else current_user's
+    return send_sms_batch([(user or current_user, to_number, message_body, conversation_id)])[0]
+
+def send_sms_batch(sends, on_result=None):
+    # sends: [(user, to_number, message_body, conversation_id or None)]. Everything is handed to the
+    # outbound dispatcher first, so the messages go out concurrently (at each number's rate). Sends are
+    # stored as they complete: whatever has finished since the last commit goes in with one insert and
+    # commit, so a crash only loses the record of the sends still in flight.
+    # on_result(index, success, feedback_message, message_sid) is called before each commit, letting
+    # the caller stage its own bookkeeping in the same transaction. Returns [(success, feedback_message)] in order.
+    results = [None] * len(sends)
+    completed = eventlet.queue.LightQueue()
+    pending = 0
+    for i, (user, to_number, message_body, conversation_id) in enumerate(sends):
+        error_message = _twilio_credentials_error(user)
+        if error_message:
+            print(f"Error sending SMS: {error_message}")
+            results[i] = (False, error_message)
+            if on_result:
+                on_result(i, False, error_message, None)
+        else:
+            send = outbound_dispatcher.submit(user, to_number, message_body) # Blocks while the dispatcher is full
+            eventlet.spawn_n(_put_when_sent, completed, i, send)
+            pending += 1
+
+    while pending:
+        done = [completed.get()]
+        while not completed.empty():
+            done.append(completed.get_nowait())
+        pending -= len(done)
+        _record_sent_sms(sends, done, results, on_result)
+    return results
+
+def _put_when_sent(completed, index, send):
     try:
-        client = Client(current_user.twilio_account_sid, current_user.twilio_auth_token)
-        message = client.messages.create(
-            to=format_phone_number_e164(to_number),
-            from_=current_user.twilio_phone_number,
-            body=message_body
-        )
+        completed.put((index, send.wait(), None))
+    except Exception as e:
+        completed.put((index, None, e))
+
+def _record_sent_sms(sends, done, results, on_result):
+    # done: [(index, message or None, exception or None)] for sends that just finished
+    rows = []
+    for i, message, error in done:
+        user, to_number, message_body, conversation_id = sends[i]
+        if error is not None:
+            print(f"Error sending SMS to {to_number}: {error}")
+            results[i] = (False, f"Error sending SMS to {to_number}: {error}")
+            continue
         print(f"Message SID: {message.sid}")
-
+        results[i] = (True, f"Message sent to {to_number}.")
         if conversation_id:
-            new_message = Message(
-                conversation_id=conversation_id,
-                sender='user',
-                body=message_body
-            )
-            db.session.add(new_message)
-            conversation = Conversation.query.get(conversation_id)
-            conversation.last_activity_time = datetime.utcnow() # Update last activity time
-            db.session.commit()
-            # Emit SocketIO event after message is committed to DB
-            # Emit to the specific conversation room
-            socketio.emit('new_message', {
+            rows.append((user.id, {
                 'conversation_id': conversation_id,
                 'sender': 'user',
                 'body': message_body,
-                'timestamp': datetime.utcnow().isoformat() + 'Z' # Ensure Z for UTC
-            }, room=str(conversation_id))
-            # Emit to the user's personal room to update conversation list
-            socketio.emit('conversation_update', {'user_id': current_user.id}, room=str(current_user.id))
+                'timestamp': datetime.utcnow(),
+                'provider_sid': message.sid # Lets the history importer recognise this message
+            }))
 
-        return True, f"Message sent to {to_number}."
+    try:
+        if rows:
+            insert_messages([row for _, row in rows]) # Also updates the conversations' last activity time and summary
+        if on_result:
+            for i, message, _ in done:
+                on_result(i, *results[i], message.sid if message else None)
+        db.session.commit()
     except Exception as e:
-        print(f"Error sending SMS to {to_number}: {e}")
-        return False, f"Error sending SMS to {to_number}: {e}"
+        db.session.rollback()
+        for i, message, error in done:
+            if error is None and sends[i][3]:
+                # Twilio accepted it, so it is still a sent message; only our copy is missing
+                print(f"[ERROR] Message {message.sid} to {sends[i][1]} was sent but could not be stored: {e}")
+                results[i] = (True, f"Message sent to {sends[i][1]}, but it could not be saved to the conversation: {e}")
+        if on_result:
+            # Record the results and SIDs even though the messages could not be stored
+            try:
+                for i, message, _ in done:
+                    on_result(i, *results[i], message.sid if message else None)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"[ERROR] Could not record {len(done)} send results: {e}")
+        return
+
+    # Emit SocketIO events after the messages are committed to DB
+    conversation_ids_by_user = {}
+    for user_id, row in rows:
+        # Emit to the specific conversation room
+        socketio_emits.queue('new_messages', {
+            'conversation_id': row['conversation_id'],
+            'sender': 'user',
+            'body': row['body'],
+            'timestamp': row['timestamp'].isoformat() + 'Z' # Ensure Z for UTC
+        }, room=str(row['conversation_id']))
+        conversation_ids_by_user.setdefault(user_id, []).append(row['conversation_id'])
+    # Emit to each user's personal room to update the conversation list
+    for user_id, conversation_ids in conversation_ids_by_user.items():
+        emit_conversation_update(user_id, list(dict.fromkeys(conversation_ids)))
 
 @app.route('/login')
 def login():
@@ -224,7 +1195,7 @@ def login():
         return redirect(url_for('index'))
 
     # Original Google OAuth redirect logic
-    google_provider_cfg = httpx.get(GOOGLE_DISCOVERY_URL).json()
+    google_provider_cfg = google_discovery_cache.get()
     authorization_endpoint = google_provider_cfg["authorization_endpoint"]
 
     request_uri = client.prepare_request_uri(
@@ -249,7 +1220,7 @@ def callback():
 
     # Find out what URL to hit to get tokens that allow you to ask for
     # things on behalf of a user
-    google_provider_cfg = httpx.get(GOOGLE_DISCOVERY_URL).json()
+    google_provider_cfg = google_discovery_cache.get()
     token_endpoint = google_provider_cfg["token_endpoint"]
 
     # Prepare and send a request to get tokens!
@@ -259,7 +1230,7 @@ def callback():
         redirect_url=request.base_url,
         code=code
     )
-    token_response = httpx.post(
+    token_response = google_http_client.post(
         token_url,
         headers=headers,
         data=body,
@@ -277,14 +1248,15 @@ def callback():
     uri, headers, body = client.add_token(
         userinfo_endpoint
     )
-    userinfo_response = httpx.get(uri, headers=headers)
+    userinfo_response = google_http_client.get(uri, headers=headers)
+    userinfo = userinfo_response.json()
 
     # You want to make sure the user is verified.
-    if userinfo_response.json().get("email_verified"):
-        unique_id = userinfo_response.json()["sub"]
-        users_email = userinfo_response.json()["email"]
-        picture = userinfo_response.json()["picture"]
-        users_name = userinfo_response.json()["given_name"]
+    if userinfo.get("email_verified"):
+        unique_id = userinfo["sub"]
+        users_email = userinfo["email"]
+        picture = userinfo["picture"]
+        users_name = userinfo["given_name"]
         # Extract tokens for future API access
         refresh_token = client.refresh_token # The refresh token
         access_token = client.token['access_token'] # The current access token
@@ -310,6 +1282,8 @@ def callback():
         user.google_api_refresh_token = refresh_token
         user.google_api_access_token = access_token
     db.session.commit()
+    invalidate_user(user.id)
+    invalidate_google_services(user.id) # Drop services built with the previous tokens
 
     # Log user in
     login_user(user)
@@ -323,80 +1297,98 @@ def logout():
     flash('You have been logged out.')
     return redirect(url_for('index'))
 
-# Helper to get the Google Sheets service
-def get_google_sheet_service():
-    # For multi-user access, use current_user's stored tokens
-    if not current_user.is_authenticated or not current_user.google_api_refresh_token:
-        print("Error: Current user not authenticated or no Google API refresh token found.")
-        return None
-
-    creds = Credentials(
-        token=current_user.google_api_access_token,
-        refresh_token=current_user.google_api_refresh_token,
+# Static discovery documents bundled with google-api-python-client, read from disk once per process
+_google_discovery_documents = {}
+_google_discovery_documents_lock = threading.Lock()
+
+def _get_static_discovery_document(api_name, api_version):
+    key = (api_name, api_version)
+    with _google_discovery_documents_lock:
+        document = _google_discovery_documents.get(key)
+        if document is None:
+            document = discovery_cache.get_static_doc(api_name, api_version)
+            _google_discovery_documents[key] = document
+    return document
+
+# Bounded per-user cache of built Google API service objects, with TTL and LRU eviction.
+# Entries remember the refresh token they were built with, so a token change misses the cache.
+google_service_cache = LRUCache(GOOGLE_SERVICE_CACHE_SIZE, GOOGLE_SERVICE_CACHE_TTL)
+
+def invalidate_google_services(user_id):
+    google_service_cache.invalidate(lambda key: key[0] == user_id)
+    sheet_data_cache.invalidate(lambda key: key[0] == user_id)
+
+def _build_google_credentials(user):
+    return Credentials(
+        token=user.google_api_access_token,
+        refresh_token=user.google_api_refresh_token,
         client_id=os.environ.get("GOOGLE_CLIENT_ID"),
         client_secret=os.environ.get("GOOGLE_CLIENT_SECRET"),
         token_uri="https://oauth2.googleapis.com/token",
         scopes=SCOPES
     )
 
-    if creds.expired and creds.refresh_token:
-        try:
-            creds.refresh(Request())
-            # Update the stored access token in the database
-            current_user.google_api_access_token = creds.token
-            db.session.commit()
-        except Exception as e:
-            print(f"Error refreshing Google API access token for Sheets: {e}")
-            return None
-
-    if not creds.valid:
-        print("Error: Google API credentials are not valid after refresh attempt for Sheets.")
-        return None
-
-    try:
-        service = build('sheets', 'v4', credentials=creds)
-        return service
-    except Exception as e:
-        print(f"Error building Google Sheets service: {e}")
-        return None
-
-
-
-def get_google_drive_service():
+# Helper to get a (cached) Google API service for the current user
+def get_google_service(api_name, api_version, label):
     # For multi-user access, use current_user's stored tokens
     if not current_user.is_authenticated or not current_user.google_api_refresh_token:
         print("Error: Current user not authenticated or no Google API refresh token found.")
         return None
 
-    creds = Credentials(
-        token=current_user.google_api_access_token,
-        refresh_token=current_user.google_api_refresh_token,
-        client_id=os.environ.get("GOOGLE_CLIENT_ID"),
-        client_secret=os.environ.get("GOOGLE_CLIENT_SECRET"),
-        token_uri="https://oauth2.googleapis.com/token",
-        scopes=SCOPES
-    )
+    key = (current_user.id, api_name, api_version)
+    entry = google_service_cache.get(key)
+    if entry and entry['refresh_token'] != current_user.google_api_refresh_token:
+        google_service_cache.pop(key)
+        entry = None
+    creds = entry['credentials'] if entry else _build_google_credentials(current_user)
 
     if creds.expired and creds.refresh_token:
         try:
             creds.refresh(Request())
-            # Update the stored access token in the database
-            current_user.google_api_access_token = creds.token
+            # Update the stored access token in the database (current_user is a detached snapshot)
+            User.query.filter_by(id=current_user.id).update({User.google_api_access_token: creds.token}, synchronize_session=False)
             db.session.commit()
+            invalidate_user(current_user.id)
         except Exception as e:
-            print(f"Error refreshing Google API access token for Drive: {e}")
+            print(f"Error refreshing Google API access token for {label}: {e}")
+            invalidate_google_services(current_user.id)
             return None
 
     if not creds.valid:
-        print("Error: Google API credentials are not valid after refresh attempt for Drive.")
+        print(f"Error: Google API credentials are not valid after refresh attempt for {label}.")
         return None
+
+    if entry:
+        return entry['service']
+
+    # httplib2 connections are not safe to share between greenlets, so every request
+    # made through the cached service gets its own authorized Http object.
+    def build_request(http, *args, **kwargs):
+        return HttpRequest(AuthorizedHttp(creds, http=httplib2.Http()), *args, **kwargs)
+
     try:
-        service = build('drive', 'v3', credentials=creds)
-        return service
+        service = build_from_document(
+            _get_static_discovery_document(api_name, api_version),
+            credentials=creds,
+            requestBuilder=build_request
+        )
     except Exception as e:
-        print(f"Error building Google Drive service: {e}")
+        print(f"Error building Google {label} service: {e}")
         return None
 
+    google_service_cache.put(key, {
+        'refresh_token': current_user.google_api_refresh_token,
+        'credentials': creds,
+        'service': service
+    })
+    return service
+
+def get_google_sheet_service():
+    return get_google_service('sheets', 'v4', 'Sheets')
+
+def get_google_drive_service():
+    return get_google_service('drive', 'v3', 'Drive')
+
 
 @app.route('/google_sheets')
 @login_required
@@ -423,28 +1415,125 @@ def list_google_sheets():
         print(f"Error listing Google Sheets: {e}")
         return jsonify({'error': f'Error listing sheets: {e}'}), 500
 
-@app.route('/google_sheet_data/<sheet_id>')
-@login_required
-def get_google_sheet_data(sheet_id):
+# Per-user cache of spreadsheet contents, validated against the file's Drive modifiedTime
+sheet_data_cache = LRUCache(SHEET_DATA_CACHE_SIZE)
+
+def _a1_sheet_name(sheet_name):
+    # Quote the sheet title for A1 notation (titles may contain spaces or quotes)
+    return "'" + sheet_name.replace("'", "''") + "'"
+
+def _get_sheet_modified_time(sheet_id):
+    drive_service = get_google_drive_service()
+    if not drive_service:
+        return None
+    try:
+        metadata = drive_service.files().get(fileId=sheet_id, fields='modifiedTime', supportsAllDrives=True).execute()
+        return metadata.get('modifiedTime')
+    except Exception as e:
+        print(f"Error reading Drive modifiedTime for {sheet_id}: {e}")
+        return None
+
+def _get_sheet_cache_entry(sheet_service, sheet_id):
+    key = (current_user.id, sheet_id)
+    entry = sheet_data_cache.get(key)
+    now = time.monotonic()
+    if entry and now - entry['checked_at'] < SHEET_DATA_REVALIDATE_SECONDS:
+        return entry
+
+    modified_time = _get_sheet_modified_time(sheet_id)
+    if entry and modified_time and entry['modified_time'] == modified_time:
+        entry['checked_at'] = now
+        return entry
+
+    # New or changed sheet: only the first tab's title and size are needed from the metadata
+    spreadsheet_metadata = sheet_service.spreadsheets().get(
+        spreadsheetId=sheet_id, fields='sheets.properties(title,gridProperties.rowCount)').execute()
+    sheet_properties = spreadsheet_metadata.get('sheets')[0].get('properties')
+    entry = {
+        'modified_time': modified_time,
+        'checked_at': now,
+        'sheet_name': sheet_properties.get('title'),
+        'row_count': sheet_properties.get('gridProperties', {}).get('rowCount'), # Grid rows, header included
+        'headers': None,
+        'rows': None, # Full data rows, once the whole sheet has been read
+        'windows': {} # (offset, limit) -> rows, for paged reads
+    }
+    if modified_time: # Without a modifiedTime we cannot tell when the data goes stale
+        sheet_data_cache.put(key, entry)
+    return entry
+
+def read_google_sheet(sheet_id, offset=0, limit=None, cache_window=True):
+    # Returns (headers, rows, has_more) for the first tab of the sheet. With a limit only that
+    # window of data rows is fetched; without one the whole tab (columns A:Z) is read and cached.
     sheet_service = get_google_sheet_service()
     if not sheet_service:
-        return jsonify({'error': 'Could not get Google Sheets service.'}), 500
+        raise RuntimeError('Could not get Google Sheets service.')
 
-    try:
-        # Try to get the first sheet's data
-        spreadsheet_metadata = sheet_service.spreadsheets().get(spreadsheetId=sheet_id).execute()
-        sheet_name = spreadsheet_metadata.get('sheets')[0].get('properties').get('title')
-        range_name = f'{sheet_name}!A:Z' # Get all columns up to Z
+    entry = _get_sheet_cache_entry(sheet_service, sheet_id)
+    sheet_name = _a1_sheet_name(entry['sheet_name'])
+
+    if entry['rows'] is not None:
+        if limit is None:
+            return entry['headers'], entry['rows'][offset:], False
+        return entry['headers'], entry['rows'][offset:offset + limit], offset + limit < len(entry['rows'])
+
+    if limit is None:
         result = sheet_service.spreadsheets().values().get(
-            spreadsheetId=sheet_id, range=range_name).execute()
+            spreadsheetId=sheet_id, range=f'{sheet_name}!A:Z').execute() # Get all columns up to Z
         values = result.get('values', [])
-        
-        if not values:
-            return jsonify({'headers': [], 'data': []})
+        entry['headers'] = values[0] if values else []
+        entry['rows'] = values[1:]
+        entry['windows'] = {}
+        return entry['headers'], entry['rows'][offset:], False
+
+    window = entry['windows'].get((offset, limit))
+    if window is None:
+        # Row 1 holds the headers, so data row N lives on sheet row N + 2
+        ranges = [f'{sheet_name}!A{offset + 2}:Z{offset + limit + 1}']
+        if entry['headers'] is None:
+            ranges.insert(0, f'{sheet_name}!A1:Z1')
+        result = sheet_service.spreadsheets().values().batchGet(spreadsheetId=sheet_id, ranges=ranges).execute()
+        value_ranges = result.get('valueRanges', [])
+        if entry['headers'] is None:
+            header_values = value_ranges.pop(0).get('values', []) if value_ranges else []
+            entry['headers'] = header_values[0] if header_values else []
+        window = value_ranges[0].get('values', []) if value_ranges else []
+        if cache_window:
+            if len(entry['windows']) >= 16:
+                entry['windows'].clear()
+            entry['windows'][(offset, limit)] = window
+    # The API leaves out empty trailing rows, so a short window does not mean the sheet ended there.
+    # Decide from the grid size; without it, keep going until a window comes back empty.
+    if entry['row_count'] is not None:
+        return entry['headers'], window, offset + limit + 1 < entry['row_count']
+    return entry['headers'], window, bool(window)
+
+def iter_google_sheet_rows(sheet_id, chunk_size=None):
+    # Stream a sheet as (headers, rows) chunks so large sheets are never held in memory at once
+    chunk_size = chunk_size or SHEET_READ_CHUNK_SIZE
+    offset = 0
+    while True:
+        headers, rows, has_more = read_google_sheet(sheet_id, offset, chunk_size, cache_window=False)
+        yield headers, rows
+        if not has_more:
+            break
+        offset += chunk_size
 
-        headers = values[0]
-        data = values[1:]
-        return jsonify({'headers': headers, 'data': data})
+@app.route('/google_sheet_data/<sheet_id>')
+@login_required
+def get_google_sheet_data(sheet_id):
+    # Optional ?limit=N&offset=M returns a window of data rows instead of the whole sheet
+    limit = request.args.get('limit', type=int)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    if limit is not None and limit <= 0:
+        return jsonify({'error': 'limit must be a positive integer.', 'headers': [], 'data': []}), 400
+
+    try:
+        headers, data, has_more = read_google_sheet(sheet_id, offset, limit)
+        response = {'headers': headers, 'data': data}
+        if limit is not None:
+            response.update({'offset': offset, 'limit': limit, 'has_more': has_more})
+        return jsonify(response)
     except Exception as e:
         print(f"Error reading Google Sheet data for {sheet_id}: {e}")
         return jsonify({'error': f'Error reading sheet data: {e}', 'headers': [], 'data': []}), 500
@@ -479,157 +1568,519 @@ def send_templated_bulk_sms():
     if not sheet_id or not message_template:
         return jsonify({'error': 'Missing sheet ID or message template.'}), 400
 
-    # Fetch sheet data
-    sheet_data_response = get_google_sheet_data(sheet_id)
-    sheet_data = json.loads(sheet_data_response.data) # Deserialize jsonify response
+    # Queue the rows as a durable job; the worker process (see Procfile) does the actual sending
+    job = BulkSendJob(user_id=current_user.id, sheet_id=sheet_id, message_template=message_template)
+    db.session.add(job)
+    db.session.flush() # Flush to get job.id before adding items
 
-    if sheet_data.get('error'):
-        return jsonify({'error': f'Error fetching sheet data: {sheet_data['error']}'}), 500
+    template = MessageTemplate(message_template)
+    bound_template = None
+    columns = None
 
-    headers = sheet_data.get('headers', [])
-    rows = sheet_data.get('data', [])
+    try:
+        # Stream the sheet in chunks; each chunk's items are flushed before the next one is read
+        for headers, rows in iter_google_sheet_rows(sheet_id):
+            if not headers:
+                break
+            if bound_template is None:
+                # Compile against the headers once per sheet, rejecting placeholders with no column
+                bound_template = template.bind(headers)
+                if bound_template.unknown_placeholders:
+                    db.session.rollback()
+                    unknown = ', '.join(f'{{{{{name}}}}}' for name in bound_template.unknown_placeholders)
+                    return jsonify({'error': f'Unknown placeholders in message template: {unknown}'}), 400
+                columns = SheetColumns(headers)
+
+            items = []
+            for row, personalized_message in zip(rows, bound_template.render_all(rows)):
+                row_index = job.total_count
+                job.total_count += 1
+
+                phone_number = columns.phone_number(row)
+                if phone_number:
+                    items.append(BulkSendItem(
+                        job_id=job.id,
+                        row_index=row_index,
+                        phone_number=phone_number,
+                        contact_name=columns.contact_name(row),
+                        label=columns.label(row, phone_number),
+                        body=personalized_message
+                    ))
+                else:
+                    job.skipped_count += 1
+                    items.append(BulkSendItem(
+                        job_id=job.id,
+                        row_index=row_index,
+                        body=personalized_message,
+                        status='skipped',
+                        result=f"Skipped row (no phone number found): {row}",
+                        processed_at=datetime.utcnow()
+                    ))
+            db.session.add_all(items)
+
+            # Pre-create the chunk's contacts in one upsert so the worker finds them instead of inserting one by one
+            sendable = [item for item in items if item.phone_number]
+            phones_e164 = format_phone_numbers_e164([item.phone_number for item in sendable])
+            upsert_contacts(current_user.id, [(phone_e164, item.contact_name) for item, phone_e164 in zip(sendable, phones_e164)], rename=False)
+            db.session.flush()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error reading Google Sheet data for {sheet_id}: {e}")
+        return jsonify({'error': f'Error fetching sheet data: Error reading sheet data: {e}'}), 500
 
-    if not headers or not rows:
+    if job.total_count == 0:
+        db.session.rollback()
         return jsonify({'message': 'No data found in the selected sheet.'}), 200
 
-    results = []
-    for row in rows:
-        # Create a dictionary for easy templating
-        row_data = {headers[i]: row[i] for i in range(len(headers)) if i < len(row)}
-        
-        # Personalize message
-        personalized_message = message_template
-        for key, value in row_data.items():
-            personalized_message = personalized_message.replace(f'{{{{{key}}}}}', str(value))
-
-        # Assuming phone number is in a column named 'Phone' or similar
-        # This needs to be robust, for now, let's try to find common names or default to a column index
-        phone_number = None
+    if job.skipped_count == job.total_count:
+        job.status = 'completed'
+    db.session.commit()
+
+    return jsonify({'message': 'Bulk SMS job queued.', 'job': _bulk_send_job_summary(job)}), 202
+
+
+@app.route('/api/bulk_jobs/<int:job_id>')
+@login_required
+def get_bulk_send_job(job_id):
+    job = BulkSendJob.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    summary = _bulk_send_job_summary(job)
+    summary['results'] = [item.result for item in job.items if item.status in ('sent', 'failed', 'skipped')]
+    return jsonify(summary)
+
+
+@app.route('/api/emit_stats')
+@login_required
+def get_emit_stats():
+    # Socket.IO emit counters for this process: events queued by the app, emitted after coalescing, and saved
+    return jsonify(dict(socketio_emits.stats, window_ms=SOCKETIO_EMIT_WINDOW_MS))
+
+@app.route('/api/outbound_stats')
+@login_required
+def get_outbound_stats():
+    # Outbound dispatcher counters for this process: sends submitted, sent, failed, and retried after 429/5xx
+    return jsonify(dict(outbound_dispatcher.stats, concurrency=OUTBOUND_CONCURRENCY, default_mps=OUTBOUND_DEFAULT_MPS))
+
+@app.route('/api/inbound_write_stats')
+@login_required
+def get_inbound_write_stats():
+    # Group commit metrics for this process: batch sizes, insert+commit time and how long messages waited
+    return jsonify(dict(inbound_writes.stats(), mode=WEBHOOK_WRITE_MODE, flush_window_ms=WEBHOOK_FLUSH_MS))
+
+
+def _bulk_send_job_summary(job):
+    return {
+        'id': job.id,
+        'status': job.status,
+        'total': job.total_count,
+        'sent': job.sent_count,
+        'failed': job.failed_count,
+        'skipped': job.skipped_count
+    }
+
+
+def claim_bulk_send_items(batch_size=None):
+    # Claim a batch of pending rows, split evenly between the jobs that have any, so one large job
+    # cannot hold back everyone else's. On PostgreSQL, FOR UPDATE SKIP LOCKED lets several workers
+    # claim disjoint batches without blocking each other; SQLite ignores the locking clause.
+    batch_size = batch_size or BULK_SEND_BATCH_SIZE
+    job_ids = [job_id for job_id, in db.session.query(BulkSendItem.job_id).filter_by(status='pending')
+               .distinct().order_by(BulkSendItem.job_id).limit(batch_size)]
+    items = []
+    for job_id in job_ids:
+        items.extend(BulkSendItem.query.filter_by(job_id=job_id, status='pending')
+                     .order_by(BulkSendItem.id)
+                     .limit(max(1, batch_size // len(job_ids)))
+                     .with_for_update(skip_locked=True)
+                     .all())
+    now = datetime.utcnow()
+    for item in items:
+        item.status = 'sending'
+        item.claimed_at = now
+    job_ids = {item.job_id for item in items}
+    if job_ids:
+        BulkSendJob.query.filter(BulkSendJob.id.in_(job_ids), BulkSendJob.status == 'pending') \
+            .update({BulkSendJob.status: 'running'}, synchronize_session=False)
+    db.session.commit() # Commit the claim so the rows stay ours if this worker dies mid-batch
+    return items
+
+
+def _renew_bulk_send_leases(item_ids):
+    # Claimed rows can wait for their number's send rate longer than the lease: keep bumping
+    # claimed_at until they are processed, so requeue_stale_bulk_send_items only finds rows of dead workers
+    while True:
+        eventlet.sleep(BULK_SEND_LEASE_SECONDS / 3)
+        try:
+            with app.app_context():
+                BulkSendItem.query.filter(BulkSendItem.id.in_(item_ids), BulkSendItem.status == 'sending') \
+                    .update({BulkSendItem.claimed_at: datetime.utcnow()}, synchronize_session=False)
+                db.session.commit()
+        except Exception as e:
+            print(f"[WORKER] Error renewing bulk send leases: {e}")
+
+
+def requeue_stale_bulk_send_items(lease_seconds=None):
+    # Rows left in 'sending' by a crashed worker go back to 'pending' once their lease expires.
+    # Everything already marked 'sent' is never retried, so a restarted job resumes where it stopped.
+    # The SID is only ever stored together with the final status, so the provider_sid check just
+    # guards against sending a row twice should that ever change.
+    lease_seconds = lease_seconds or BULK_SEND_LEASE_SECONDS
+    cutoff = datetime.utcnow() - timedelta(seconds=lease_seconds)
+    requeued = BulkSendItem.query.filter(BulkSendItem.status == 'sending', BulkSendItem.claimed_at < cutoff,
+                                         BulkSendItem.provider_sid.is_(None)) \
+        .update({BulkSendItem.status: 'pending', BulkSendItem.claimed_at: None}, synchronize_session=False)
+    db.session.commit()
+    if requeued:
+        print(f"[WORKER] Requeued {requeued} stale bulk send items.")
+    return requeued
+
+
+def process_bulk_send_items(items):
+    # Send a claimed batch concurrently through the outbound dispatcher. Each item is marked with its
+    # result (and the message SID) in the same commit that stores its message, as soon as its send completes.
+    jobs = {job.id: job for job in BulkSendJob.query.filter(BulkSendJob.id.in_({item.job_id for item in items}))}
+    users = {user.id: user for user in User.query.filter(User.id.in_({job.user_id for job in jobs.values()}))}
+
+    def record_result(item, success, feedback_message, provider_sid=None):
+        item.status = 'sent' if success else 'failed'
+        item.result = f"To {item.label}: {feedback_message}" # Use Name if available
+        item.processed_at = datetime.utcnow()
+        item.provider_sid = provider_sid
+        counter = BulkSendJob.sent_count if success else BulkSendJob.failed_count
+        BulkSendJob.query.filter_by(id=item.job_id).update({counter: counter + 1}, synchronize_session=False)
+
+    failures = []
+    sends = []
+    for item in items:
+        user = users[jobs[item.job_id].user_id]
+        try:
+            # Get or create contact and conversation for the job's user and phone number
+            contact, conversation = get_or_create_contact_and_conversation(item.phone_number, user.id, item.contact_name)
+            sends.append((item, (user, item.phone_number, item.body, conversation.id if conversation else None)))
+        except Exception as e:
+            db.session.rollback()
+            failures.append((item, f"Error sending SMS to {item.phone_number}: {e}"))
+    for item, feedback_message in failures:
+        record_result(item, False, feedback_message)
+    db.session.commit()
+
+    renewer = eventlet.spawn(_renew_bulk_send_leases, [item.id for item, _ in sends])
+    try:
+        send_sms_batch([send for _, send in sends],
+                       on_result=lambda i, success, feedback_message, sid: record_result(sends[i][0], success, feedback_message, sid))
+    finally:
+        renewer.kill()
+
+    for job in jobs.values():
+        remaining = BulkSendItem.query.filter(BulkSendItem.job_id == job.id, BulkSendItem.status.in_(('pending', 'sending'))).count()
+        if remaining == 0:
+            BulkSendJob.query.filter_by(id=job.id).update({BulkSendJob.status: 'completed'}, synchronize_session=False)
+            db.session.commit()
+
+        db.session.refresh(job)
+        socketio_emits.queue('bulk_job_progress', _bulk_send_job_summary(job), room=str(job.user_id))
+
+
+def run_bulk_send_worker():
+    print("[WORKER] Bulk send worker started.")
+    last_requeue = 0
+    while True:
+        try:
+            if time.monotonic() - last_requeue > BULK_SEND_LEASE_SECONDS:
+                requeue_stale_bulk_send_items()
+                last_requeue = time.monotonic()
+
+            items = claim_bulk_send_items()
+            if items:
+                process_bulk_send_items(items)
+            else:
+                time.sleep(BULK_SEND_POLL_SECONDS)
+        except Exception as e:
+            db.session.rollback()
+            print(f"[WORKER] Error processing bulk send items: {e}")
+            time.sleep(BULK_SEND_POLL_SECONDS)
+
+
+# Compiled message template: the text is split once into literal and {{placeholder}} slots,
+# so rendering a row is a single pass instead of one str.replace per header.
+TEMPLATE_PLACEHOLDER_PATTERN = re.compile(r'\{\{(.*?)\}\}')
+
+class MessageTemplate:
+    def __init__(self, template):
+        self.template = template
+        self.slots = [] # (text, placeholder name or None)
+        position = 0
+        for match in TEMPLATE_PLACEHOLDER_PATTERN.finditer(template):
+            if match.start() > position:
+                self.slots.append((template[position:match.start()], None))
+            self.slots.append((match.group(0), match.group(1)))
+            position = match.end()
+        if position < len(template):
+            self.slots.append((template[position:], None))
+        self.placeholders = list(dict.fromkeys(name for _, name in self.slots if name is not None))
+
+    def bind(self, headers):
+        # Resolve placeholders to column indexes once per sheet (a repeated header uses its last column)
+        column_index = {header: i for i, header in enumerate(headers)}
+        unknown_placeholders = [name for name in self.placeholders if name not in column_index]
+        slots = []
+        for text, name in self.slots:
+            index = column_index.get(name) if name is not None else None
+            if index is None and slots and slots[-1][1] is None:
+                slots[-1] = (slots[-1][0] + text, None) # Merge adjacent literals
+            else:
+                slots.append((text, index))
+        return BoundMessageTemplate(slots, unknown_placeholders)
+
+class BoundMessageTemplate:
+    def __init__(self, slots, unknown_placeholders):
+        self.slots = slots # (text, column index or None for literals)
+        self.unknown_placeholders = unknown_placeholders
+
+    def render(self, row):
+        # A placeholder whose cell is missing from a short row is left as written
+        return ''.join(
+            str(row[index]) if index is not None and index < len(row) else text
+            for text, index in self.slots
+        )
+
+    def render_all(self, rows):
+        return [self.render(row) for row in rows]
+
+def _row_value(row, index, default=None):
+    return row[index] if index is not None and index < len(row) else default
+
+# Phone and name columns of a sheet, resolved once per sheet instead of once per row
+class SheetColumns:
+    def __init__(self, headers):
+        column_index = {header: i for i, header in enumerate(headers)}
+        # Assuming phone number is in a column named 'Phone' or similar, else fall back to the 2nd column
         if 'Phone' in headers:
-            phone_index = headers.index('Phone')
-            if phone_index < len(row):
-                phone_number = row[phone_index]
+            self.phone_index = headers.index('Phone')
         elif 'phone' in headers:
-            phone_index = headers.index('phone')
-            if phone_index < len(row):
-                phone_number = row[phone_index]
-        elif len(row) > 1: # Fallback to second column if no 'Phone' header found
-            phone_number = row[1] # Assuming 2nd column is phone number (index 1)
-        
-        if phone_number:
-            # Get or create contact and conversation for the current user and phone number
-            contact, conversation = get_or_create_contact_and_conversation(phone_number, current_user.id, _get_contact_name_from_row_data(row_data, headers))
-
-            success, feedback_message = send_sms(phone_number, personalized_message, conversation.id)
-            results.append(f"To {row_data.get('Name', phone_number)}: {feedback_message}") # Use Name if available
+            self.phone_index = headers.index('phone')
         else:
-            results.append(f"Skipped row (no phone number found): {row}")
+            self.phone_index = None
+        self.name_index = column_index.get('Name')
+        self.first_name_indexes = [column_index.get('First Name'), column_index.get('FirstName')]
+        self.last_name_indexes = [column_index.get('Last Name'), column_index.get('LastName')]
+
+    def phone_number(self, row):
+        if self.phone_index is not None:
+            return _row_value(row, self.phone_index)
+        return _row_value(row, 1) # Assuming 2nd column is phone number (index 1)
+
+    def label(self, row, phone_number):
+        return _row_value(row, self.name_index, phone_number) # Use Name if available
+
+    def contact_name(self, row):
+        # Prioritize 'Name', then 'First Name' + 'Last Name', then 'FirstName', then 'LastName', then empty string
+        name = _row_value(row, self.name_index)
+        if name:
+            return name
+
+        first_name = self._first_present(row, self.first_name_indexes)
+        last_name = self._first_present(row, self.last_name_indexes)
+
+        if first_name and last_name:
+            return f"{first_name} {last_name}"
+        elif first_name:
+            return first_name
+        elif last_name:
+            return last_name
+        return '' # Return empty string if no name found
+
+    @staticmethod
+    def _first_present(row, indexes):
+        for index in indexes:
+            value = _row_value(row, index)
+            if value is not None:
+                return value
+        return ''
+
+@app.route('/api/preview_bulk_sms', methods=['POST'])
+@login_required
+def preview_bulk_sms():
+    data = request.get_json() or {}
+    sheet_id = data.get('sheet_id')
+    message_template = data.get('message_template') or ''
+    try:
+        limit = min(max(int(data.get('limit') or 5), 1), SHEET_PREVIEW_ROWS)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid preview limit.'}), 400
 
-    return jsonify({'message': 'Bulk SMS process completed.', 'results': results}), 200
+    if not sheet_id:
+        return jsonify({'error': 'Missing sheet ID.'}), 400
 
+    template = MessageTemplate(message_template)
+    try:
+        headers, rows, has_more = read_google_sheet(sheet_id, 0, limit)
+    except Exception as e:
+        print(f"Error reading Google Sheet data for {sheet_id}: {e}")
+        return jsonify({'error': f'Error reading sheet data: {e}'}), 500
 
-def _get_contact_name_from_row_data(row_data, headers):
-    # Prioritize 'Name', then 'First Name' + 'Last Name', then 'FirstName', then 'LastName', then empty string
-    if 'Name' in row_data and row_data['Name']:
-        return row_data['Name']
-    
-    first_name = row_data.get('First Name', row_data.get('FirstName', ''))
-    last_name = row_data.get('Last Name', row_data.get('LastName', ''))
+    bound_template = template.bind(headers)
+    columns = SheetColumns(headers)
+    messages = []
+    for row, body in zip(rows, bound_template.render_all(rows)):
+        phone_number = columns.phone_number(row)
+        messages.append({'phone_number': phone_number, 'name': columns.contact_name(row), 'body': body})
 
-    if first_name and last_name:
-        return f"{first_name} {last_name}"
-    elif first_name:
-        return first_name
-    elif last_name:
-        return last_name
-    return '' # Return empty string if no name found
+    return jsonify({
+        'placeholders': template.placeholders,
+        'unknown_placeholders': bound_template.unknown_placeholders,
+        'messages': messages,
+        'has_more': has_more
+    })
+
+def _conversation_summaries_query():
+    # The last message and unread count are materialized on the conversation, so the list is a
+    # single scan of (user_id, last_activity_time)
+    return db.session.query(
+        Conversation.id,
+        Conversation.last_activity_time,
+        Contact.name,
+        Contact.phone_number,
+        Conversation.last_message_body,
+        Conversation.last_message_at,
+        Conversation.unread_count
+    ).outerjoin(Contact, Contact.id == Conversation.contact_id)
+
+def _conversation_summary(row):
+    # One entry of the conversation list, also the payload of conversation_update events
+    conv_id, last_activity_time, contact_name, contact_phone, last_body, last_timestamp, unread_count = row
+    phone_number = contact_phone if contact_phone else None # Stored contact numbers are already E.164
+    display_contact_name = contact_name if contact_name and contact_name != 'Unknown' else None
+    display_contact_name = display_contact_name if display_contact_name else (phone_number if phone_number else 'Unknown Contact/Phone')
+
+    return {
+        'id': conv_id,
+        'contact_name': display_contact_name,
+        'phone_number': phone_number,
+        'last_message_time': last_timestamp.isoformat() + 'Z' if last_timestamp else None,
+        'last_message_body': last_body if last_body is not None else '', # Add last message body for preview
+        'last_activity_time': last_activity_time.isoformat() + 'Z' if last_activity_time else None,
+        'unread_count': unread_count
+    }
+
+def conversation_summaries(user_id, conversation_ids):
+    rows = _conversation_summaries_query().filter(Conversation.user_id == user_id, Conversation.id.in_(conversation_ids)).all()
+    return [_conversation_summary(row) for row in rows]
+
+def emit_conversation_update(user_id, conversation_ids=None):
+    # Tell the user's open tabs what changed in their conversation list: the summaries of the given
+    # conversations, which the client patches in place, or, after bulk changes (conversation_ids=None),
+    # a refresh flag that makes it refetch /api/conversations. The summaries are read by the emit
+    # coalescer, once per user and window.
+    payload = {'user_id': user_id}
+    if conversation_ids is None:
+        payload['refresh'] = True
+    else:
+        payload['conversation_ids'] = list(conversation_ids)
+    socketio_emits.queue('conversation_update', payload, room=str(user_id))
 
 @app.route('/api/conversations')
 @login_required
 def get_conversations():
     user_id = current_user.id
+
     # Order conversations by last_activity_time in descending order, with NULLs last
-    conversations = Conversation.query.filter_by(user_id=user_id).order_by(Conversation.last_activity_time.desc().nullslast()).all()
-    
-    print("[DEBUG] Conversations retrieved from DB (before sorting applies, raw order):")
-    for conv_raw in Conversation.query.filter_by(user_id=user_id).all():
-        print(f"[DEBUG]   ID: {conv_raw.id}, Last Activity: {conv_raw.last_activity_time}")
-    print("[DEBUG] ----------------------------------------")
-
-    print("[DEBUG] Conversations after SQLAlchemy sorting:")
-    for conv_sorted in conversations:
-        print(f"[DEBUG]   ID: {conv_sorted.id}, Last Activity: {conv_sorted.last_activity_time}")
-    print("[DEBUG] ----------------------------------------")
-
-    conversation_list = []
-    for conv in conversations:
-        # Consolidate debug prints for brevity
-        display_contact_name = conv.contact.name if conv.contact and conv.contact.name != 'Unknown' else None
-        display_contact_name = display_contact_name if display_contact_name else (format_phone_number_e164(conv.contact.phone_number) if conv.contact and conv.contact.phone_number else 'Unknown Contact/Phone')
-        
-        print(f"[DEBUG] Conv ID: {conv.id} | Contact: '{display_contact_name}' | Phone (raw): '{conv.contact.phone_number if conv.contact else 'N/A'}' | Last Activity: {conv.last_activity_time}")
-
-        last_message_timestamp_str = None
-        last_message_body = '' # Default to empty string for preview
-
-        # Fetch the very last message for the conversation to get its body
-        last_message_record = Message.query.filter_by(conversation_id=conv.id).order_by(Message.timestamp.desc()).first()
-        if last_message_record:
-            last_message_timestamp_str = last_message_record.timestamp.isoformat() + 'Z'
-            last_message_body = last_message_record.body
-
-        # Unread count logic remains the same
-        unread_count = 0
-        if conv.last_read_timestamp:
-            unread_count = Message.query.filter(
-                Message.conversation_id == conv.id,
-                Message.sender == 'contact',
-                Message.timestamp > conv.last_read_timestamp
-            ).count()
-        else:
-            unread_count = Message.query.filter(
-                Message.conversation_id == conv.id,
-                Message.sender == 'contact'
-            ).count()
-        print(f"  Unread Count: {unread_count}")
-        print("----------------------------------------")
-
-        conversation_list.append({
-            'id': conv.id,
-            'contact_name': display_contact_name,
-            'phone_number': format_phone_number_e164(conv.contact.phone_number) if conv.contact and conv.contact.phone_number else None,
-            'last_message_time': last_message_timestamp_str,
-            'last_message_body': last_message_body, # Add last message body for preview
-            'last_activity_time': conv.last_activity_time.isoformat() + 'Z' if conv.last_activity_time else None,
-            'unread_count': unread_count
-        })
-    return jsonify(conversation_list)
+    rows = _conversation_summaries_query() \
+        .filter(Conversation.user_id == user_id) \
+        .order_by(Conversation.last_activity_time.desc().nullslast()) \
+        .all()
+    return jsonify([_conversation_summary(row) for row in rows])
+
+def recalculate_last_activity_times(user_id=None, min_conversation_id=None, max_conversation_id=None):
+    # Set last_activity_time to the newest message timestamp with one UPDATE ... FROM (SELECT conversation_id,
+    # max(timestamp) ...), touching only conversations whose value is off; conversations without messages keep
+    # theirs. Scoped to one user and/or an inclusive conversation id range so the maintenance CLI can work
+    # through the whole table in batches. Returns the number of conversations updated.
+    latest = db.select(Message.conversation_id, db.func.max(Message.timestamp).label('timestamp'))
+    if user_id is not None: # Aggregate only this user's messages
+        latest = latest.where(Message.conversation_id.in_(db.select(Conversation.id).where(Conversation.user_id == user_id)))
+    if min_conversation_id is not None:
+        latest = latest.where(Message.conversation_id >= min_conversation_id)
+    if max_conversation_id is not None:
+        latest = latest.where(Message.conversation_id <= max_conversation_id)
+    latest = latest.group_by(Message.conversation_id).subquery()
+
+    statement = db.update(Conversation).where(
+        Conversation.id == latest.c.conversation_id,
+        Conversation.last_activity_time != latest.c.timestamp
+    )
+    if user_id is not None:
+        statement = statement.where(Conversation.user_id == user_id)
+    result = db.session.execute(statement.values(last_activity_time=latest.c.timestamp).execution_options(synchronize_session=False))
+    return result.rowcount
 
 @app.route('/api/recalculate_last_activity', methods=['POST'])
 @login_required
 def recalculate_last_activity():
     # Rebuild last_activity_time from max message timestamp per conversation for current user
     user_id = current_user.id
-    conversations = Conversation.query.filter_by(user_id=user_id).all()
-    updated = 0
-    for conv in conversations:
-        latest_msg = Message.query.filter_by(conversation_id=conv.id).order_by(Message.timestamp.desc()).first()
-        new_time = latest_msg.timestamp if latest_msg else None
-        if conv.last_activity_time != new_time:
-            conv.last_activity_time = new_time
-            db.session.add(conv)
-            updated += 1
+    updated = recalculate_last_activity_times(user_id)
     db.session.commit()
     # Notify UI to refresh
-    socketio.emit('conversation_update', {'user_id': user_id}, room=str(user_id))
+    emit_conversation_update(user_id)
     return jsonify({'message': f'Recalculated last_activity_time for {updated} conversations.'})
 
+def _message_cursor(message):
+    # Opaque keyset cursor for a message: its (timestamp, id) position in the conversation
+    return f"{message.timestamp.isoformat()}_{message.id}"
+
+def _parse_message_cursor(cursor):
+    timestamp, _, message_id = cursor.rpartition('_')
+    return datetime.fromisoformat(timestamp), int(message_id)
+
 @app.route('/api/conversations/<int:conversation_id>/messages')
 @login_required
 def get_conversation_messages(conversation_id):
+    # Keyset pagination on (timestamp, id): ?limit=N returns the newest page, ?before=<cursor>
+    # the page of older messages and ?after=<cursor> the page of newer ones. Messages in a page
+    # are always oldest first.
     user_id = current_user.id
     conversation = Conversation.query.filter_by(id=conversation_id, user_id=user_id).first_or_404()
-    messages = Message.query.filter_by(conversation_id=conversation.id).order_by(Message.timestamp.asc()).all()
+
+    limit = min(max(request.args.get('limit', MESSAGE_PAGE_SIZE, type=int), 1), MESSAGE_PAGE_SIZE_MAX)
+    before = request.args.get('before')
+    after = request.args.get('after')
+    try:
+        before = _parse_message_cursor(before) if before else None
+        after = _parse_message_cursor(after) if after else None
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor.'}), 400
+
+    query = Message.query.filter(Message.conversation_id == conversation.id)
+    if after:
+        timestamp, message_id = after
+        query = query.filter(db.or_(
+            Message.timestamp > timestamp,
+            db.and_(Message.timestamp == timestamp, Message.id > message_id)
+        )).order_by(Message.timestamp.asc(), Message.id.asc())
+    else:
+        if before:
+            timestamp, message_id = before
+            query = query.filter(db.or_(
+                Message.timestamp < timestamp,
+                db.and_(Message.timestamp == timestamp, Message.id < message_id)
+            ))
+        query = query.order_by(Message.timestamp.desc(), Message.id.desc())
+
+    # Fetch one extra row to know whether another page exists in that direction
+    messages = query.limit(limit + 1).all()
+    # Archived messages are only read when the page reaches back past the newest of them
+    archived_through = conversation.archived_through
+    if archived_through and (
+        (after and after[0] <= archived_through) or
+        (not after and (len(messages) <= limit or messages[-1].timestamp <= archived_through))
+    ):
+        messages += archived_messages_page(conversation.id, limit + 1, before, after)
+        messages.sort(key=lambda message: (message.timestamp, message.id), reverse=not after)
+        messages = messages[:limit + 1]
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if not after:
+        messages.reverse()
 
     message_list = []
     for msg in messages:
@@ -640,16 +2091,97 @@ def get_conversation_messages(conversation_id):
             'timestamp': msg.timestamp.isoformat() + 'Z' # Ensure Z for UTC
         })
 
-    contact_name = conversation.contact.name if conversation.contact and conversation.contact.name else format_phone_number_e164(conversation.contact.phone_number) if conversation.contact else None
-    phone_number = format_phone_number_e164(conversation.contact.phone_number) if conversation.contact and conversation.contact.phone_number else None
+    # Stored contact numbers are already E.164, no need to parse them again
+    contact_name = conversation.contact.name if conversation.contact and conversation.contact.name else conversation.contact.phone_number if conversation.contact else None
+    phone_number = conversation.contact.phone_number if conversation.contact and conversation.contact.phone_number else None
 
     return jsonify({
         'conversation_id': conversation.id,
         'contact_name': contact_name,
         'phone_number': phone_number,
-        'messages': message_list
+        'messages': message_list,
+        'before_cursor': _message_cursor(messages[0]) if messages else None, # Pass as ?before= for older messages
+        'after_cursor': _message_cursor(messages[-1]) if messages else None, # Pass as ?after= for newer messages
+        'has_more_before': has_more if not after else True, # Paging forward from a cursor: that message is older
+        'has_more_after': has_more if after else before is not None # Paging back from a cursor: that message is newer
     })
 
+EXPORT_COLUMNS = ['conversation_id', 'contact_phone', 'contact_name', 'message_id', 'sender', 'timestamp', 'body', 'provider_sid']
+
+def _export_rows(user_id, conversation_id=None):
+    # Every message of the user (or of one conversation), archived ones included, ordered by conversation
+    # then time. Both sources are read through streaming cursors and merged, so memory stays constant.
+    criteria = [Conversation.user_id == user_id]
+    if conversation_id is not None:
+        criteria.append(Conversation.id == conversation_id)
+    hot = db.session.execute(
+        db.select(Message.conversation_id, Contact.phone_number, Contact.name, Message.id, Message.sender,
+                  Message.timestamp, Message.body, Message.provider_sid)
+        .join(Conversation, Conversation.id == Message.conversation_id)
+        .join(Contact, Contact.id == Conversation.contact_id)
+        .where(*criteria)
+        .order_by(Message.conversation_id, Message.timestamp.asc().nulls_last(), Message.id) # Same NULL order on every database
+        .execution_options(yield_per=EXPORT_BATCH_SIZE) # Server-side cursor on PostgreSQL
+    )
+
+    def archived():
+        segments = db.session.execute(
+            db.select(MessageArchiveSegment.conversation_id, MessageArchiveSegment.messages, Contact.phone_number, Contact.name)
+            .join(Conversation, Conversation.id == MessageArchiveSegment.conversation_id)
+            .join(Contact, Contact.id == Conversation.contact_id)
+            .where(*criteria)
+            .order_by(MessageArchiveSegment.conversation_id, MessageArchiveSegment.first_timestamp, MessageArchiveSegment.first_message_id)
+            .execution_options(yield_per=16) # Segments are up to MESSAGE_ARCHIVE_SEGMENT_SIZE messages each
+        )
+        for segment in segments:
+            for message in _unpack_archive_segment(segment):
+                yield (segment.conversation_id, segment.phone_number, segment.name, message.id, message.sender,
+                       message.timestamp, message.body, message.provider_sid)
+
+    # The key must order rows exactly like the queries do: NULL timestamps last (archived messages always have one)
+    return heapq.merge(hot, archived(), key=lambda row: (row[0], row[5] is None, row[5] or datetime.min, row[3]))
+
+def _export_response(user_id, conversation_id=None):
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'error': 'Unsupported export format, use csv or ndjson.'}), 400
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if export_format == 'csv':
+            writer.writerow(EXPORT_COLUMNS)
+        for count, row in enumerate(_export_rows(user_id, conversation_id), 1):
+            values = list(row)
+            values[5] = values[5].isoformat() + 'Z' if values[5] else None # Ensure Z for UTC
+            if export_format == 'csv':
+                writer.writerow(values)
+            else:
+                buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, values))) + '\n')
+            if count % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                eventlet.sleep(0) # Database reads do not yield to the hub; let other requests run between batches
+        yield buffer.getvalue()
+
+    name = f"messages-{f'conversation-{conversation_id}' if conversation_id else 'all'}-{datetime.utcnow():%Y%m%d}.{export_format}"
+    return Response(stream_with_context(generate()),
+                    mimetype='text/csv' if export_format == 'csv' else 'application/x-ndjson',
+                    headers={'Content-Disposition': f'attachment; filename="{name}"'})
+
+@app.route('/api/export/messages')
+@login_required
+def export_messages():
+    # Streams every message of the account as ?format=csv (default) or ndjson
+    return _export_response(current_user.id)
+
+@app.route('/api/conversations/<int:conversation_id>/export')
+@login_required
+def export_conversation_messages(conversation_id):
+    conversation = Conversation.query.filter_by(id=conversation_id, user_id=current_user.id).first_or_404()
+    return _export_response(current_user.id, conversation.id)
+
 @app.route('/api/conversations/<int:conversation_id>/mark_read', methods=['POST'])
 @login_required
 def mark_conversation_as_read(conversation_id):
@@ -658,11 +2190,18 @@ def mark_conversation_as_read(conversation_id):
 
     print(f"Attempting to mark conversation {conversation_id} as read. Current last_read_timestamp: {conversation.last_read_timestamp}")
 
-    if conversation.last_read_timestamp is None or conversation.last_read_timestamp < datetime.utcnow():
-        conversation.last_read_timestamp = datetime.utcnow()
+    now = datetime.utcnow()
+    if conversation.last_read_timestamp is None or conversation.last_read_timestamp < now:
+        # One statement, so an inbound message whose unread increment lands between our read of the
+        # row and this write is not lost: the count is recomputed from the messages newer than now
+        unread = db.session.query(db.func.count(Message.id)).filter(
+            Message.conversation_id == Conversation.id, Message.sender == 'contact', Message.timestamp > now
+        ).scalar_subquery()
+        Conversation.query.filter_by(id=conversation_id, user_id=user_id) \
+            .update({Conversation.last_read_timestamp: now, Conversation.unread_count: unread}, synchronize_session=False)
         db.session.commit()
-        print(f"Conversation {conversation_id} marked as read. New last_read_timestamp: {conversation.last_read_timestamp}")
-        socketio.emit('conversation_update', {'user_id': current_user.id}, room=str(current_user.id)) # Notify for unread count update
+        print(f"Conversation {conversation_id} marked as read. New last_read_timestamp: {now}")
+        emit_conversation_update(current_user.id, [conversation_id]) # Notify for unread count update
     else:
         print(f"Conversation {conversation_id} already read (or timestamp is future). No update needed.")
 
@@ -688,12 +2227,15 @@ def start_conversation():
         # Use provided contact_name_input, otherwise default to phone number for display
         display_name = contact_name_input if contact_name_input else p_num
         contact, conversation = get_or_create_contact_and_conversation(p_num, current_user.id, display_name)
-        if initial_message:
-            success, feedback = send_sms(p_num, initial_message, conversation.id)
-            conversations_started.append({'phone': p_num, 'conversation_id': conversation.id, 'status': feedback})
-        else:
-            conversations_started.append({'phone': p_num, 'conversation_id': conversation.id, 'status': 'Conversation started without initial message.'})
-    
+        conversations_started.append({'phone': p_num, 'conversation_id': conversation.id, 'status': 'Conversation started without initial message.'})
+    if initial_message:
+        # The initial messages go out concurrently through the outbound dispatcher
+        results = send_sms_batch([(current_user, started['phone'], initial_message, started['conversation_id'])
+                                  for started in conversations_started])
+        for started, (success, feedback) in zip(conversations_started, results):
+            started['status'] = feedback
+
+    emit_conversation_update(current_user.id, [started['conversation_id'] for started in conversations_started])
     return jsonify({'message': 'Conversations initiated.', 'conversations': conversations_started}), 200
 
 @app.route('/api/send_message/<int:conversation_id>', methods=['POST'])
@@ -725,10 +2267,21 @@ def twilio_webhook():
 
     print(f"[DEBUG] Incoming Twilio Message SID: {message_sid}, From: {from_number}, To: {to_number}, Body: {message_body}")
 
+    # Twilio retries deliveries it considers slow; a SID we stored recently is acknowledged without any DB work
+    if is_known_message_sid(message_sid):
+        print(f"[DEBUG] Duplicate delivery of {message_sid} ignored.")
+        return Response(str(MessagingResponse()), mimetype='text/xml')
+
     # Normalize numbers to E.164
     formatted_from_number = format_phone_number_e164(from_number)
     formatted_to_number = format_phone_number_e164(to_number)
 
+    # Fast path: a reply in a conversation we have already routed is a single insert and commit
+    routed_user_id = webhook_routes.user_for(formatted_to_number)
+    routed_conversation_id = webhook_routes.conversation_for(routed_user_id, formatted_from_number) if routed_user_id else None
+    if routed_conversation_id:
+        return _store_inbound_message(routed_user_id, routed_conversation_id, message_sid, message_body)
+
     target_user = None
     conversation = None
 
@@ -743,6 +2296,7 @@ def twilio_webhook():
     user_with_twilio_number = User.query.filter_by(twilio_phone_number=formatted_to_number).first()
 
     if user_with_twilio_number:
+        webhook_routes.remember_user(formatted_to_number, user_with_twilio_number.id)
         print(f"[DEBUG] Found user {user_with_twilio_number.id} ({user_with_twilio_number.email}) with matching Twilio number.")
         contact = Contact.query.filter_by(user_id=user_with_twilio_number.id, phone_number=formatted_from_number).first()
         if contact:
@@ -750,6 +2304,7 @@ def twilio_webhook():
             conversation = Conversation.query.filter_by(user_id=user_with_twilio_number.id, contact_id=contact.id).first()
             if conversation:
                 target_user = user_with_twilio_number
+                webhook_routes.remember_conversation(target_user.id, formatted_from_number, conversation.id)
                 print(f"[DEBUG] Found existing conversation {conversation.id} for user {target_user.id}.")
             else:
                 print("[DEBUG] No existing conversation found for this user and contact. Creating new conversation.")
@@ -793,35 +2348,34 @@ def twilio_webhook():
         print("[ERROR] After all attempts, target_user or conversation is still None. Cannot process message.")
         return Response(str(MessagingResponse()), mimetype='text/xml')
 
+    return _store_inbound_message(target_user.id, conversation.id, message_sid, message_body)
+
+def _store_inbound_message(user_id, conversation_id, message_sid, message_body):
+    # Write an inbound message and bump its conversation in one transaction, then notify clients
+    row = {
+        'conversation_id': conversation_id,
+        'sender': 'contact',
+        'body': message_body,
+        'timestamp': datetime.utcnow(),
+        'provider_sid': message_sid
+    }
     try:
-        new_message = Message(
-            conversation_id=conversation.id,
-            sender='contact',
-            body=message_body,
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(new_message)
-        
-        # Update conversation's last_activity_time to the current message's timestamp
-        conversation.last_activity_time = new_message.timestamp
-        db.session.add(conversation) # Mark conversation for update
-        
-        db.session.commit() # Commit new message and conversation update
-        print(f"[DEBUG] Committed new message {new_message.id} and updated conversation {conversation.id} last_activity_time to {conversation.last_activity_time}")
-
-        # Emit real-time updates
-        # Emit to the specific conversation room for message display
-        socketio.emit('new_message', {
-            'conversation_id': conversation.id,
-            'sender': new_message.sender,
-            'body': new_message.body,
-            'timestamp': new_message.timestamp.isoformat() + 'Z'
-        }, room=str(conversation.id))
-        print(f"[DEBUG] Emitted 'new_message' to room {conversation.id}")
-
-        # Emit a user-specific update to refresh the conversation list in the left pane
-        socketio.emit('conversation_update', {'user_id': target_user.id}, room=str(target_user.id))
-        print(f"[DEBUG] Emitted 'conversation_update' to user room {target_user.id}")
+        if WEBHOOK_WRITE_MODE != 'sync':
+            stored = inbound_writes.append(user_id, row)
+            if WEBHOOK_WRITE_MODE == 'group':
+                stored.wait() # Reply only once the batch holding this message is committed
+            return Response(str(MessagingResponse()), mimetype='text/xml')
+
+        inserted = insert_messages([row])
+        if not inserted:
+            # Already stored by an earlier delivery of the same MessageSid
+            db.session.commit()
+            print(f"[DEBUG] Duplicate delivery of {message_sid} ignored.")
+            return Response(str(MessagingResponse()), mimetype='text/xml')
+
+        db.session.commit() # Commit new message and conversation update (done by insert_messages)
+        print(f"[DEBUG] Committed new message {inserted[0].id} and updated conversation {conversation_id} last_activity_time to {row['timestamp']}")
+        _emit_inbound_messages(user_id, inserted)
 
         resp = MessagingResponse()
         return Response(str(resp), mimetype='text/xml')
@@ -833,6 +2387,121 @@ def twilio_webhook():
         resp.message("An error occurred while processing your message.") # Or a more generic error
         return Response(str(resp), mimetype='text/xml')
 
+def _emit_inbound_messages(user_id, inserted):
+    # Emit real-time updates for committed inbound messages of one user
+    for message in inserted:
+        # Emit to the specific conversation room for message display
+        socketio_emits.queue('new_messages', {
+            'conversation_id': message.conversation_id,
+            'sender': 'contact',
+            'body': message.body,
+            'timestamp': message.timestamp.isoformat() + 'Z'
+        }, room=str(message.conversation_id))
+        print(f"[DEBUG] Queued 'new_messages' to room {message.conversation_id}")
+
+    # Emit a user-specific update to refresh the conversation list in the left pane
+    emit_conversation_update(user_id, list(dict.fromkeys(message.conversation_id for message in inserted)))
+    print(f"[DEBUG] Queued 'conversation_update' to user room {user_id}")
+
+# Group commit for inbound messages (WEBHOOK_WRITE_MODE group or ack). Webhook requests append their
+# message to a per-process buffer; a background green thread writes everything buffered with one
+# multi-row insert and one commit, WEBHOOK_FLUSH_MS after the first message or as soon as
+# WEBHOOK_FLUSH_MAX_BATCH are waiting. append() returns an event that fires once the message is durable.
+class InboundWriteBuffer:
+    def __init__(self, flush_seconds, max_batch, samples=1000):
+        self.flush_seconds = flush_seconds
+        self.max_batch = max_batch
+        self._pending = [] # (user_id, row, event, appended_at)
+        self._lock = threading.Lock()
+        self._batch_sizes = deque(maxlen=samples) # Recent flushes, for the percentiles in stats()
+        self._flush_ms = deque(maxlen=samples) # Insert + commit time
+        self._wait_ms = deque(maxlen=samples) # Oldest message of the batch: appended -> committed
+        self.counters = {'batches': 0, 'messages': 0, 'duplicates': 0, 'failed_batches': 0, 'failed_messages': 0}
+
+    def append(self, user_id, row):
+        done = eventlet.event.Event()
+        with self._lock:
+            self._pending.append((user_id, row, done, time.monotonic()))
+            if len(self._pending) == 1:
+                eventlet.spawn_after(self.flush_seconds, self.flush)
+            elif len(self._pending) == self.max_batch:
+                eventlet.spawn_n(self.flush)
+        return done
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return # Already taken by a size-triggered flush
+        start = time.monotonic()
+        failures = {} # batch index -> exception
+        try:
+            inserted = self._write([row for _, row, _, _ in batch])
+        except Exception as e:
+            # One bad row (e.g. a conversation deleted meanwhile) must not fail the whole batch:
+            # write the rows one at a time so only the ones that really fail get the error reply
+            print(f"[ERROR] Failed to write {len(batch)} buffered inbound messages, retrying them one by one: {e}")
+            inserted = []
+            for index, (_, row, _, _) in enumerate(batch):
+                try:
+                    inserted.extend(self._write([row]))
+                except Exception as e:
+                    print(f"[ERROR] Failed to write buffered inbound message {row['provider_sid']}: {e}")
+                    failures[index] = e
+            with self._lock:
+                self.counters['failed_batches'] += 1
+                self.counters['failed_messages'] += len(failures)
+
+        now = time.monotonic()
+        with self._lock:
+            self.counters['batches'] += 1
+            self.counters['messages'] += len(batch) - len(failures)
+            self.counters['duplicates'] += len(batch) - len(failures) - len(inserted)
+            self._batch_sizes.append(len(batch))
+            self._flush_ms.append((now - start) * 1000)
+            self._wait_ms.append((now - batch[0][3]) * 1000)
+        print(f"[DEBUG] Group commit of {len(batch)} inbound messages ({len(inserted)} new) in {(now - start) * 1000:.1f} ms")
+        for index, (_, _, done, _) in enumerate(batch):
+            if index in failures:
+                done.send_exception(failures[index])
+            else:
+                done.send(True)
+
+        user_for_conversation = {row['conversation_id']: user_id for user_id, row, _, _ in batch}
+        inserted_by_user = {}
+        for message in inserted:
+            inserted_by_user.setdefault(user_for_conversation[message.conversation_id], []).append(message)
+        with app.app_context():
+            for user_id, messages in inserted_by_user.items():
+                _emit_inbound_messages(user_id, messages)
+
+    def _write(self, rows):
+        # Insert and commit in a fresh app context (flushes run outside any request)
+        with app.app_context():
+            try:
+                inserted = insert_messages(rows)
+                db.session.commit()
+                return inserted
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters, pending=len(self._pending))
+            samples = {'batch_size': sorted(self._batch_sizes), 'flush_ms': sorted(self._flush_ms), 'wait_ms': sorted(self._wait_ms)}
+        for name, values in samples.items():
+            if values:
+                stats[name] = {
+                    'mean': round(sum(values) / len(values), 2),
+                    'p50': round(values[len(values) // 2], 2),
+                    'p99': round(values[min(len(values) - 1, len(values) * 99 // 100)], 2),
+                    'max': round(values[-1], 2),
+                }
+        return stats
+
+inbound_writes = InboundWriteBuffer(WEBHOOK_FLUSH_MS / 1000, WEBHOOK_FLUSH_MAX_BATCH)
+
 @socketio.on('connect')
 def handle_connect():
     print("Client connected!")
@@ -879,12 +2548,8 @@ def send_multiple():
     message_body = request.form['message']
     to_numbers = [num.strip() for num in to_numbers_str.split(',') if num.strip()]
 
-    results = []
-    for number in to_numbers:
-        success, feedback_message = send_sms(number, message_body)
-        results.append(feedback_message)
-    
-    return render_template('index.html', message='\n'.join(results))
+    results = send_sms_batch([(current_user, number, message_body, None) for number in to_numbers])
+    return render_template('index.html', message='\n'.join(feedback_message for _, feedback_message in results))
 
 @app.route('/send_bulk', methods=['POST'])
 @login_required
@@ -895,11 +2560,9 @@ def send_bulk():
     if not contacts:
         return render_template('index.html', message="No contacts found in Google Sheet or error retrieving them.")
 
-    results = []
-    for contact in contacts:
-        success, feedback_message = send_sms(contact['phone'], message_body)
-        results.append(f"To {contact['name']} ({contact['phone']}): {feedback_message}") # Use Name if available
-    
+    results = send_sms_batch([(current_user, contact['phone'], message_body, None) for contact in contacts])
+    results = [f"To {contact['name']} ({contact['phone']}): {feedback_message}" # Use Name if available
+               for contact, (_, feedback_message) in zip(contacts, results)]
     return render_template('index.html', message='\n'.join(results))
 
 @app.route('/settings')
@@ -935,10 +2598,17 @@ def configure_twilio():
         return jsonify({'error': 'This Twilio phone number is already associated with another account.'}), 409 # Conflict
 
     try:
-        current_user.twilio_account_sid = account_sid
-        current_user.twilio_auth_token = auth_token
-        current_user.twilio_phone_number = formatted_phone_number
+        user = db.session.get(User, current_user.id) # current_user is a detached snapshot; change the stored row
+        if user.twilio_account_sid:
+            twilio_client_pool.invalidate(user.twilio_account_sid) # Drop clients built with the old credentials
+        if user.twilio_phone_number:
+            webhook_routes.forget_user(user.twilio_phone_number) # Inbound traffic to the old number is no longer ours
+        user.twilio_account_sid = account_sid
+        user.twilio_auth_token = auth_token
+        user.twilio_phone_number = formatted_phone_number
         db.session.commit()
+        invalidate_user(user.id)
+        webhook_routes.remember_user(formatted_phone_number, user.id)
         print(f"Successfully committed Twilio credentials for user {current_user.id}.")
         return jsonify({'message': 'Twilio credentials saved successfully!'}), 200
     except Exception as e:
@@ -949,6 +2619,7 @@ def configure_twilio():
 if __name__ == '__main__':
     with app.app_context():
         db.create_all() # Create database tables within the application context
+        webhook_routes.warm()
     # Use eventlet for Gunicorn deployment, remove ssl_context
     if os.environ.get("FLASK_ENV") == "production": # Check for production environment
         socketio.run(app, host='0.0.0.0', port=int(os.environ.get("PORT", 5000)), debug=False, logger=False, engineio_logger=False)
@@ -964,110 +2635,202 @@ def trigger_twilio_history_import():
        not current_user.twilio_phone_number:
         return jsonify({'error': 'Twilio credentials not configured for your account.'}), 400
     
-    # In a real application, this would be a long-running task, possibly in a background job.
-    # For simplicity, we'll run it synchronously for now.
-    # success, message = import_twilio_history_for_user(current_user)
-    
-    # Run the import in a separate greenlet to avoid blocking the main event loop
-    eventlet.spawn(import_twilio_history_for_user, current_user._get_current_object())
+    # Run the import in a separate greenlet to avoid blocking the main event loop.
+    # Progress is reported to the user's SocketIO room as 'import_progress' events.
+    eventlet.spawn(_run_in_app_context, import_twilio_history_for_user, current_user.id)
     
     # Return immediately, the import will proceed in the background
-    return jsonify({'message': 'Twilio history import initiated in the background. Check server logs for progress.'}), 202 # 202 Accepted for background processing
+    return jsonify({'message': 'Twilio history import initiated in the background.'}), 202 # 202 Accepted for background processing
 
-def import_twilio_history_for_user(user):
+def _run_in_app_context(function, *args, **kwargs):
+    # Background greenlets do not inherit the request's application context
+    with app.app_context():
+        return function(*args, **kwargs)
+
+def upsert_contacts(user_id, contacts, rename=True):
+    # Set-based create-or-rename of a user's contacts. contacts is a sequence of (phone_number_e164, name)
+    # in input order; later entries for the same number see the effect of earlier ones. With rename=True
+    # a non-empty name replaces a different stored name (sheet name import); with rename=False it only
+    # fills a blank name, like get_or_create_contact_and_conversation. Returns (created, updated, skipped)
+    # counted per entry. Does not commit.
+    contacts = [(phone_number, name or '') for phone_number, name in contacts if phone_number]
+    phone_numbers = list(dict.fromkeys(phone_number for phone_number, _ in contacts))
+
+    # Prefetch the stored names of every number in a few IN queries
+    stored = {}
+    for start in range(0, len(phone_numbers), CONTACT_UPSERT_BATCH_SIZE):
+        stored.update(db.session.query(Contact.phone_number, Contact.name).filter(
+            Contact.user_id == user_id, Contact.phone_number.in_(phone_numbers[start:start + CONTACT_UPSERT_BATCH_SIZE])))
+
+    created = updated = skipped = 0
+    names = dict(stored) # phone -> name after applying the entries so far
+    for phone_number, name in contacts:
+        if phone_number not in names:
+            names[phone_number] = name
+            created += 1
+        elif name and names[phone_number] != name and (rename or not names[phone_number]):
+            names[phone_number] = name
+            updated += 1
+        else:
+            skipped += 1
+
+    rows = [{'user_id': user_id, 'phone_number': phone_number, 'name': name}
+            for phone_number, name in names.items() if phone_number not in stored or stored[phone_number] != name]
+    if not rows:
+        return created, updated, skipped
+
+    table = Contact.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        for start in range(0, len(rows), CONTACT_UPSERT_BATCH_SIZE):
+            statement = insert(table).values(rows[start:start + CONTACT_UPSERT_BATCH_SIZE])
+            # ON CONFLICT (user_id, phone_number): a concurrent insert of the same number is renamed, not duplicated
+            db.session.execute(statement.on_conflict_do_update(
+                index_elements=['user_id', 'phone_number'],
+                set_={'name': statement.excluded.name},
+                where=None if rename else or_(table.c.name.is_(None), table.c.name == '')
+            ))
+    else:
+        new_rows = [row for row in rows if row['phone_number'] not in stored]
+        renamed = [{'b_phone_number': row['phone_number'], 'b_name': row['name']} for row in rows if row['phone_number'] in stored]
+        if new_rows:
+            db.session.execute(table.insert(), new_rows)
+        if renamed:
+            db.session.execute(table.update().where(
+                table.c.user_id == user_id, table.c.phone_number == bindparam('b_phone_number')
+            ).values(name=bindparam('b_name')), renamed)
+    return created, updated, skipped
+
+def get_or_create_conversations_bulk(user_id, phone_numbers_e164):
+    # Set-based variant of get_or_create_contact_and_conversation for many numbers at once:
+    # one query for existing contacts, one for their conversations, then bulk inserts for the rest.
+    # Returns {phone_number_e164: conversation}. Flushes but does not commit.
+    phone_numbers = {phone_number for phone_number in phone_numbers_e164 if phone_number}
+    if not phone_numbers:
+        return {}
+
+    contacts = {contact.phone_number: contact for contact in Contact.query.filter(
+        Contact.user_id == user_id, Contact.phone_number.in_(phone_numbers))}
+    new_contacts = [Contact(user_id=user_id, phone_number=phone_number, name='')
+                    for phone_number in phone_numbers if phone_number not in contacts]
+    if new_contacts:
+        db.session.add_all(new_contacts)
+        db.session.flush() # Flush to get contact ids
+        contacts.update((contact.phone_number, contact) for contact in new_contacts)
+
+    contact_ids = [contact.id for contact in contacts.values()]
+    conversations = {conversation.contact_id: conversation for conversation in Conversation.query.filter(
+        Conversation.user_id == user_id, Conversation.contact_id.in_(contact_ids))}
+    new_conversations = [Conversation(user_id=user_id, contact_id=contact_id)
+                         for contact_id in contact_ids if contact_id not in conversations]
+    if new_conversations:
+        db.session.add_all(new_conversations)
+        db.session.flush() # Flush to get conversation ids
+        conversations.update((conversation.contact_id, conversation) for conversation in new_conversations)
+
+    return {phone_number: conversations[contact.id] for phone_number, contact in contacts.items()}
+
+def _import_twilio_message_page(user, records):
+    # Import one page of Twilio message records: normalize, dedupe and insert in bulk
+    from_numbers_e164 = format_phone_numbers_e164([record.from_ for record in records])
+    to_numbers_e164 = format_phone_numbers_e164([record.to for record in records])
+
+    candidates = [] # (record, app_sender, contact_phone, timestamp)
+    for record, twilio_from_e164, twilio_to_e164 in zip(records, from_numbers_e164, to_numbers_e164):
+        if record.date_sent is None: # Not sent yet (queued/failed); picked up by a later import
+            continue
+        # Determine sender and recipient in the context of our app
+        if twilio_from_e164 == user.twilio_phone_number: # User sent the message
+            app_sender, contact_phone = 'user', twilio_to_e164
+        elif twilio_to_e164 == user.twilio_phone_number: # User received the message
+            app_sender, contact_phone = 'contact', twilio_from_e164
+        else:
+            continue # Not relevant to this user's Twilio number
+        # Skip if contact_phone is the user's own Twilio number (e.g., messages to self)
+        if contact_phone == user.twilio_phone_number:
+            continue
+        # Twilio's date_sent is timezone-aware; store timezone-naive UTC like the rest of the app
+        candidates.append((record, app_sender, contact_phone, record.date_sent.replace(tzinfo=None)))
+
+    if not candidates:
+        return 0, None
+    newest = max(candidate[3] for candidate in candidates)
+
+    # Drop messages already stored, by MessageSid: the recent-SID filter first, then one query per page
+    candidates = [candidate for candidate in candidates if not is_known_message_sid(candidate[0].sid)]
+    stored_sids = {sid for (sid,) in db.session.query(Message.provider_sid).filter(
+        Message.provider_sid.in_([candidate[0].sid for candidate in candidates]))} if candidates else set()
+    candidates = [candidate for candidate in candidates if candidate[0].sid not in stored_sids]
+    if not candidates:
+        return 0, newest
+
+    conversations = get_or_create_conversations_bulk(user.id, [candidate[2] for candidate in candidates])
+
+    # Messages stored before SIDs were kept can only be matched on their content
+    timestamps = [candidate[3] for candidate in candidates]
+    legacy = set(db.session.query(Message.conversation_id, Message.sender, Message.body, Message.timestamp).filter(
+        Message.conversation_id.in_({conversation.id for conversation in conversations.values()}),
+        Message.provider_sid.is_(None),
+        Message.timestamp.between(min(timestamps), max(timestamps))
+    ))
+
+    new_rows = []
+    for record, app_sender, contact_phone, timestamp in candidates:
+        conversation = conversations[contact_phone]
+        if (conversation.id, app_sender, record.body, timestamp) in legacy:
+            continue
+        new_rows.append({'conversation_id': conversation.id, 'sender': app_sender, 'body': record.body, 'timestamp': timestamp, 'provider_sid': record.sid})
+    new_rows = _drop_archived_duplicates(new_rows, conversations.values())
+
+    # insert_messages also moves each conversation's last_activity_time forward and updates its summary
+    new_rows = insert_messages(new_rows) if new_rows else []
+    db.session.commit()
+    return len(new_rows), newest
+
+def import_twilio_history_for_user(user_id):
+    user = User.query.get(user_id)
     print(f"Starting Twilio history import for user {user.id} ({user.email})...")
-    # TODO: Implement actual Twilio API calls and database insertion here
+    room = str(user.id)
+    # Twilio filters DateSent by day, so the day of the watermark is fetched again and deduped
+    watermark = user.twilio_history_synced_at
+    newest_imported = None
+    imported_count = 0
+    pages = 0
     try:
-        client = Client(user.twilio_account_sid, user.twilio_auth_token)
-        # Fetch messages
-        # messages = client.messages.list(to=user.twilio_phone_number, limit=100) # Example: fetch messages sent to user's Twilio number
-        # messages = client.messages.list(from_=user.twilio_phone_number, limit=100) # Example: fetch messages sent from user's Twilio number
-        
-        # To get all messages (sent and received) related to the user's Twilio number,
-        # we'll fetch messages where the user's Twilio number is either 'from' or 'to'.
-        # This might require two separate queries and merging/deduplicating, or iterating more broadly.
-        
-        # A more robust approach would be to iterate through all messages in the account
-        # and filter them by the user's Twilio number.
-        
-        # Let's simplify for now: fetch all messages for the account and filter by the user's Twilio number
-        all_messages = client.messages.list()
-        
-        print(f"Fetched {len(all_messages)} total messages from Twilio account.")
-        
-        imported_count = 0
-        for message_record in all_messages:
-            # Normalize Twilio message numbers to E.164 for reliable comparison
-            twilio_from_e164 = format_phone_number_e164(message_record.from_)
-            twilio_to_e164 = format_phone_number_e164(message_record.to)
-            
-            print(f"  Processing Twilio message SID: {message_record.sid}, From: {twilio_from_e164}, To: {twilio_to_e164}")
-            print(f"  User's Twilio number (E.164): {user.twilio_phone_number}")
+        client = get_twilio_client(user)
+        # Page through only this number's traffic, received then sent, server-side filtered by the watermark
+        for direction in ({'to': user.twilio_phone_number}, {'from_': user.twilio_phone_number}):
+            filters = dict(direction, page_size=TWILIO_IMPORT_PAGE_SIZE)
+            if watermark:
+                filters['date_sent_after'] = watermark
+            page = client.messages.page(**filters)
+            while page is not None:
+                records = list(page)
+                count, newest = _import_twilio_message_page(user, records)
+                imported_count += count
+                pages += 1
+                if newest and (newest_imported is None or newest > newest_imported):
+                    newest_imported = newest
+                socketio.emit('import_progress', {'status': 'running', 'pages': pages, 'imported': imported_count}, room=room)
+                page = page.next_page()
+
+        # Advance the watermark only once both directions are complete, since Twilio lists newest
+        # first and an interrupted import must fetch the older pages again next time
+        if newest_imported and (watermark is None or newest_imported > watermark):
+            user.twilio_history_synced_at = newest_imported
+            db.session.commit()
+            invalidate_user(user.id)
 
-            is_from_user_twilio = (twilio_from_e164 == user.twilio_phone_number)
-            is_to_user_twilio = (twilio_to_e164 == user.twilio_phone_number)
-            
-            if not (is_from_user_twilio or is_to_user_twilio):
-                print(f"  Skipping message {message_record.sid}: not relevant to user's Twilio number.")
-                continue # Skip messages not involving this user's Twilio number
-
-            # Determine sender and recipient in the context of our app
-            if is_from_user_twilio: # User sent the message
-                app_sender = 'user'
-                contact_phone = message_record.to
-            else: # User received the message
-                app_sender = 'contact'
-                contact_phone = message_record.from_
-            
-            # Skip if contact_phone is the user's own Twilio number (e.g., messages to self)
-            if format_phone_number_e164(contact_phone) == user.twilio_phone_number:
-                continue
-
-            # Convert Twilio timestamp to datetime object
-            # Twilio timestamp is typically in RFC 2822 format or similar, can be parsed by datetime.fromisoformat
-            # Example: 'Thu, 24 Sep 2025 10:00:00 +0000'
-            # Twilio's date_sent is a datetime object directly
-            # Convert it to timezone-naive UTC for consistency with database entries
-            message_timestamp = message_record.date_sent.replace(tzinfo=None)
-
-            # Get or create contact and conversation
-            contact, conversation = get_or_create_contact_and_conversation(contact_phone, user.id)
-
-            # Check for existing message to avoid duplicates
-            existing_message = Message.query.filter_by(
-                conversation_id=conversation.id,
-                sender=app_sender,
-                body=message_record.body,
-                timestamp=message_timestamp # Exact timestamp match
-            ).first()
-            
-            if existing_message:
-                # print(f"Skipping duplicate message: {message_record.sid}")
-                continue # Skip if message already exists
-
-            new_message = Message(
-                conversation_id=conversation.id,
-                sender=app_sender,
-                body=message_record.body,
-                timestamp=message_timestamp
-            )
-            db.session.add(new_message)
-
-            # Update conversation's last_activity_time if this message is more recent
-            if conversation.last_activity_time is None or new_message.timestamp > conversation.last_activity_time:
-                conversation.last_activity_time = new_message.timestamp
-                
-            imported_count += 1
-            # print(f"Imported message: {message_record.sid}")
-        
-        db.session.commit()
         print(f"Successfully imported {imported_count} messages for user {user.id}.")
-        # Emit a global update or a user-specific update to refresh UI
-        socketio.emit('conversation_update', {'user_id': user.id}, room=str(user.id))
+        socketio.emit('import_progress', {'status': 'completed', 'pages': pages, 'imported': imported_count}, room=room)
+        # Emit a user-specific update to refresh UI
+        emit_conversation_update(user.id)
         return True, f"Successfully imported {imported_count} historical Twilio messages."
     except Exception as e:
         db.session.rollback()
         print(f"Error importing Twilio history for user {user.id}: {e}")
+        socketio.emit('import_progress', {'status': 'failed', 'pages': pages, 'imported': imported_count, 'error': str(e)}, room=room)
         return False, f"Error importing Twilio history: {e}"
 
 @app.route('/api/apply_sheet_contacts', methods=['POST'])
@@ -1079,39 +2842,18 @@ def apply_sheet_contacts():
         if not isinstance(contacts, list) or not contacts:
             return jsonify({'error': 'No contacts provided.'}), 400
 
-        updated = 0
-        created = 0
-        skipped = 0
-
-        for item in contacts:
-            raw_phone = (item.get('phone_number') or '').strip()
-            name = (item.get('name') or '').strip()
-            if not raw_phone:
-                skipped += 1
-                continue
-
-            phone_e164 = format_phone_number_e164(raw_phone)
-            if not phone_e164:
-                skipped += 1
-                continue
-
-            contact = Contact.query.filter_by(user_id=current_user.id, phone_number=phone_e164).first()
-            if contact:
-                if name and contact.name != name:
-                    contact.name = name
-                    db.session.add(contact)
-                    updated += 1
-                else:
-                    skipped += 1
-            else:
-                # Create a contact so future conversations have a name
-                contact = Contact(user_id=current_user.id, phone_number=phone_e164, name=name)
-                db.session.add(contact)
-                created += 1
+        raw_phones = [(item.get('phone_number') or '').strip() for item in contacts]
+        phones_e164 = format_phone_numbers_e164(raw_phones)
+        names = [(item.get('name') or '').strip() for item in contacts]
+
+        # Rows without a usable phone number are skipped; the rest are created or renamed in bulk
+        valid = [(phone_e164, name) for raw_phone, phone_e164, name in zip(raw_phones, phones_e164, names) if raw_phone and phone_e164]
+        created, updated, skipped = upsert_contacts(current_user.id, valid)
+        skipped += len(contacts) - len(valid)
 
         db.session.commit()
         # Refresh conversation list for this user
-        socketio.emit('conversation_update', {'user_id': current_user.id}, room=str(current_user.id))
+        emit_conversation_update(current_user.id)
         return jsonify({'message': f'Applied names. updated={updated}, created={created}, skipped={skipped}'}), 200
     except Exception as e:
         db.session.rollback()
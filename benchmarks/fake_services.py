@@ -0,0 +1,198 @@
+import argparse
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+
+# Local stand-ins for the Twilio REST API and the Google Sheets/Drive APIs, serving just the
+# calls app.py makes, from synthetic data. Runs as its own process (see FakeServices) so its
+# work does not count against the app in the benchmarks.
+#
+#   POST /2010-04-01/Accounts/<sid>/Messages.json       send an SMS (recorded, not delivered)
+#   GET  /2010-04-01/Accounts/<sid>/Messages.json       message history pages, newest first
+#   GET  /v4/spreadsheets/<id>[/values/<range>|/values:batchGet]
+#   GET  /drive/v3/files[/<id>]
+#
+# Usage: python -m benchmarks.fake_services --port 8765 [--history-messages 100000] [--sheet-rows 10000]
+
+TWILIO_NUMBER = '+15005550001' # bench user 1's number in benchmarks.seed
+HISTORY_START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+SHEET_HEADERS = ['Name', 'Phone', 'City']
+
+def contact_number(n):
+    # Same numbering as the contacts created by benchmarks.seed.seed_tenant
+    return f'+1415{n:07d}'
+
+class FakeData:
+    def __init__(self, history_messages, contacts, sheet_rows):
+        self.history_messages = history_messages
+        self.contacts = contacts
+        self.sheet_rows = sheet_rows
+        self.sent_count = 0
+        self._lock = threading.Lock()
+
+    def history_message(self, account_sid, i):
+        # Message i of the synthetic history: inbound when i is even, outbound when odd, one minute apart
+        contact = contact_number(i % self.contacts + 1)
+        inbound = i % 2 == 0
+        return {
+            'sid': f'SM{i:032d}',
+            'account_sid': account_sid,
+            'from': contact if inbound else TWILIO_NUMBER,
+            'to': TWILIO_NUMBER if inbound else contact,
+            'body': f'History message {i}',
+            'status': 'received' if inbound else 'delivered',
+            'direction': 'inbound' if inbound else 'outbound-api',
+            'date_sent': format_datetime(HISTORY_START + timedelta(minutes=i)),
+            'num_segments': '1',
+        }
+
+    def history_indexes(self, to_number, from_number, sent_after):
+        # Indexes matching the filters, newest first
+        if to_number == TWILIO_NUMBER:
+            parity = 0
+        elif from_number == TWILIO_NUMBER:
+            parity = 1
+        else:
+            return range(0)
+        first = parity
+        if sent_after: # Twilio filters DateSent>= by day
+            minutes = (sent_after - HISTORY_START).total_seconds() // 60
+            first = max(first, int(minutes) + ((parity - int(minutes)) % 2))
+        return range(self.history_messages - 1 - ((self.history_messages - 1 - parity) % 2), first - 1, -2)
+
+    def sheet_row(self, n):
+        # Data row n (0-based); every tenth phone number is not a contact yet
+        phone = contact_number(n % self.contacts + 1) if n % 10 else f'+1628{n:07d}'
+        return [f'Person {n}', phone, 'Springfield']
+
+    def sheet_values(self, first_row, last_row):
+        # Sheet rows first_row..last_row (1-based, row 1 is the header)
+        values = []
+        for row in range(first_row, min(last_row, self.sheet_rows + 1) + 1):
+            values.append(SHEET_HEADERS if row == 1 else self.sheet_row(row - 2))
+        return values
+
+    def record_send(self):
+        with self._lock:
+            self.sent_count += 1
+            return self.sent_count
+
+A1_RANGE = re.compile(r"!A(\d+)?:Z(\d+)?$")
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    data = None # FakeData, set by serve()
+    latency = 0 # Seconds added to every response, to mimic a network round trip
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True # Headers and body are separate writes; avoid delayed-ACK stalls on keep-alive
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        if self.latency:
+            time.sleep(self.latency)
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode())
+        match = re.fullmatch(r'/2010-04-01/Accounts/([^/]+)/Messages\.json', url.path)
+        if not match:
+            return self._send_json({'message': 'Not found'}, 404)
+        count = self.data.record_send()
+        self._send_json({
+            'sid': 'SM' + uuid.uuid4().hex,
+            'account_sid': match.group(1),
+            'from': form.get('From', [''])[0],
+            'to': form.get('To', [''])[0],
+            'body': form.get('Body', [''])[0],
+            'status': 'queued',
+            'direction': 'outbound-api',
+            'date_sent': None,
+            'num_segments': '1',
+            'uri': f'{url.path[:-5]}/{count}.json',
+        }, 201)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        match = re.fullmatch(r'/2010-04-01/Accounts/([^/]+)/Messages\.json', url.path)
+        if match:
+            return self._messages_page(match.group(1), url.path, query)
+        match = re.fullmatch(r'/v4/spreadsheets/([^/:]+)(/values/(.+)|/values:batchGet)?', url.path)
+        if match:
+            if match.group(2) is None:
+                return self._send_json({'sheets': [{'properties': {
+                    'title': 'Sheet1', 'gridProperties': {'rowCount': self.data.sheet_rows + 1}}}]})
+            if match.group(3):
+                return self._send_json({'range': match.group(3), 'values': self._range_values(match.group(3))})
+            return self._send_json({'valueRanges': [
+                {'range': a1, 'values': self._range_values(a1)} for a1 in query.get('ranges', [])
+            ]})
+        if url.path == '/drive/v3/files':
+            return self._send_json({'files': [{'id': 'bench-sheet', 'name': 'Benchmark contacts'}]})
+        if url.path.startswith('/drive/v3/files/'):
+            return self._send_json({'modifiedTime': '2024-01-01T00:00:00.000Z'})
+        self._send_json({'message': 'Not found'}, 404)
+
+    def _range_values(self, a1):
+        match = A1_RANGE.search(a1)
+        first_row = int(match.group(1) or 1) if match else 1
+        last_row = int(match.group(2) or self.data.sheet_rows + 1) if match else self.data.sheet_rows + 1
+        return self.data.sheet_values(first_row, last_row)
+
+    def _messages_page(self, account_sid, path, query):
+        page_size = int(query.get('PageSize', ['50'])[0])
+        page = int(query.get('Page', ['0'])[0])
+        sent_after = query.get('DateSent>', [None])[0]
+        sent_after = datetime.fromisoformat(sent_after[:10]).replace(tzinfo=timezone.utc) if sent_after else None
+        indexes = self.data.history_indexes(query.get('To', [None])[0], query.get('From', [None])[0], sent_after)
+        window = indexes[page * page_size:(page + 1) * page_size]
+        next_query = dict((key, values[0]) for key, values in query.items())
+        next_query.update({'Page': page + 1, 'PageToken': f'PA{page + 1}'})
+        self._send_json({
+            'messages': [self.data.history_message(account_sid, i) for i in window],
+            'page': page,
+            'page_size': page_size,
+            'uri': self.path,
+            'first_page_uri': path,
+            'previous_page_uri': None,
+            'next_page_uri': f'{path}?{urlencode(next_query)}' if len(indexes) > (page + 1) * page_size else None,
+        })
+
+def serve(port, history_messages, contacts, sheet_rows, latency_ms):
+    FakeServiceHandler.data = FakeData(history_messages, contacts, sheet_rows)
+    FakeServiceHandler.latency = latency_ms / 1000
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeServiceHandler)
+    server.daemon_threads = True
+    print(f'Fake Twilio/Google services listening on http://127.0.0.1:{server.server_address[1]}', flush=True)
+    server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description='Local fake Twilio REST, Google Sheets and Drive APIs.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--history-messages', type=int, default=100000, help='messages in the Twilio history of ' + TWILIO_NUMBER)
+    parser.add_argument('--contacts', type=int, default=5000, help='contacts the history and sheet rows refer to')
+    parser.add_argument('--sheet-rows', type=int, default=10000, help='data rows in every spreadsheet')
+    parser.add_argument('--latency-ms', type=float, default=0, help='delay added to every response')
+    args = parser.parse_args()
+    try:
+        serve(args.port, args.history_messages, args.contacts, args.sheet_rows, args.latency_ms)
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+if __name__ == '__main__':
+    main()
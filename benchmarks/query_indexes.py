@@ -0,0 +1,118 @@
+import argparse
+import json
+import random
+import statistics
+import time
+
+from benchmarks.seed import use_database, seed_tenant, logged_in_client
+
+# Query plans and timings for the hot queries, before and after the migration 1 indexes.
+#
+# Usage: python -m benchmarks.query_indexes [--database-url URL] [--messages 2000000]
+# The target database is dropped and reseeded; never point it at real data.
+
+HOT_QUERIES = {
+    'conversation_list': "SELECT id FROM conversation WHERE user_id = :user_id ORDER BY last_activity_time DESC LIMIT 50",
+    'last_message': "SELECT id, body, timestamp FROM message WHERE conversation_id = :conversation_id ORDER BY timestamp DESC, id DESC LIMIT 1",
+    'unread_count': "SELECT count(*) FROM message WHERE conversation_id = :conversation_id AND sender = 'contact' AND timestamp > :since",
+    'message_history': "SELECT id, sender, body, timestamp FROM message WHERE conversation_id = :conversation_id ORDER BY timestamp, id",
+    'user_by_twilio_number': 'SELECT id FROM "user" WHERE twilio_phone_number = :twilio_phone_number',
+}
+
+def explain(db, sql, params):
+    from sqlalchemy import text
+    if db.engine.dialect.name == 'sqlite':
+        return [row[3] for row in db.session.execute(text('EXPLAIN QUERY PLAN ' + sql), params)]
+    return [row[0] for row in db.session.execute(text('EXPLAIN ' + sql), params)]
+
+def measure(app, db, user_ids, conversation_count, repeat, endpoint_repeat, rng):
+    from datetime import datetime, timedelta
+    from sqlalchemy import text
+
+    db.session.execute(text('ANALYZE'))
+    db.session.commit()
+
+    results = {}
+    for name, sql in HOT_QUERIES.items():
+        timings = []
+        for _ in range(repeat):
+            params = {
+                'user_id': rng.choice(user_ids),
+                'conversation_id': rng.randint(1, conversation_count),
+                'since': datetime.utcnow() - timedelta(days=rng.uniform(0, 730)),
+                'twilio_phone_number': f'+1500555{rng.choice(user_ids):04d}',
+            }
+            start = time.perf_counter()
+            db.session.execute(text(sql), params).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        results[name] = {
+            'plan': explain(db, sql, params),
+            'median_ms': round(statistics.median(timings), 3),
+            'max_ms': round(max(timings), 3),
+        }
+
+    # End-to-end latency of the endpoints that use these queries
+    client = logged_in_client(app, user_ids[0])
+    for name, url in (('GET /api/conversations', '/api/conversations'),
+                      ('GET /api/conversations/<id>/messages', '/api/conversations/{}/messages')):
+        timings = []
+        for _ in range(endpoint_repeat):
+            start = time.perf_counter()
+            response = client.get(url.format(rng.randint(1, conversation_count // len(user_ids))))
+            timings.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 200, response.status_code
+        results[name] = {'median_ms': round(statistics.median(timings), 3), 'max_ms': round(max(timings), 3)}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Hot query plans and timings before and after the index migration.')
+    parser.add_argument('--database-url', help='throwaway database to seed (default: a temp SQLite file)')
+    parser.add_argument('--users', type=int, default=1)
+    parser.add_argument('--contacts', type=int, default=5000, help='contacts (and conversations) per user')
+    parser.add_argument('--messages', type=int, default=2000000)
+    parser.add_argument('--repeat', type=int, default=200, help='executions per query')
+    parser.add_argument('--endpoint-repeat', type=int, default=3, help='requests per endpoint (slow without indexes)')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    use_database(args.database_url)
+    from sqlalchemy import text
+    from app import app, db
+    from migrate import HOT_QUERY_INDEXES, run_migrations
+
+    rng = random.Random(7)
+    with app.app_context():
+        start = time.perf_counter()
+        user_ids = seed_tenant(args.users, args.contacts, args.messages)
+        seed_seconds = time.perf_counter() - start
+
+        # create_all() builds the model indexes; drop them to measure the pre-migration schema
+        for name, _, _ in HOT_QUERY_INDEXES:
+            db.session.execute(text(f'DROP INDEX IF EXISTS {name}'))
+        db.session.execute(text('DROP TABLE IF EXISTS schema_migrations'))
+        db.session.commit()
+        before = measure(app, db, user_ids, args.users * args.contacts, args.repeat, args.endpoint_repeat, rng)
+
+        start = time.perf_counter()
+        run_migrations()
+        migrate_seconds = time.perf_counter() - start
+        after = measure(app, db, user_ids, args.users * args.contacts, args.repeat, args.endpoint_repeat, rng)
+        dialect = db.engine.dialect.name
+
+    report = json.dumps({
+        'benchmark': 'query_indexes',
+        'database': dialect,
+        'config': {'users': args.users, 'contacts_per_user': args.contacts, 'messages': args.messages, 'repeat': args.repeat},
+        'seed_seconds': round(seed_seconds, 1),
+        'migrate_seconds': round(migrate_seconds, 1),
+        'before': before,
+        'after': after,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import os
+import random
+import statistics
+import tempfile
+from datetime import datetime, timedelta
+
+# Shared setup for the benchmark scripts. DATABASE_URL must point at a throwaway database
+# before app.py is imported, because the seeders drop and recreate every table.
+
+def use_database(database_url=None):
+    if not database_url:
+        database_url = 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'smssuite_bench.db')
+    os.environ['DATABASE_URL'] = database_url
+    return database_url
+
+def _insert_batches(db, table, rows, batch_size=50000):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+    db.session.commit()
+
+def seed_tenant(users=1, contacts_per_user=5000, messages=2000000, days=730, seed=42):
+    # Synthetic tenant: every contact has one conversation, messages are spread randomly
+    # across all conversations over the last `days` days. Returns the created user ids.
+    from app import db, User, Contact, Conversation, Message, rebuild_conversation_summaries
+
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+
+    db.drop_all()
+    db.create_all()
+
+    _insert_batches(db, User.__table__, (
+        {
+            'id': user_id,
+            'google_id': f'bench-{user_id}',
+            'name': f'Bench User {user_id}',
+            'email': f'bench{user_id}@example.com',
+            'twilio_account_sid': f'AC{user_id:032d}',
+            'twilio_auth_token': 'bench-token',
+            'twilio_phone_number': f'+1500555{user_id:04d}',
+            'google_api_access_token': 'bench-access-token', # No expiry, so never refreshed
+            'google_api_refresh_token': 'bench-refresh-token'
+        } for user_id in range(1, users + 1)
+    ))
+
+    conversation_count = users * contacts_per_user
+    _insert_batches(db, Contact.__table__, (
+        {
+            'id': contact_id,
+            'user_id': (contact_id - 1) // contacts_per_user + 1,
+            'phone_number': f'+1415{contact_id:07d}',
+            'name': f'Contact {contact_id}' if contact_id % 3 else ''
+        } for contact_id in range(1, conversation_count + 1)
+    ))
+    _insert_batches(db, Conversation.__table__, (
+        {
+            'id': conversation_id,
+            'user_id': (conversation_id - 1) // contacts_per_user + 1,
+            'contact_id': conversation_id,
+            'start_time': now - timedelta(days=days),
+            'last_read_timestamp': now - timedelta(days=rng.uniform(0, days)),
+            'last_activity_time': now - timedelta(days=rng.uniform(0, days))
+        } for conversation_id in range(1, conversation_count + 1)
+    ))
+    _insert_batches(db, Message.__table__, (
+        {
+            'conversation_id': rng.randint(1, conversation_count),
+            'sender': 'contact' if rng.random() < 0.5 else 'user',
+            'body': f'Benchmark message {message_id}',
+            'timestamp': now - timedelta(seconds=rng.uniform(0, days * 86400))
+        } for message_id in range(1, messages + 1)
+    ))
+    rebuild_conversation_summaries() # Messages were inserted directly, not through insert_messages
+    db.session.commit()
+    return list(range(1, users + 1))
+
+def logged_in_client(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+def percentiles(timings_ms):
+    # Inclusive method: interpolate within the observed range, so p99 never exceeds the max
+    cuts = statistics.quantiles(timings_ms, n=100, method='inclusive') if len(timings_ms) > 1 else timings_ms * 99
+    return {
+        'count': len(timings_ms),
+        'p50_ms': round(cuts[49], 3),
+        'p99_ms': round(cuts[98], 3),
+        'max_ms': round(max(timings_ms), 3),
+    }
@@ -0,0 +1,211 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from benchmarks.seed import use_database, seed_tenant, logged_in_client, percentiles
+
+# End-to-end benchmark of the real app.py endpoints against a seeded database, with Twilio and
+# Google served by benchmarks.fake_services in a separate process. Writes one JSON report, so
+# runs on two commits can be compared key by key.
+#
+# Usage: python -m benchmarks.suite [--database-url URL] [--messages 1000000] [--output report.json]
+# The target database is dropped and reseeded; never point it at real data.
+
+class FakeServices:
+    # Runs benchmarks.fake_services on a free local port for the duration of a with block
+    def __init__(self, history_messages, contacts, sheet_rows, latency_ms):
+        self.args = ['--history-messages', str(history_messages), '--contacts', str(contacts),
+                     '--sheet-rows', str(sheet_rows), '--latency-ms', str(latency_ms)]
+
+    def __enter__(self):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        self.process = subprocess.Popen([sys.executable, '-m', 'benchmarks.fake_services', '--port', str(port)] + self.args,
+                                        stdout=subprocess.PIPE, text=True)
+        self.process.stdout.readline() # Printed once the server is listening
+        self.base_url = f'http://127.0.0.1:{port}'
+        return self
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.wait()
+
+def point_app_at(app_module, base_url):
+    # Send the app's Twilio and Google API calls to the fake services instead of the real hosts
+    class FakeTwilioHttpClient(app_module.TwilioHttpClient):
+        def request(self, method, url, *args, **kwargs):
+            return super().request(method, url.replace('https://api.twilio.com', base_url), *args, **kwargs)
+    app_module.TwilioHttpClient = FakeTwilioHttpClient
+
+    for api_name, api_version in (('sheets', 'v4'), ('drive', 'v3')):
+        document = json.loads(app_module.discovery_cache.get_static_doc(api_name, api_version))
+        document['rootUrl'] = base_url + '/'
+        app_module._google_discovery_documents[(api_name, api_version)] = document
+
+@contextlib.contextmanager
+def quiet():
+    # app.py logs every step of a request; keep it out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def timed_requests(count, request):
+    timings = []
+    start = time.perf_counter()
+    for i in range(count):
+        request_start = time.perf_counter()
+        response = request(i)
+        timings.append((time.perf_counter() - request_start) * 1000)
+        assert response.status_code < 400, response.get_data(as_text=True)
+    result = percentiles(timings)
+    result['per_second'] = round(count / (time.perf_counter() - start), 1)
+    return result
+
+def bench_webhook(app, user_ids, contacts_per_user, requests, rng):
+    # Replies in existing conversations plus every tenth from a new number
+    client = app.test_client()
+    def post(i):
+        user_id = rng.choice(user_ids)
+        contact_id = (user_id - 1) * contacts_per_user + rng.randint(1, contacts_per_user)
+        return client.post('/twilio_webhook', data={
+            'MessageSid': f'SMbenchwebhook{i:020d}',
+            'From': f'+1415{contact_id:07d}' if i % 10 else f'+1628{i:07d}',
+            'To': f'+1500555{user_id:04d}',
+            'Body': f'Benchmark reply {i}',
+        })
+    with quiet():
+        return timed_requests(requests, post)
+
+def bench_reads(app, user_id, conversation_ids, requests, rng):
+    client = logged_in_client(app, user_id)
+    with quiet():
+        conversations = timed_requests(requests, lambda i: client.get('/api/conversations'))
+        newest_page = timed_requests(requests, lambda i: client.get(
+            f'/api/conversations/{rng.choice(conversation_ids)}/messages'))
+        # Older pages: walk back from the newest page of a busy conversation
+        cursors = []
+        conversation_id = conversation_ids[0]
+        cursor = client.get(f'/api/conversations/{conversation_id}/messages').get_json()['before_cursor']
+        while cursor and len(cursors) < requests:
+            cursors.append(cursor)
+            cursor = client.get(f'/api/conversations/{conversation_id}/messages?before={cursor}').get_json()['before_cursor']
+        older_pages = timed_requests(len(cursors), lambda i: client.get(
+            f'/api/conversations/{conversation_id}/messages?before={cursors[i]}')) if cursors else None
+    return {'GET /api/conversations': conversations, 'GET messages (newest page)': newest_page, 'GET messages (older pages)': older_pages}
+
+def bench_bulk_send(app, app_module, db, user_id, sheet_rows):
+    client = logged_in_client(app, user_id)
+    with quiet():
+        start = time.perf_counter()
+        response = client.post('/send_templated_bulk_sms', json={
+            'sheet_id': 'bench-sheet', 'message_template': 'Hi {{Name}}, see you in {{City}}!'})
+        queue_seconds = time.perf_counter() - start
+        assert response.status_code == 202, response.get_data(as_text=True)
+        job_id = response.get_json()['job']['id']
+
+        # Drain the job the way worker.py does, in this process
+        start = time.perf_counter()
+        with app.app_context():
+            while True:
+                items = app_module.claim_bulk_send_items()
+                if not items:
+                    break
+                app_module.process_bulk_send_items(items)
+            job = db.session.get(app_module.BulkSendJob, job_id)
+            summary = app_module._bulk_send_job_summary(job)
+        send_seconds = time.perf_counter() - start
+    return {
+        'rows': sheet_rows,
+        'queue_seconds': round(queue_seconds, 3),
+        'queue_rows_per_second': round(sheet_rows / queue_seconds, 1),
+        'send_seconds': round(send_seconds, 3),
+        'send_rows_per_second': round(summary['sent'] / send_seconds, 1) if summary['sent'] else 0,
+        'job': summary,
+    }
+
+def bench_history_import(app, app_module, user_id, history_messages):
+    with quiet(), app.app_context():
+        before = app_module.Message.query.count()
+        start = time.perf_counter()
+        success, message = app_module.import_twilio_history_for_user(user_id)
+        seconds = time.perf_counter() - start
+        imported = app_module.Message.query.count() - before
+    assert success, message
+    return {
+        'history_messages': history_messages,
+        'imported': imported,
+        'seconds': round(seconds, 3),
+        'messages_per_second': round(imported / seconds, 1),
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmarks against local fake Twilio and Google services.')
+    parser.add_argument('--database-url', help='throwaway database to seed (default: a temp SQLite file)')
+    parser.add_argument('--users', type=int, default=2)
+    parser.add_argument('--contacts', type=int, default=5000, help='contacts (and conversations) per user')
+    parser.add_argument('--messages', type=int, default=1000000, help='messages seeded across all conversations')
+    parser.add_argument('--webhook-requests', type=int, default=2000)
+    parser.add_argument('--read-requests', type=int, default=200, help='requests per read endpoint')
+    parser.add_argument('--sheet-rows', type=int, default=2000, help='rows in the bulk send sheet')
+    parser.add_argument('--history-messages', type=int, default=20000, help='messages in the fake Twilio history')
+    parser.add_argument('--service-latency-ms', type=float, default=0, help='delay added to every fake API response')
+    parser.add_argument('--sender-mps', type=float, default=0, help='per-number send rate for the outbound dispatcher (0: unlimited)')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    use_database(args.database_url)
+    os.environ.setdefault('SOCKETIO_EMIT_WINDOW_MS', '0') # No browsers are listening
+    os.environ.setdefault('OUTBOUND_DEFAULT_MPS', str(args.sender_mps)) # Measure the dispatcher, not Twilio's rate limit
+    with quiet():
+        import app as app_module
+    from app import app, db
+    from migrate import run_migrations
+
+    rng = random.Random(7)
+    results = {}
+    with FakeServices(args.history_messages, args.contacts, args.sheet_rows, args.service_latency_ms) as services:
+        point_app_at(app_module, services.base_url)
+        with quiet(), app.app_context():
+            start = time.perf_counter()
+            user_ids = seed_tenant(args.users, args.contacts, args.messages)
+            run_migrations()
+            results['seed_seconds'] = round(time.perf_counter() - start, 1)
+            dialect = db.engine.dialect.name
+            busiest = [conversation_id for (conversation_id,) in db.session.query(app_module.Message.conversation_id).group_by(
+                app_module.Message.conversation_id).order_by(db.func.count().desc()).limit(50)]
+
+        results['webhook'] = bench_webhook(app, user_ids, args.contacts, args.webhook_requests, rng)
+        results['reads'] = bench_reads(app, user_ids[0], [c for c in busiest if c <= args.contacts] or [1], args.read_requests, rng)
+        results['bulk_send'] = bench_bulk_send(app, app_module, db, user_ids[0], args.sheet_rows)
+        results['history_import'] = bench_history_import(app, app_module, user_ids[0], args.history_messages)
+
+    report = json.dumps({
+        'benchmark': 'suite',
+        'commit': git_commit(),
+        'run_at': datetime.utcnow().isoformat() + 'Z',
+        'database': dialect,
+        'config': {key: value for key, value in vars(args).items() if key not in ('database_url', 'output')},
+        'results': results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
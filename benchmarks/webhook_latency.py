@@ -0,0 +1,77 @@
+import argparse
+import contextlib
+import io
+import json
+import random
+import time
+
+from benchmarks.seed import use_database, seed_tenant, percentiles
+
+# p50/p99 latency of POST /twilio_webhook for replies in existing conversations, with the
+# in-memory routing table cleared before every request (the lookup path) and warm (the fast path).
+#
+# Usage: python -m benchmarks.webhook_latency [--database-url URL] [--requests 2000]
+# The target database is dropped and reseeded; never point it at real data.
+
+def measure(app, routes, user_ids, contacts_per_user, requests, cold, rng):
+    client = app.test_client()
+    timings = []
+    for i in range(requests):
+        user_id = rng.choice(user_ids)
+        contact_id = (user_id - 1) * contacts_per_user + rng.randint(1, contacts_per_user)
+        form = {
+            'MessageSid': f'SMbench{"cold" if cold else "warm"}{i:010d}',
+            'From': f'+1415{contact_id:07d}',
+            'To': f'+1500555{user_id:04d}',
+            'Body': f'Benchmark reply {i}',
+        }
+        if cold:
+            routes.clear()
+        with contextlib.redirect_stdout(io.StringIO()): # The webhook logs every step
+            start = time.perf_counter()
+            response = client.post('/twilio_webhook', data=form)
+            timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200
+    return percentiles(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description='Inbound webhook latency with and without the routing table.')
+    parser.add_argument('--database-url', help='throwaway database to seed (default: a temp SQLite file)')
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--contacts', type=int, default=2000, help='contacts (and conversations) per user')
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--requests', type=int, default=2000, help='webhook requests per mode')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    use_database(args.database_url)
+    from app import app, db, webhook_routes
+    from migrate import run_migrations
+
+    rng = random.Random(7)
+    with app.app_context():
+        user_ids = seed_tenant(args.users, args.contacts, args.messages)
+        run_migrations()
+        dialect = db.engine.dialect.name
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        with app.app_context():
+            webhook_routes.warm()
+    warm = measure(app, webhook_routes, user_ids, args.contacts, args.requests, False, rng)
+    cold = measure(app, webhook_routes, user_ids, args.contacts, args.requests, True, rng)
+
+    report = json.dumps({
+        'benchmark': 'webhook_latency',
+        'database': dialect,
+        'config': {'users': args.users, 'contacts_per_user': args.contacts, 'messages': args.messages, 'requests': args.requests},
+        'lookup_path': cold,
+        'routing_table': warm,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
 from app import app, db
+from migrate import run_migrations
 
 with app.app_context():
     db.create_all()
+    run_migrations() # Records every migration as applied (they are no-ops on a fresh schema)
     print("Database tables created successfully.")
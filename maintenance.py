@@ -0,0 +1,123 @@
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete, func
+
+from app import app, db, User, Contact, Conversation, Message, MessageArchiveSegment, MESSAGE_ARCHIVE_AFTER_DAYS, \
+    archive_messages, recalculate_last_activity_times, rebuild_conversation_summaries
+
+# Offline data repairs, run across all users in id-range batches with a commit per batch,
+# so long repairs neither hold a web worker nor one huge transaction.
+#
+# Usage: python maintenance.py last-activity [--user ID] [--batch-size N]
+#        python maintenance.py summaries [--user ID] [--dry-run] [--batch-size N]
+#        python maintenance.py orphans [--dry-run] [--batch-size N]
+#        python maintenance.py archive [--older-than-days N] [--user ID] [--batch-size N]
+
+def _id_batches(model, batch_size, *criteria):
+    # Inclusive (first_id, last_id) ranges covering every row of model that matches criteria
+    low, high = db.session.query(func.min(model.id), func.max(model.id)).filter(*criteria).one()
+    if low is None:
+        return
+    for start in range(low, high + 1, batch_size):
+        yield start, min(start + batch_size - 1, high)
+
+def repair_last_activity(user_id=None, batch_size=10000):
+    criteria = [Conversation.user_id == user_id] if user_id is not None else []
+    total = 0
+    for first_id, last_id in _id_batches(Conversation, batch_size, *criteria):
+        total += recalculate_last_activity_times(user_id, first_id, last_id)
+        db.session.commit()
+        print(f"Conversations {first_id}-{last_id}: {total} updated so far.")
+    print(f"Recalculated last_activity_time for {total} conversations.")
+    return total
+
+def check_conversation_summaries(user_id=None, dry_run=False, batch_size=10000):
+    # Compare each conversation's unread_count/last message with its messages and rebuild mismatches
+    criteria = [Conversation.user_id == user_id] if user_id is not None else []
+    mismatched = []
+    for first_id, last_id in _id_batches(Conversation, batch_size, *criteria):
+        mismatched += rebuild_conversation_summaries(first_id, last_id, user_id, dry_run)
+        db.session.commit()
+    print(f"{'Found' if dry_run else 'Rebuilt'} {len(mismatched)} conversation summaries out of sync"
+          + (f": {mismatched[:20]}{' ...' if len(mismatched) > 20 else ''}" if mismatched else '.'))
+    return mismatched
+
+def archive_old_messages(older_than_days=None, user_id=None, batch_size=10000):
+    # Move old messages into compressed archive segments, one conversation id range per transaction
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days or MESSAGE_ARCHIVE_AFTER_DAYS)
+    criteria = [Conversation.user_id == user_id] if user_id is not None else []
+    archived = segments = 0
+    for first_id, last_id in _id_batches(Conversation, batch_size, *criteria):
+        batch_archived, batch_segments = archive_messages(cutoff, first_id, last_id, user_id)
+        db.session.commit()
+        archived += batch_archived
+        segments += batch_segments
+        print(f"Conversations {first_id}-{last_id}: {archived} messages archived so far.")
+    print(f"Archived {archived} messages older than {cutoff:%Y-%m-%d} into {segments} segments.")
+    return archived, segments
+
+# (label, model, parent model, foreign key column) in child-first order, so removing an orphaned
+# conversation in one pass cannot leave its messages behind unnoticed in the next
+ORPHAN_CHECKS = [
+    ('archive segments without a conversation', MessageArchiveSegment, Conversation, MessageArchiveSegment.conversation_id),
+    ('messages without a conversation', Message, Conversation, Message.conversation_id),
+    ('conversations without a contact', Conversation, Contact, Conversation.contact_id),
+    ('conversations without a user', Conversation, User, Conversation.user_id),
+    ('contacts without a user', Contact, User, Contact.user_id),
+]
+
+def clean_orphans(dry_run=False, batch_size=10000):
+    # Foreign keys are not enforced everywhere (SQLite), so rows can outlive their parents.
+    # Repeats until a pass finds nothing, since deleting a conversation orphans its messages.
+    totals = {label: 0 for label, _, _, _ in ORPHAN_CHECKS}
+    while True:
+        found = 0
+        for label, model, parent, column in ORPHAN_CHECKS:
+            missing_parent = ~select(parent.id).where(parent.id == column).exists()
+            for first_id, last_id in _id_batches(model, batch_size):
+                in_batch = (model.id >= first_id, model.id <= last_id, missing_parent)
+                if dry_run:
+                    count = db.session.query(func.count(model.id)).filter(*in_batch).scalar()
+                else:
+                    count = db.session.execute(delete(model).where(*in_batch).execution_options(synchronize_session=False)).rowcount
+                    db.session.commit()
+                totals[label] += count
+                found += count
+        if dry_run or not found:
+            break
+    for label, count in totals.items():
+        print(f"{'Found' if dry_run else 'Deleted'} {count} {label}.")
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline data repairs for DATABASE_URL.')
+    parser.add_argument('--batch-size', type=int, default=10000, help='rows per batch/transaction')
+    commands = parser.add_subparsers(dest='command', required=True)
+    last_activity = commands.add_parser('last-activity', help='rebuild conversation last_activity_time from messages')
+    last_activity.add_argument('--user', type=int, help='only this user id (default: all users)')
+    summaries = commands.add_parser('summaries', help='check unread counts and last messages, rebuilding mismatches')
+    summaries.add_argument('--user', type=int, help='only this user id (default: all users)')
+    summaries.add_argument('--dry-run', action='store_true', help='only report mismatched conversations')
+    orphans = commands.add_parser('orphans', help='delete messages, conversations and contacts whose parent row is gone')
+    orphans.add_argument('--dry-run', action='store_true', help='only count orphaned rows')
+    archive = commands.add_parser('archive', help='move old messages into compressed archive segments')
+    archive.add_argument('--older-than-days', type=int, help=f'archive messages older than this (default: MESSAGE_ARCHIVE_AFTER_DAYS, {MESSAGE_ARCHIVE_AFTER_DAYS})')
+    archive.add_argument('--user', type=int, help='only this user id (default: all users)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with app.app_context():
+        if args.command == 'last-activity':
+            repair_last_activity(args.user, args.batch_size)
+        elif args.command == 'summaries':
+            check_conversation_summaries(args.user, args.dry_run, args.batch_size)
+        elif args.command == 'orphans':
+            clean_orphans(args.dry_run, args.batch_size)
+        elif args.command == 'archive':
+            archive_old_messages(args.older_than_days, args.user, args.batch_size)
+    print(f"Done in {time.perf_counter() - start:.1f}s.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+import argparse
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from app import app, db, Conversation, conversation_summary_repair
+
+# Versioned schema migrations for databases created before a model change.
+# db.create_all() only creates missing tables, so new indexes and columns on existing
+# tables are applied here. Every step is idempotent, and on PostgreSQL indexes are built
+# with CREATE INDEX CONCURRENTLY so production tables stay writable during the upgrade.
+#
+# Usage: python migrate.py            apply pending migrations
+#        python migrate.py --status   list applied and pending migrations
+
+MIGRATIONS = [] # (version, description, function)
+MIGRATION_LOCK_ID = 727274 # pg_advisory_lock key, keeps two deploys from migrating at once
+BACKFILL_BATCH_SIZE = 10000 # Rows per statement when a migration backfills a new column
+
+def migration(version, description):
+    def decorator(function):
+        MIGRATIONS.append((version, description, function))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return function
+    return decorator
+
+def _quote(conn, name):
+    return conn.dialect.identifier_preparer.quote(name)
+
+def create_index(conn, name, table, columns, unique=False):
+    column_list = ', '.join(_quote(conn, column) for column in columns)
+    unique_sql = 'UNIQUE ' if unique else ''
+    if conn.dialect.name == 'postgresql':
+        # A failed concurrent build leaves an INVALID index behind that IF NOT EXISTS would skip
+        is_valid = conn.execute(text(
+            "SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid WHERE c.relname = :name"
+        ), {'name': name}).scalar()
+        if is_valid is False:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {_quote(conn, name)}"))
+        conn.execute(text(
+            f"CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {_quote(conn, name)} ON {_quote(conn, table)} ({column_list})"
+        ))
+    else:
+        conn.execute(text(
+            f"CREATE {unique_sql}INDEX IF NOT EXISTS {_quote(conn, name)} ON {_quote(conn, table)} ({column_list})"
+        ))
+
+def add_column(conn, table, column, ddl):
+    # ddl is the column type and options, e.g. "INTEGER NOT NULL DEFAULT 0"
+    existing = {c['name'] for c in inspect(conn).get_columns(table)}
+    if column not in existing:
+        conn.execute(text(f"ALTER TABLE {_quote(conn, table)} ADD COLUMN {_quote(conn, column)} {ddl}"))
+
+HOT_QUERY_INDEXES = [ # (name, table, columns), mirrored in the models' __table_args__
+    ('ix_message_conversation_timestamp', 'message', ['conversation_id', 'timestamp', 'id']),
+    ('ix_message_conversation_sender_timestamp', 'message', ['conversation_id', 'sender', 'timestamp']),
+    ('ix_conversation_user_activity', 'conversation', ['user_id', 'last_activity_time']),
+    ('ix_conversation_user_contact', 'conversation', ['user_id', 'contact_id']),
+    ('ix_bulk_send_item_job_status', 'bulk_send_item', ['job_id', 'status']),
+]
+
+@migration(1, 'Composite indexes for conversation list, message history and unread counts')
+def hot_query_indexes(conn):
+    for name, table, columns in HOT_QUERY_INDEXES:
+        create_index(conn, name, table, columns)
+
+@migration(2, 'Twilio history import watermark on user')
+def twilio_history_watermark(conn):
+    add_column(conn, 'user', 'twilio_history_synced_at', 'TIMESTAMP')
+
+@migration(3, 'Provider MessageSid on message with a unique index')
+def message_provider_sid(conn):
+    add_column(conn, 'message', 'provider_sid', 'VARCHAR(64)')
+    create_index(conn, 'ix_message_provider_sid', 'message', ['provider_sid'], unique=True)
+
+@migration(4, 'Materialized unread count and last message on conversation')
+def conversation_summary(conn):
+    add_column(conn, 'conversation', 'unread_count', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(conn, 'conversation', 'last_message_body', 'TEXT')
+    add_column(conn, 'conversation', 'last_message_at', 'TIMESTAMP')
+    # Backfill in id ranges; each UPDATE commits on its own (AUTOCOMMIT), keeping row locks short
+    high = conn.execute(text("SELECT max(id) FROM conversation")).scalar() or 0
+    for start in range(1, high + 1, BACKFILL_BATCH_SIZE):
+        mismatch, values = conversation_summary_repair(start, start + BACKFILL_BATCH_SIZE - 1)
+        conn.execute(Conversation.__table__.update().where(mismatch).values(**values))
+
+@migration(5, 'Message archive horizon on conversation')
+def message_archive(conn):
+    # The message_archive_segment table itself is created by create_all
+    add_column(conn, 'conversation', 'archived_through', 'TIMESTAMP')
+
+@migration(6, 'Provider MessageSid on bulk send items')
+def bulk_send_item_provider_sid(conn):
+    add_column(conn, 'bulk_send_item', 'provider_sid', 'VARCHAR(64)')
+
+@migration(7, 'Per-job claim index on bulk send items')
+def bulk_send_item_job_claims(conn):
+    create_index(conn, 'ix_bulk_send_item_job_status_id', 'bulk_send_item', ['job_id', 'status', 'id'])
+
+def _ensure_migrations_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, description TEXT, applied_at TIMESTAMP)"
+    ))
+
+def applied_versions(conn):
+    _ensure_migrations_table(conn)
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+def run_migrations(engine=None):
+    engine = engine or db.engine
+    db.metadata.create_all(engine) # New tables (with their indexes) are created directly
+
+    # AUTOCOMMIT: CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        is_postgres = conn.dialect.name == 'postgresql'
+        if is_postgres:
+            conn.execute(text("SELECT pg_advisory_lock(:id)"), {'id': MIGRATION_LOCK_ID})
+        try:
+            done = applied_versions(conn)
+            applied = []
+            for version, description, function in MIGRATIONS:
+                if version in done:
+                    continue
+                print(f"Applying migration {version}: {description}...")
+                function(conn)
+                conn.execute(text(
+                    "INSERT INTO schema_migrations (version, description, applied_at) VALUES (:version, :description, :applied_at)"
+                ), {'version': version, 'description': description, 'applied_at': datetime.utcnow()})
+                applied.append(version)
+            return applied
+        finally:
+            if is_postgres:
+                conn.execute(text("SELECT pg_advisory_unlock(:id)"), {'id': MIGRATION_LOCK_ID})
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply schema migrations to DATABASE_URL.')
+    parser.add_argument('--status', action='store_true', help='list applied and pending migrations and exit')
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.status:
+            with db.engine.connect() as conn:
+                done = applied_versions(conn)
+                conn.commit()
+            for version, description, _ in MIGRATIONS:
+                print(f"{'applied' if version in done else 'pending'}  {version:>4}  {description}")
+            return
+
+        applied = run_migrations()
+        print(f"Applied {len(applied)} migration(s)." if applied else "Database schema is up to date.")
+
+if __name__ == '__main__':
+    main()
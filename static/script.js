@@ -19,6 +19,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const bulkMessageComposer = document.querySelector('.bulk-message-composer');
     const bulkMessageTemplate = document.getElementById('bulk-message-template');
     const sendBulkSmsBtn = document.getElementById('send-bulk-sms-btn');
+    const bulkMessagePreview = document.getElementById('bulk-message-preview');
 
     // Conversation elements
     const conversationList = document.querySelector('.conversation-list');
@@ -37,7 +38,7 @@ document.addEventListener('DOMContentLoaded', function() {
     let currentUserRoom = null; // To track the current user's room
 
     // Socket.IO setup
-    const socket = io();
+    const socket = io(window.SOCKETIO_OPTIONS || {});
 
     socket.on('connect', () => {
         console.log('Socket.IO connected!');
@@ -57,24 +58,52 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
-    socket.on('new_message', (data) => {
-        console.log('Socket.IO: New message received:', data);
-        if (data.conversation_id == currentConversationId) {
-            const messageDiv = document.createElement('div');
-            messageDiv.classList.add('message', data.sender === 'user' ? 'sent' : 'received');
-            messageDiv.innerHTML = `<p>${data.body}</p><span class="timestamp">${new Date(data.timestamp).toLocaleString()}</span>`;
-            conversationDisplay.appendChild(messageDiv);
+    // New messages arrive in batches: the server coalesces each room's messages over a short window
+    socket.on('new_messages', (messages) => {
+        console.log('Socket.IO: New messages received:', messages);
+        const current = messages.filter(data => data.conversation_id == currentConversationId);
+        if (current.length) {
+            current.forEach(data => conversationDisplay.appendChild(createMessageElement(data)));
             conversationDisplay.scrollTop = conversationDisplay.scrollHeight;
         }
-        fetchConversations(); // Refresh conversations list to update unread counts and last message
+        // The conversation list row is patched by the conversation_update event that follows
     });
 
     socket.on('conversation_update', (data) => {
         console.log('Socket.IO: Conversation update received:', data);
-        // This event signifies that the conversation list in the left pane might need updating
-        fetchConversations();
+        // Carries the changed conversations' summaries; only bulk changes ask for a full refetch
+        if (data.refresh) {
+            fetchConversations();
+        } else if (data.conversations) {
+            data.conversations.forEach(updateConversationItem);
+        }
     });
 
+    const SHEET_PREVIEW_ROWS = 100; // Rows requested for the sheet preview table
+
+    // Bulk send jobs started from this tab, reported when the worker finishes them
+    const bulkJobsInProgress = new Set();
+
+    socket.on('bulk_job_progress', (job) => {
+        console.log('Socket.IO: Bulk job progress:', job);
+        if (job.status === 'completed' && bulkJobsInProgress.has(job.id)) {
+            showBulkJobResults(job.id);
+        }
+    });
+
+    async function showBulkJobResults(jobId) {
+        bulkJobsInProgress.delete(jobId);
+        try {
+            const response = await fetch(`/api/bulk_jobs/${jobId}`);
+            const job = await response.json();
+            if (response.ok) {
+                alert(`Bulk SMS job #${job.id} completed: sent=${job.sent}, failed=${job.failed}, skipped=${job.skipped}\n` + job.results.join('\n'));
+            }
+        } catch (error) {
+            console.error('Error fetching bulk job results:', error);
+        }
+    }
+
     // Function to fetch and populate Google Sheets
     async function fetchGoogleSheets(searchQuery = '') {
         console.log("Fetching Google Sheets...");
@@ -107,7 +136,8 @@ document.addEventListener('DOMContentLoaded', function() {
         }
 
         try {
-            const response = await fetch(`/google_sheet_data/${sheetId}`);
+            // Only the first rows are needed for the preview; the bulk sender reads the sheet server-side
+            const response = await fetch(`/google_sheet_data/${sheetId}?limit=${SHEET_PREVIEW_ROWS}`);
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
@@ -132,11 +162,13 @@ document.addEventListener('DOMContentLoaded', function() {
                 html += '</tr>';
             });
             html += '</tbody></table>';
+            if (data.has_more) {
+                html += `<p>Showing the first ${data.data.length} rows.</p>`;
+            }
             sheetDataPreview.innerHTML = html;
 
-            // Store headers and rows globally for later use
+            // Store headers globally for later use (rows are only the preview window)
             window.currentSheetHeaders = data.headers;
-            window.currentSheetRows = data.data;
             console.log('Available headers for templating:', window.currentSheetHeaders);
 
         } catch (error) {
@@ -145,6 +177,41 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // Render the template against the first sheet rows server-side, as the bulk sender will
+    async function previewBulkMessage() {
+        const sheetId = googleSheetSelect.value;
+        const messageTemplate = bulkMessageTemplate.value;
+        if (!sheetId || !messageTemplate) {
+            bulkMessagePreview.innerHTML = '';
+            return;
+        }
+
+        try {
+            const response = await fetch('/api/preview_bulk_sms', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ sheet_id: sheetId, message_template: messageTemplate, limit: 3 }),
+            });
+            const result = await response.json();
+            if (!response.ok) {
+                bulkMessagePreview.innerHTML = `<p class="preview-warning">${result.error}</p>`;
+                return;
+            }
+
+            let html = '';
+            if (result.unknown_placeholders.length > 0) {
+                const unknown = result.unknown_placeholders.map(name => `{{${name}}}`).join(', ');
+                html += `<p class="preview-warning">Unknown placeholders: ${unknown}</p>`;
+            }
+            result.messages.forEach(msg => {
+                html += `<div class="preview-message"><strong>${msg.name || msg.phone_number || ''}</strong>: ${msg.body}</div>`;
+            });
+            bulkMessagePreview.innerHTML = html;
+        } catch (error) {
+            console.error('Error previewing bulk message:', error);
+        }
+    }
+
     // Function to fetch and display conversations
     async function fetchConversations() {
         try {
@@ -155,32 +222,7 @@ document.addEventListener('DOMContentLoaded', function() {
             const conversations = await response.json();
             conversationList.innerHTML = ''; // Clear existing list
             conversations.forEach(conv => {
-                const convItem = document.createElement('div');
-                convItem.classList.add('conversation-item');
-                if (conv.id === currentConversationId) {
-                    convItem.classList.add('active');
-                }
-                convItem.dataset.conversationId = conv.id;
-                
-                const timeDisplay = conv.last_message_time ? new Date(conv.last_message_time).toLocaleString() : '';
-                const unreadDot = conv.unread_count > 0 ? '<span class="unread-dot"></span>' : '';
-                const unreadCountDisplay = conv.unread_count > 0 ? `<span class="unread-count">${conv.unread_count}</span>` : '';
-
-                convItem.innerHTML = `
-                    <div class="conversation-info">
-                        <div class="contact-name">${conv.contact_name || conv.phone_number || 'Unknown'}</div>
-                        <div class="last-message-preview">${conv.last_message_body || 'No messages yet.'}</div>
-                    </div>
-                    <div class="conversation-meta">
-                        <div class="last-message-time">${timeDisplay}</div>
-                        ${unreadDot}
-                        ${unreadCountDisplay}
-                    </div>
-                `;
-                convItem.addEventListener('click', () => {
-                    selectConversation(conv.id);
-                });
-                conversationList.appendChild(convItem);
+                conversationList.appendChild(createConversationElement(conv));
             });
         } catch (error) {
             console.error('Error fetching conversations:', error);
@@ -188,12 +230,73 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    function createConversationElement(conv) {
+        const convItem = document.createElement('div');
+        convItem.classList.add('conversation-item');
+        if (conv.id === currentConversationId) {
+            convItem.classList.add('active');
+        }
+        convItem.dataset.conversationId = conv.id;
+        convItem.dataset.lastActivityTime = conv.last_activity_time || '';
+
+        const timeDisplay = conv.last_message_time ? new Date(conv.last_message_time).toLocaleString() : '';
+        const unreadDot = conv.unread_count > 0 ? '<span class="unread-dot"></span>' : '';
+        const unreadCountDisplay = conv.unread_count > 0 ? `<span class="unread-count">${conv.unread_count}</span>` : '';
+
+        convItem.innerHTML = `
+            <div class="conversation-info">
+                <div class="contact-name">${conv.contact_name || conv.phone_number || 'Unknown'}</div>
+                <div class="last-message-preview">${conv.last_message_body || 'No messages yet.'}</div>
+            </div>
+            <div class="conversation-meta">
+                <div class="last-message-time">${timeDisplay}</div>
+                ${unreadDot}
+                ${unreadCountDisplay}
+            </div>
+        `;
+        convItem.addEventListener('click', () => {
+            selectConversation(conv.id);
+        });
+        return convItem;
+    }
+
+    // Replace one conversation's row (or add it) and move it to its place in the
+    // last-activity order, leaving the rest of the list untouched
+    function updateConversationItem(conv) {
+        const existing = conversationList.querySelector(`.conversation-item[data-conversation-id="${conv.id}"]`);
+        if (existing) {
+            existing.remove();
+        } else if (!conversationList.querySelector('.conversation-item')) {
+            conversationList.innerHTML = ''; // Drop an empty-list or error placeholder
+        }
+        const convItem = createConversationElement(conv);
+        const activity = conv.last_activity_time ? Date.parse(conv.last_activity_time) : -Infinity;
+        const next = Array.from(conversationList.querySelectorAll('.conversation-item')).find(item => {
+            const itemActivity = item.dataset.lastActivityTime ? Date.parse(item.dataset.lastActivityTime) : -Infinity;
+            return itemActivity < activity;
+        });
+        conversationList.insertBefore(convItem, next || null);
+    }
+
+    // Message history is paged: the newest page loads first, older pages load when scrolling up
+    const MESSAGE_PAGE_SIZE = 50;
+    let olderMessagesCursor = null;
+    let hasOlderMessages = false;
+    let loadingOlderMessages = false;
+
+    function createMessageElement(msg) {
+        const messageDiv = document.createElement('div');
+        messageDiv.classList.add('message', msg.sender === 'user' ? 'sent' : 'received');
+        messageDiv.innerHTML = `<p>${msg.body}</p><span class="timestamp">${new Date(msg.timestamp).toLocaleString()}</span>`;
+        return messageDiv;
+    }
+
     // Function to fetch and display messages for the current conversation
     async function fetchMessagesForCurrentConversation() {
         if (!currentConversationId) return;
 
         try {
-            const response = await fetch(`/api/conversations/${currentConversationId}/messages`);
+            const response = await fetch(`/api/conversations/${currentConversationId}/messages?limit=${MESSAGE_PAGE_SIZE}`);
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
@@ -208,11 +311,10 @@ document.addEventListener('DOMContentLoaded', function() {
 
             conversationDisplay.innerHTML = ''; 
             data.messages.forEach(msg => {
-                const messageDiv = document.createElement('div');
-                messageDiv.classList.add('message', msg.sender === 'user' ? 'sent' : 'received');
-                messageDiv.innerHTML = `<p>${msg.body}</p><span class="timestamp">${new Date(msg.timestamp).toLocaleString()}</span>`;
-                conversationDisplay.appendChild(messageDiv);
+                conversationDisplay.appendChild(createMessageElement(msg));
             });
+            olderMessagesCursor = data.before_cursor;
+            hasOlderMessages = data.has_more_before;
             conversationDisplay.scrollTop = conversationDisplay.scrollHeight; // Scroll to bottom
 
         } catch (error) {
@@ -221,6 +323,43 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    async function fetchOlderMessages() {
+        if (!currentConversationId || !hasOlderMessages || loadingOlderMessages) return;
+        loadingOlderMessages = true;
+        const conversationId = currentConversationId;
+
+        try {
+            const response = await fetch(`/api/conversations/${conversationId}/messages?limit=${MESSAGE_PAGE_SIZE}&before=${encodeURIComponent(olderMessagesCursor)}`);
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            const data = await response.json();
+            if (conversationId !== currentConversationId) return; // Conversation changed while loading
+
+            // Prepend the older page and keep the visible messages where they were
+            const previousHeight = conversationDisplay.scrollHeight;
+            const fragment = document.createDocumentFragment();
+            data.messages.forEach(msg => {
+                fragment.appendChild(createMessageElement(msg));
+            });
+            conversationDisplay.insertBefore(fragment, conversationDisplay.firstChild);
+            conversationDisplay.scrollTop += conversationDisplay.scrollHeight - previousHeight;
+
+            olderMessagesCursor = data.before_cursor;
+            hasOlderMessages = data.has_more_before;
+        } catch (error) {
+            console.error('Error fetching older messages:', error);
+        } finally {
+            loadingOlderMessages = false;
+        }
+    }
+
+    conversationDisplay.addEventListener('scroll', function() {
+        if (conversationDisplay.scrollTop < 100) {
+            fetchOlderMessages();
+        }
+    });
+
     // Function to select a conversation and load its messages
     async function selectConversation(convId) {
         if (currentConversationRoom && currentConversationRoom !== String(convId)) {
@@ -250,9 +389,9 @@ document.addEventListener('DOMContentLoaded', function() {
             if (!response.ok) {
                 console.error('Failed to mark conversation as read.', await response.json());
             } else {
-                // Only after marking as read successfully, then fetch messages and refresh conversation list
+                // Only after marking as read successfully, then fetch messages; the conversation_update
+                // event for this conversation clears its unread count in the list
                 fetchMessagesForCurrentConversation(); // Initial load
-                fetchConversations(); // Refresh conversations list to clear unread count
             }
         } catch (error) {
             console.error('Error marking conversation as read:', error);
@@ -263,6 +402,7 @@ document.addEventListener('DOMContentLoaded', function() {
     if (googleSheetSelect) {
         googleSheetSelect.addEventListener('change', function() {
             fetchSheetData(this.value);
+            previewBulkMessage();
         });
     }
 
@@ -273,6 +413,8 @@ document.addEventListener('DOMContentLoaded', function() {
         }, 300)); // Debounce to avoid excessive API calls
     }
 
+    bulkMessageTemplate.addEventListener('input', debounce(previewBulkMessage, 400));
+
     newBulkMessageBtn.addEventListener('click', function() {
         bulkMessageComposer.style.display = 'block';
     });
@@ -301,9 +443,15 @@ document.addEventListener('DOMContentLoaded', function() {
             });
 
             const result = await response.json();
-            if (response.ok) {
-                alert('Bulk SMS sent successfully!\n' + result.results.join('\n'));
-                fetchConversations(); // Refresh conversations list after sending bulk message
+            if (response.ok && result.job) {
+                // The job is sent by the background worker; progress arrives via 'bulk_job_progress'
+                bulkJobsInProgress.add(result.job.id);
+                alert(`Bulk SMS queued: ${result.job.total} rows (job #${result.job.id}).`);
+                if (result.job.status === 'completed') {
+                    showBulkJobResults(result.job.id);
+                }
+            } else if (response.ok) {
+                alert(result.message);
             } else {
                 alert('Error sending bulk SMS: ' + result.error);
             }
@@ -328,8 +476,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 });
                 const result = await response.json();
                 if (response.ok) {
-                    alert(result.message);
-                    fetchConversations(); // Refresh conversations list
+                    alert(result.message); // The new conversations arrive through conversation_update
                 } else {
                     alert('Error starting conversation: ' + result.error);
                 }
@@ -409,14 +556,24 @@ document.addEventListener('DOMContentLoaded', function() {
                 return;
             }
 
-            // Ensure we have current sheet data loaded; if not, fetch it
-            if (!window.currentSheetHeaders || !window.currentSheetRows) {
-                await fetchSheetData(sheetId);
+            // The preview only holds the first rows, so fetch the whole sheet here
+            let headers = [];
+            let rows = [];
+            try {
+                const sheetResponse = await fetch(`/google_sheet_data/${sheetId}`);
+                const sheetData = await sheetResponse.json();
+                if (!sheetResponse.ok || sheetData.error) {
+                    throw new Error(sheetData.error || `HTTP error! status: ${sheetResponse.status}`);
+                }
+                headers = sheetData.headers || [];
+                rows = sheetData.data || [];
+            } catch (e) {
+                console.error('Error loading sheet data:', e);
+                applyNamesFromSheetFeedback.style.color = 'red';
+                applyNamesFromSheetFeedback.textContent = 'Error loading sheet data.';
+                return;
             }
 
-            const headers = window.currentSheetHeaders || [];
-            const rows = window.currentSheetRows || [];
-
             // Build a normalized header index for robust matching
             const norm = s => String(s || '').toLowerCase().replace(/\s+|_/g, '');
             const headerIndexByNorm = {};
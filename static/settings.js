@@ -55,6 +55,23 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    // The server joins this socket to the user's room on connect; import progress arrives there
+    const socket = io(window.SOCKETIO_OPTIONS || {});
+
+    socket.on('import_progress', (progress) => {
+        if (!importHistoryFeedback) return;
+        if (progress.status === 'running') {
+            importHistoryFeedback.style.color = 'black';
+            importHistoryFeedback.textContent = `Importing... ${progress.imported} new messages so far (${progress.pages} pages).`;
+        } else if (progress.status === 'completed') {
+            importHistoryFeedback.style.color = 'green';
+            importHistoryFeedback.textContent = `Import complete: ${progress.imported} new messages.`;
+        } else {
+            importHistoryFeedback.style.color = 'red';
+            importHistoryFeedback.textContent = `Import failed after ${progress.imported} messages: ${progress.error}`;
+        }
+    });
+
     if (importTwilioHistoryBtn) {
         importTwilioHistoryBtn.addEventListener('click', async function() {
             if (!confirm("Importing historical data may take a while and could potentially create new conversations. Do you want to proceed?")) {
@@ -73,7 +90,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 });
                 const result = await response.json();
                 if (response.ok) {
-                    importHistoryFeedback.style.color = 'green';
+                    importHistoryFeedback.style.color = 'black';
                     importHistoryFeedback.textContent = result.message;
                 } else {
                     importHistoryFeedback.style.color = 'red';
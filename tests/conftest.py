@@ -0,0 +1,78 @@
+import itertools
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+# Importing app monkey patches the interpreter (eventlet), so tests that need the app run a script
+# against it in a subprocess. The scripts get the names below, and whatever it prints last as JSON
+# is returned to the test.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PREAMBLE = textwrap.dedent('''
+    import json, time
+    from datetime import datetime, timedelta
+    import eventlet
+    import app as A
+    from app import app, db
+
+    with app.app_context():
+        db.create_all()
+
+    def make_user(phone_number='+15005550006'):
+        user = A.User(google_id=phone_number, name='Tester', email=f'{phone_number}@example.com',
+                      twilio_account_sid='AC' + phone_number[1:], twilio_auth_token='token',
+                      twilio_phone_number=phone_number)
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+    def make_conversation(user, phone_number):
+        contact = A.Contact(user_id=user.id, phone_number=phone_number, name='')
+        db.session.add(contact)
+        db.session.flush()
+        conversation = A.Conversation(user_id=user.id, contact_id=contact.id)
+        db.session.add(conversation)
+        db.session.commit()
+        return conversation
+
+    def logged_in_client(user_id):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        return client
+
+    class FakeTwilioMessages:
+        sent = [] # (to, body), shared by every fake client
+
+        def create(self, to, from_, body):
+            FakeTwilioMessages.sent.append((to, body))
+            return type('Message', (), {'sid': f'SMfake{len(FakeTwilioMessages.sent)}'})()
+
+    class FakeTwilioClient:
+        def __init__(self, *args, **kwargs):
+            self.messages = FakeTwilioMessages()
+
+    A.Client = FakeTwilioClient
+''')
+
+
+@pytest.fixture
+def run_app_script(tmp_path):
+    run_numbers = itertools.count(1)
+
+    def run(*scripts, **env):
+        # scripts: code blocks run in order after the preamble, each dedented on its own. Every run
+        # gets a fresh database.
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{tmp_path / f"app{next(run_numbers)}.db"}', SECRET_KEY='test-secret', **env)
+        source = PREAMBLE + ''.join(textwrap.dedent(script) for script in scripts)
+        result = subprocess.run([sys.executable, '-c', source], cwd=REPO_ROOT, env=env,
+                                capture_output=True, text=True, timeout=120)
+        assert result.returncode == 0, result.stderr
+        return json.loads(result.stdout.strip().splitlines()[-1])
+    return run
@@ -0,0 +1,100 @@
+# Bulk send: preview validation, worker claims, lease renewal and how sent items are recorded
+
+JOB_SETUP = '''
+    def make_job(user, rows, prefix='+1415555'):
+        job = A.BulkSendJob(user_id=user.id, sheet_id='sheet', message_template='hi', total_count=rows)
+        db.session.add(job)
+        db.session.flush()
+        for i in range(rows):
+            db.session.add(A.BulkSendItem(job_id=job.id, row_index=i + 2, phone_number=f'{prefix}{i:04d}',
+                                          label=f'Row {i}', body='hi'))
+        db.session.commit()
+        return job.id
+'''
+
+
+def test_claimed_rows_are_not_requeued_while_waiting_for_their_rate(run_app_script):
+    # 5 rows at 2 messages/s take ~2s, twice the 1s lease: without renewal the requeue pass
+    # would hand the waiting rows back to 'pending' and they would be sent a second time
+    report = run_app_script(JOB_SETUP, '''
+        with app.app_context():
+            job_id = make_job(make_user(), 5)
+            items = A.claim_bulk_send_items()
+            requeued = []
+
+            def requeue_loop():
+                while True:
+                    eventlet.sleep(0.2)
+                    with app.app_context():
+                        requeued.append(A.requeue_stale_bulk_send_items())
+
+            requeuer = eventlet.spawn(requeue_loop)
+            A.process_bulk_send_items(items)
+            requeuer.kill()
+            job = db.session.get(A.BulkSendJob, job_id)
+            print(json.dumps({'requeued': sum(requeued), 'passes': len(requeued), 'sent': FakeTwilioMessages.sent,
+                              'job': [job.status, job.sent_count, job.failed_count]}))
+    ''', BULK_SEND_LEASE_SECONDS='1', OUTBOUND_DEFAULT_MPS='2')
+
+    assert report['passes'] >= 5
+    assert report['requeued'] == 0
+    assert sorted(to for to, _ in report['sent']) == [f'+1415555{i:04d}' for i in range(5)]
+    assert report['job'] == ['completed', 5, 0]
+
+
+def test_stale_rows_of_a_dead_worker_are_requeued(run_app_script):
+    report = run_app_script(JOB_SETUP, '''
+        with app.app_context():
+            make_job(make_user(), 2)
+            A.claim_bulk_send_items()
+            A.BulkSendItem.query.update({A.BulkSendItem.claimed_at: datetime.utcnow() - timedelta(seconds=120)})
+            db.session.commit()
+            print(json.dumps({'requeued': A.requeue_stale_bulk_send_items(60),
+                              'statuses': [item.status for item in A.BulkSendItem.query.order_by(A.BulkSendItem.id)]}))
+    ''')
+    assert report == {'requeued': 2, 'statuses': ['pending', 'pending']}
+
+
+def test_sent_message_that_cannot_be_stored_still_counts_as_sent(run_app_script):
+    report = run_app_script(JOB_SETUP, '''
+        def insert_messages(rows):
+            raise RuntimeError('disk full')
+        A.insert_messages = insert_messages
+
+        with app.app_context():
+            job_id = make_job(make_user(), 2)
+            A.process_bulk_send_items(A.claim_bulk_send_items())
+            job = db.session.get(A.BulkSendJob, job_id)
+            items = A.BulkSendItem.query.order_by(A.BulkSendItem.id).all()
+            print(json.dumps({'job': [job.status, job.sent_count, job.failed_count],
+                              'items': [[item.status, bool(item.provider_sid), item.result] for item in items]}))
+    ''', OUTBOUND_DEFAULT_MPS='0')
+
+    assert report['job'] == ['completed', 2, 0]
+    for status, has_sid, result in report['items']:
+        assert (status, has_sid) == ('sent', True)
+        assert 'could not be saved' in result
+
+
+def test_claims_are_shared_between_jobs(run_app_script):
+    report = run_app_script(JOB_SETUP, '''
+        with app.app_context():
+            user = make_user()
+            big_job = make_job(user, 100, '+1415555')
+            small_job = make_job(user, 3, '+1415556')
+            items = A.claim_bulk_send_items(10)
+            print(json.dumps({'big': sum(item.job_id == big_job for item in items),
+                              'small': sum(item.job_id == small_job for item in items)}))
+    ''')
+    assert report == {'big': 5, 'small': 3}
+
+
+def test_preview_rejects_a_malformed_limit(run_app_script):
+    report = run_app_script('''
+        with app.app_context():
+            user_id = make_user().id
+        client = logged_in_client(user_id)
+        responses = [client.post('/api/preview_bulk_sms', json={'sheet_id': 'sheet', 'limit': limit}) for limit in ('abc', [3], {'rows': 3})]
+        print(json.dumps([[response.status_code, response.get_json()] for response in responses]))
+    ''')
+    assert report == [[400, {'error': 'Invalid preview limit.'}]] * 3
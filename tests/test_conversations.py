@@ -0,0 +1,102 @@
+# Conversation reads and the read marker
+
+
+def test_mark_read_keeps_messages_newer_than_the_marker_unread(run_app_script):
+    # A message stored while the request runs can carry a timestamp after the new last_read_timestamp;
+    # it must stay counted instead of being wiped by unread_count = 0
+    report = run_app_script('''
+        with app.app_context():
+            user = make_user()
+            conversation = make_conversation(user, '+14155550000')
+            now = datetime.utcnow()
+            conversation.last_read_timestamp = now - timedelta(minutes=10)
+            A.insert_messages([
+                {'conversation_id': conversation.id, 'sender': 'contact', 'body': 'old', 'timestamp': now - timedelta(minutes=1)},
+                {'conversation_id': conversation.id, 'sender': 'contact', 'body': 'late', 'timestamp': now + timedelta(minutes=1)},
+            ])
+            db.session.commit()
+            user_id, conversation_id = user.id, conversation.id
+            before = db.session.get(A.Conversation, conversation_id).unread_count
+
+        response = logged_in_client(user_id).post(f'/api/conversations/{conversation_id}/mark_read')
+        with app.app_context():
+            after = db.session.get(A.Conversation, conversation_id)
+            print(json.dumps({'status': response.status_code, 'before': before, 'after': after.unread_count,
+                              'marked': after.last_read_timestamp is not None}))
+    ''')
+    assert report == {'status': 200, 'before': 2, 'after': 1, 'marked': True}
+
+
+ARCHIVED_CONVERSATION = '''
+    # Ten messages; the four oldest are archived into two segments that split a timestamp tie
+    # (days 1 and 1), and the hot messages start with another tie (days 3 and 3)
+    DAYS = [0, 1, 1, 2, 3, 3, 4, 5, 6, 7]
+    with app.app_context():
+        user = make_user()
+        conversation = make_conversation(user, '+14155550000')
+        start = datetime(2025, 1, 1)
+        A.insert_messages([{'conversation_id': conversation.id, 'sender': 'user', 'body': f'm{i}',
+                            'timestamp': start + timedelta(days=day)} for i, day in enumerate(DAYS)])
+        db.session.commit()
+        archived, segments = A.archive_messages(start + timedelta(days=3), segment_size=2)
+        db.session.commit()
+        user_id, conversation_id = user.id, conversation.id
+    client = logged_in_client(user_id)
+
+    def page(**params):
+        query = '&'.join(f'{name}={value}' for name, value in dict(limit=3, **params).items())
+        return client.get(f'/api/conversations/{conversation_id}/messages?{query}').get_json()
+'''
+
+
+def test_paging_back_and_forth_across_the_archive(run_app_script):
+    report = run_app_script(ARCHIVED_CONVERSATION, '''
+        backward, current = [], page()
+        while True:
+            backward[:0] = [message['body'] for message in current['messages']]
+            if not current['has_more_before']:
+                break
+            current = page(before=current['before_cursor'])
+        oldest_page = current
+
+        forward, current = [message['body'] for message in oldest_page['messages']], oldest_page
+        while True:
+            current = page(after=current['after_cursor'])
+            forward += [message['body'] for message in current['messages']]
+            if not current['has_more_after']:
+                break
+        print(json.dumps({'archived': [archived, segments], 'backward': backward, 'forward': forward}))
+    ''')
+    expected = [f'm{i}' for i in range(10)]
+    assert report['archived'] == [4, 2]
+    assert report['backward'] == expected
+    assert report['forward'] == expected
+
+
+def test_history_import_skips_messages_already_in_the_archive(run_app_script):
+    report = run_app_script('''
+        with app.app_context():
+            user = make_user()
+            conversation = make_conversation(user, '+14155550000')
+            start = datetime(2025, 1, 1)
+            A.insert_messages([
+                {'conversation_id': conversation.id, 'sender': 'contact', 'body': 'with sid', 'timestamp': start, 'provider_sid': 'SMold'},
+                {'conversation_id': conversation.id, 'sender': 'user', 'body': 'legacy', 'timestamp': start + timedelta(hours=1), 'provider_sid': None},
+                {'conversation_id': conversation.id, 'sender': 'user', 'body': 'newest', 'timestamp': start + timedelta(days=30), 'provider_sid': None},
+            ])
+            conversation.last_read_timestamp = start + timedelta(days=30)
+            db.session.commit()
+            A.archive_messages(start + timedelta(days=1))
+            db.session.commit()
+
+            imported = [
+                {'conversation_id': conversation.id, 'sender': 'contact', 'body': 'with sid', 'timestamp': start, 'provider_sid': 'SMold'},
+                {'conversation_id': conversation.id, 'sender': 'user', 'body': 'legacy', 'timestamp': start + timedelta(hours=1), 'provider_sid': 'SMlegacy'},
+                {'conversation_id': conversation.id, 'sender': 'user', 'body': 'missed', 'timestamp': start + timedelta(hours=2), 'provider_sid': 'SMmissed'},
+                {'conversation_id': conversation.id, 'sender': 'user', 'body': 'recent', 'timestamp': start + timedelta(days=31), 'provider_sid': 'SMrecent'},
+            ]
+            kept = A._drop_archived_duplicates(imported, [db.session.get(A.Conversation, conversation.id)])
+            print(json.dumps([row['body'] for row in kept]))
+    ''')
+    # Matched by SID, or by content for archived messages stored without one
+    assert report == ['missed', 'recent']
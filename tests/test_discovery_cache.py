@@ -0,0 +1,85 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# DiscoveryDocumentCache against a local server that counts requests: a burst of cold callers
+# shares one fetch, a stale entry is served while one background refresh runs, and a no-store
+# response is never cached.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CACHE_CONTROL = {
+    '/short': 'max-age=1, stale-while-revalidate=60',
+    '/no-store': 'no-store',
+}
+
+
+class DiscoveryHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests[self.path] = count = self.server.requests.get(self.path, 0) + 1
+        time.sleep(0.2) # Slow enough for the callers of a burst to overlap
+        body = json.dumps({'fetch': count}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', CACHE_CONTROL[self.path])
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+SCRIPT = textwrap.dedent('''
+    import json, sys, time
+    import eventlet
+    import app
+
+    base_url = sys.argv[1]
+    report = {}
+    pool = eventlet.GreenPool()
+
+    cache = app.DiscoveryDocumentCache(base_url + '/short', app.google_http_client)
+    report['cold'] = [document['fetch'] for document in pool.imap(lambda _: cache.get(), range(20))]
+
+    eventlet.sleep(1.2) # Past max-age, inside stale-while-revalidate
+    start = time.monotonic()
+    report['stale'] = [document['fetch'] for document in pool.imap(lambda _: cache.get(), range(20))]
+    report['stale_seconds'] = time.monotonic() - start
+    eventlet.sleep(0.5) # Let the background refresh finish
+    report['refreshed'] = cache.get()['fetch']
+
+    cache = app.DiscoveryDocumentCache(base_url + '/no-store', app.google_http_client)
+    report['no_store'] = [cache.get()['fetch'] for _ in range(3)]
+    print(json.dumps(report))
+''')
+
+
+def test_discovery_cache_fetches_once_per_burst_and_refresh(tmp_path):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), DiscoveryHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{tmp_path / "discovery.db"}', SECRET_KEY='discovery-test-secret')
+    try:
+        result = subprocess.run([sys.executable, '-c', SCRIPT, f'http://127.0.0.1:{server.server_address[1]}'],
+                                cwd=REPO_ROOT, env=env, capture_output=True, text=True, timeout=60)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+
+    assert report['cold'] == [1] * 20 # Twenty cold callers, one request
+    assert report['stale'] == [1] * 20 # Stale copy served without waiting for the server
+    assert report['stale_seconds'] < 0.2
+    assert report['refreshed'] == 2 # Exactly one background refresh
+    assert report['no_store'] == [1, 2, 3] # Every caller fetches its own copy
+    assert server.requests == {'/short': 2, '/no-store': 3}
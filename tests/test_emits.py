@@ -0,0 +1,80 @@
+# Emit coalescing of real-time updates: conversation summaries are read once per user and window
+
+EMIT_SETUP = '''
+    from sqlalchemy import event as sqlalchemy_event
+
+    emitted = [] # (event name, payload, room)
+    A.socketio.emit = lambda event_name, payload, room=None: emitted.append((event_name, payload, room))
+    summary_selects = []
+
+    with app.app_context():
+        @sqlalchemy_event.listens_for(db.engine, 'before_cursor_execute')
+        def count_summary_selects(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT') and 'LEFT OUTER JOIN contact' in statement:
+                summary_selects.append(statement)
+
+    def inbound(client, conversation_phone, sid, body='hello'):
+        return client.post('/twilio_webhook', data={'MessageSid': sid, 'From': conversation_phone,
+                                                    'To': '+15005550006', 'Body': body})
+'''
+
+
+def test_inbound_burst_reads_summaries_once_per_window(run_app_script):
+    report = run_app_script(EMIT_SETUP, '''
+        with app.app_context():
+            user = make_user()
+            user_id = user.id
+            phones = [f'+1415555000{i}' for i in range(3)]
+            for phone in phones:
+                make_conversation(user, phone)
+
+        client = app.test_client()
+        for i in range(12):
+            assert inbound(client, phones[i % 3], f'SMburst{i}').status_code == 200
+        during_requests = len(summary_selects)
+        eventlet.sleep(0.4) # Past the emit window
+        updates = [payload for name, payload, room in emitted if name == 'conversation_update']
+        print(json.dumps({'during_requests': during_requests, 'after_flush': len(summary_selects),
+                          'updates': updates, 'user_id': user_id, 'stats': A.socketio_emits.stats}))
+    ''')
+
+    assert report['during_requests'] == 0
+    assert report['after_flush'] == 1
+    [update] = report['updates']
+    assert update['user_id'] == report['user_id']
+    assert sorted(summary['unread_count'] for summary in update['conversations']) == [4, 4, 4]
+    assert report['stats']['summary_queries'] == 1
+
+
+def test_failed_summary_query_falls_back_to_refresh(run_app_script):
+    report = run_app_script(EMIT_SETUP, '''
+        def broken(user_id, conversation_ids):
+            raise RuntimeError('database unavailable')
+        A.conversation_summaries = broken
+
+        with app.app_context():
+            user = make_user()
+            make_conversation(user, '+14155550000')
+        inbound(app.test_client(), '+14155550000', 'SMbroken')
+        eventlet.sleep(0.4)
+        print(json.dumps([payload for name, payload, room in emitted if name == 'conversation_update']))
+    ''')
+    assert [update.get('refresh') for update in report] == [True]
+
+
+def test_webhook_replies_before_summaries_are_read_without_a_window(run_app_script):
+    report = run_app_script(EMIT_SETUP, '''
+        with app.app_context():
+            user = make_user()
+            make_conversation(user, '+14155550000')
+        response = inbound(app.test_client(), '+14155550000', 'SMnowindow')
+        during_request = len(summary_selects)
+        eventlet.sleep(0.1)
+        print(json.dumps({'status': response.status_code, 'during_request': during_request, 'after': len(summary_selects),
+                          'updates': [payload for name, payload, room in emitted if name == 'conversation_update']}))
+    ''', SOCKETIO_EMIT_WINDOW_MS='0')
+
+    assert report['status'] == 200
+    assert report['during_request'] == 0
+    assert report['after'] == 1
+    assert [update['conversations'][0]['unread_count'] for update in report['updates']] == [1]
@@ -0,0 +1,24 @@
+# Message export: hot and archived messages merged into one ordered stream
+
+
+def test_export_merges_archive_and_keeps_null_timestamps_last(run_app_script):
+    report = run_app_script('''
+        with app.app_context():
+            user = make_user()
+            conversation = make_conversation(user, '+14155550000')
+            start = datetime(2025, 1, 1)
+            A.insert_messages([{'conversation_id': conversation.id, 'sender': 'user', 'body': f'm{i}',
+                                'timestamp': start + timedelta(days=i)} for i in range(6)])
+            # A message without a timestamp, as rows from before the column had a default may be
+            db.session.execute(A.Message.__table__.insert().values(conversation_id=conversation.id, sender='user', body='undated', timestamp=None))
+            db.session.commit()
+            archived, segments = A.archive_messages(start + timedelta(days=3), segment_size=2)
+            db.session.commit()
+            user_id = user.id
+
+        response = logged_in_client(user_id).get('/api/export/messages?format=ndjson')
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        print(json.dumps({'archived': archived, 'segments': segments, 'bodies': [row['body'] for row in rows]}))
+    ''')
+    assert (report['archived'], report['segments']) == (3, 2)
+    assert report['bodies'] == ['m0', 'm1', 'm2', 'm3', 'm4', 'm5', 'undated']
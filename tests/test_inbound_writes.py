@@ -0,0 +1,80 @@
+# Group-commit write-behind for inbound webhook messages (WEBHOOK_WRITE_MODE=group/ack)
+
+WEBHOOK_SETUP = '''
+    with app.app_context():
+        user = make_user()
+        conversation_id = make_conversation(user, '+14155550000').id
+
+    def inbound(sid, body='hello'):
+        response = app.test_client().post('/twilio_webhook', data={'MessageSid': sid, 'From': '+14155550000',
+                                                                   'To': '+15005550006', 'Body': body})
+        return 'error occurred' not in response.get_data(as_text=True)
+
+    def stored_bodies():
+        with app.app_context():
+            return sorted(message.body for message in A.Message.query.filter_by(conversation_id=conversation_id))
+
+    def burst(deliveries):
+        # Concurrent webhook requests, so they land in the same flush batch
+        return list(eventlet.GreenPool().starmap(inbound, deliveries))
+'''
+
+
+def test_duplicate_sid_within_one_batch_is_stored_once(run_app_script):
+    report = run_app_script(WEBHOOK_SETUP, '''
+        replies = burst([('SMdup', 'first'), ('SMdup', 'first'), ('SMother', 'second')])
+        stats = A.inbound_writes.stats()
+        print(json.dumps({'replies': replies, 'bodies': stored_bodies(),
+                          'batches': stats['batches'], 'duplicates': stats['duplicates']}))
+    ''', WEBHOOK_WRITE_MODE='group', WEBHOOK_FLUSH_MS='50')
+    assert report == {'replies': [True, True, True], 'bodies': ['first', 'second'], 'batches': 1, 'duplicates': 1}
+
+
+def test_failing_row_does_not_fail_its_batch(run_app_script):
+    report = run_app_script(WEBHOOK_SETUP, '''
+        insert_messages = A.insert_messages
+        def failing_insert(rows):
+            if any(row['body'] == 'bad' for row in rows):
+                raise RuntimeError('constraint violated')
+            return insert_messages(rows)
+        A.insert_messages = failing_insert
+
+        replies = burst([(f'SMok{i}', f'ok{i}') for i in range(4)] + [('SMbad', 'bad')])
+        stats = A.inbound_writes.stats()
+        print(json.dumps({'replies': replies, 'bodies': stored_bodies(), 'failed_batches': stats['failed_batches'],
+                          'failed_messages': stats['failed_messages'], 'messages': stats['messages']}))
+    ''', WEBHOOK_WRITE_MODE='group', WEBHOOK_FLUSH_MS='50')
+    assert report['replies'] == [True, True, True, True, False] # Only the bad message gets the error TwiML
+    assert report['bodies'] == ['ok0', 'ok1', 'ok2', 'ok3']
+    assert (report['failed_batches'], report['failed_messages'], report['messages']) == (1, 1, 4)
+
+
+def test_group_mode_replies_once_committed_and_ack_mode_replies_first(run_app_script):
+    script = '''
+        start = time.monotonic()
+        replied = inbound('SMmode')
+        elapsed = time.monotonic() - start
+        at_reply = stored_bodies()
+        eventlet.sleep(0.5)
+        print(json.dumps({'replied': replied, 'elapsed': elapsed, 'at_reply': at_reply, 'later': stored_bodies()}))
+    '''
+    group = run_app_script(WEBHOOK_SETUP, script, WEBHOOK_WRITE_MODE='group', WEBHOOK_FLUSH_MS='200')
+    assert group['replied'] and group['elapsed'] >= 0.2 # Waited for the flush window
+    assert group['at_reply'] == group['later'] == ['hello']
+
+    ack = run_app_script(WEBHOOK_SETUP, script, WEBHOOK_WRITE_MODE='ack', WEBHOOK_FLUSH_MS='200')
+    assert ack['replied'] and ack['elapsed'] < 0.2
+    assert ack['at_reply'] == [] # Written with the next batch
+    assert ack['later'] == ['hello']
+
+
+def test_full_batch_flushes_without_waiting_for_the_window(run_app_script):
+    report = run_app_script(WEBHOOK_SETUP, '''
+        start = time.monotonic()
+        replies = burst([(f'SMfull{i}', f'm{i}') for i in range(3)])
+        print(json.dumps({'replies': replies, 'elapsed': time.monotonic() - start,
+                          'batch_size': A.inbound_writes.stats()['batch_size']['max']}))
+    ''', WEBHOOK_WRITE_MODE='group', WEBHOOK_FLUSH_MS='5000', WEBHOOK_FLUSH_MAX_BATCH='3')
+    assert report['replies'] == [True, True, True]
+    assert report['elapsed'] < 2
+    assert report['batch_size'] == 3
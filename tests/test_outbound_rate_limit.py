@@ -0,0 +1,51 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+# Two processes sending from one number must share its rate: two RedisTokenBuckets on separate
+# connections to one (fake) Redis stand in for them. Runs in a subprocess because importing app
+# monkey patches the interpreter.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = textwrap.dedent('''
+    import json, time
+    import fakeredis, redis
+    import app
+
+    server = fakeredis.FakeServer()
+    web = app.RedisTokenBucket(fakeredis.FakeRedis(server=server), 'test:+15005550006', 10, 1)
+    worker = app.RedisTokenBucket(fakeredis.FakeRedis(server=server), 'test:+15005550006', 10, 1)
+    start = time.monotonic()
+    for _ in range(5):
+        web.acquire()
+        worker.acquire()
+    shared = time.monotonic() - start
+
+    web.pause(0.5) # A 429 seen by one process holds back the other too
+    start = time.monotonic()
+    worker.acquire()
+    paused = time.monotonic() - start
+
+    unreachable = app.RedisTokenBucket(redis.Redis(host='127.0.0.1', port=1), 'test:down', 10, 1)
+    start = time.monotonic()
+    for _ in range(3):
+        unreachable.acquire()
+    fallback = time.monotonic() - start
+    print(json.dumps({'shared': shared, 'paused': paused, 'fallback': fallback}))
+''')
+
+
+def test_buckets_share_one_rate_through_redis(tmp_path):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{tmp_path / "rate.db"}', SECRET_KEY='rate-test-secret')
+    result = subprocess.run([sys.executable, '-c', SCRIPT], cwd=REPO_ROOT, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    # 10 sends at 10/s with a burst of 1: ~0.9s when shared, ~0.4s if each bucket had its own rate
+    assert timings['shared'] >= 0.8
+    assert timings['paused'] >= 0.5
+    # Without Redis the bucket still limits this process on its own
+    assert 0.15 <= timings['fallback'] < 1
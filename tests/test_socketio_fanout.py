@@ -0,0 +1,151 @@
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+import socketio
+
+# Two app processes sharing one message queue: a browser-like client connected to the web process
+# must receive an emit made by another process (a second web worker or the bulk send worker).
+# A minimal in-memory stand-in for Redis pub/sub serves as the queue.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    # Speaks just enough RESP for redis-py's publish and pubsub: SUBSCRIBE, PUBLISH, PING, and +OK for the rest
+    def handle(self):
+        while True:
+            command = self._read_command()
+            if command is None:
+                return
+            name = command[0].upper()
+            if name == b'SUBSCRIBE':
+                for channel in command[1:]:
+                    with self.server.lock:
+                        self.server.subscribers.setdefault(channel, []).append(self)
+                    self._write(b'*3\r\n' + _bulk(b'subscribe') + _bulk(channel) + b':1\r\n')
+            elif name == b'PUBLISH':
+                channel, payload = command[1], command[2]
+                with self.server.lock:
+                    subscribers = list(self.server.subscribers.get(channel, []))
+                for subscriber in subscribers:
+                    subscriber._write(b'*3\r\n' + _bulk(b'message') + _bulk(channel) + _bulk(payload))
+                self._write(f':{len(subscribers)}\r\n'.encode())
+            elif name == b'PING':
+                self._write(b'+PONG\r\n')
+            else:
+                self._write(b'+OK\r\n')
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        parts = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            parts.append(self.rfile.read(length + 2)[:-2])
+        return parts
+
+    def _write(self, data):
+        with self.server.lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+
+def _bulk(value):
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+class FakeRedis(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeRedisHandler)
+        self.lock = threading.RLock()
+        self.subscribers = {}
+
+    @property
+    def url(self):
+        return f'redis://127.0.0.1:{self.server_address[1]}/0'
+
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def _wait_for_port(port, process, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'app process exited with {process.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f'app did not listen on {port}')
+
+
+@pytest.fixture
+def queue_env(tmp_path):
+    fake_redis = FakeRedis()
+    threading.Thread(target=fake_redis.serve_forever, daemon=True).start()
+    env = dict(os.environ,
+               DATABASE_URL=f'sqlite:///{tmp_path / "fanout.db"}',
+               SOCKETIO_MESSAGE_QUEUE=fake_redis.url,
+               SOCKETIO_CHANNEL='fanout-test',
+               SECRET_KEY='fanout-test-secret')
+    yield env
+    fake_redis.shutdown()
+    fake_redis.server_close()
+
+
+def test_emit_from_one_process_reaches_client_on_another(queue_env):
+    port = _free_port()
+    web = subprocess.Popen(
+        [sys.executable, '-c', f"import app; app.socketio.run(app.app, host='127.0.0.1', port={port}, log_output=False)"],
+        cwd=REPO_ROOT, env=queue_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    client = socketio.Client()
+    received = threading.Event()
+    payloads = []
+
+    @client.on('new_messages')
+    def on_new_messages(data):
+        payloads.append(data)
+        received.set()
+
+    try:
+        _wait_for_port(port, web)
+        client.connect(f'http://127.0.0.1:{port}', transports=['polling'])
+        client.emit('join', {'room': '42'})
+        time.sleep(0.5) # Let the web process handle the join
+
+        # A separate process (like worker.py) emits to the room; only the queue connects it to the client
+        subprocess.run(
+            [sys.executable, '-c',
+             "import app, eventlet; app.socketio.emit('new_messages', [{'conversation_id': 42, 'body': 'from another process'}], room='42'); eventlet.sleep(0.2)"],
+            cwd=REPO_ROOT, env=queue_env, check=True, timeout=60, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        assert received.wait(10), 'emit from the other process never reached the client'
+        assert payloads == [[{'conversation_id': 42, 'body': 'from another process'}]]
+    finally:
+        client.disconnect()
+        web.terminate()
+        web.wait(10)
+
+
+def test_several_workers_require_secret_key(queue_env):
+    env = dict(queue_env, WEB_CONCURRENCY='2')
+    env.pop('SECRET_KEY')
+    result = subprocess.run([sys.executable, '-c', 'import app'], cwd=REPO_ROOT, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode != 0
+    assert 'SECRET_KEY must be set' in result.stderr
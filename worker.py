@@ -0,0 +1,4 @@
+from app import app, run_bulk_send_worker
+
+with app.app_context():
+    run_bulk_send_worker()